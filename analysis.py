@@ -1,4 +1,9 @@
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+from itertools import islice
 
 
 class LanguageCode(Enum):
@@ -57,6 +62,9 @@ ENGLISH_NUMBER_CODES = list(range(48, 48 + 10))
 SPACE_CODE = 32
 
 
+ANALYZE_CHUNK_SIZE = 64
+
+
 VALID_CHARACTER_CODES = PERSIAN_ALPHABET_CODES + \
     PERSIAN_NUMBER_CODES + \
     ENGLISH_ALPHABET_CODES + \
@@ -136,10 +144,87 @@ def normalize_whitespace(string):
         return chr(SPACE_CODE).join(string.strip().split())
 
 
-def analyze(text):
+def _analyze_multi_pass(text):
     text = remove_inside_brackets(text)
     text = normalize_characters(text)
     text = add_whitespace_on_language_transition(text)
     text = replace_invalid_characters_with_whitespace(text)
     text = normalize_whitespace(text)
     return text
+
+
+# single-pass engine: every replacement in CHARACTER_REPLACE_DICT yields a
+# valid character, a space or nothing, so after one translate() the output
+# of analyze() is just the runs of persian letters, english letters and
+# digits (a language transition splits a run, anything else separates runs)
+_TRANSLATE_TABLE = str.maketrans(CHARACTER_REPLACE_DICT)
+_BRACKET_PATTERN = re.compile(r'([\[\]])')
+
+
+def _character_class(codes):
+    return ''.join(re.escape(chr(code)) for code in sorted(codes))
+
+
+TOKEN_PATTERN = re.compile('[%s]+|[%s]+|[%s]+' % (
+    _character_class(PERSIAN_ALPHABET_CODES),
+    _character_class(ENGLISH_ALPHABET_CODES),
+    _character_class(ENGLISH_NUMBER_CODES),
+))
+
+
+def _remove_inside_brackets_fast(text):
+    if '[' not in text and ']' not in text:
+        return text
+    inside_bracket = 0
+    kept_parts = []
+    for part in _BRACKET_PATTERN.split(text):
+        if part == '[':
+            inside_bracket += 1
+        elif part == ']':
+            inside_bracket -= 1
+        elif not inside_bracket:
+            kept_parts.append(part)
+    return ''.join(kept_parts)
+
+
+def analyze(text):
+    text = _remove_inside_brackets_fast(text).translate(_TRANSLATE_TABLE)
+    return chr(SPACE_CODE).join(TOKEN_PATTERN.findall(text))
+
+
+def _analyze_chunk(texts):
+    return [analyze(text) for text in texts]
+
+
+def analyze_many(texts, workers=None, chunk_size=ANALYZE_CHUNK_SIZE):
+    """
+    analyze texts on a process pool, yielding results in input order; at
+    most two chunks per worker are in flight so memory stays bounded
+    """
+    if workers is not None and workers < 1:
+        raise ValueError('workers must be at least 1, not %d' % workers)
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be at least 1, not %d' % chunk_size)
+    return _analyze_many(iter(texts), workers or os.cpu_count() or 1,
+                         chunk_size)
+
+
+def _analyze_many(texts, workers, chunk_size):
+    if workers == 1:
+        for text in texts:
+            yield analyze(text)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        max_in_flight = 2 * workers
+        in_flight = deque()
+        while True:
+            while len(in_flight) < max_in_flight:
+                chunk = list(islice(texts, chunk_size))
+                if not chunk:
+                    break
+                in_flight.append(executor.submit(_analyze_chunk, chunk))
+            if not in_flight:
+                break
+            for analyzed_text in in_flight.popleft().result():
+                yield analyzed_text
@@ -0,0 +1,808 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Thread
+from time import perf_counter, sleep
+
+from settings import BASE_DIR, DEFAULT_PAGES_DIR
+
+
+FIXTURE_PAGES_DIR = os.path.join(BASE_DIR, 'tests', 'fixtures', 'pages')
+FIXTURE_HTML_DIR = os.path.join(BASE_DIR, 'tests', 'fixtures', 'html')
+
+
+# modules each cli.py command imports when it is dispatched
+STARTUP_COMMAND_MODULES = {
+    'crawl': ['crawler'],
+    'convert': ['page_store'],
+    'index': ['index'],
+    'cluster': ['cluster'],
+    'search': ['search'],
+    'serve': ['service'],
+}
+HEAVY_PACKAGES = ['bs4', 'elasticsearch', 'lxml', 'numpy', 'scipy',
+                  'sklearn', 'urllib3']
+
+
+def _timed(function, *args, **kwargs):
+    start = perf_counter()
+    result = function(*args, **kwargs)
+    return result, perf_counter() - start
+
+
+def _read_page_texts(pages_dir):
+    from page_store import open_page_store
+
+    texts = []
+    page_store = open_page_store(pages_dir)
+    for document_json in page_store:
+        texts.append(document_json['title'])
+        texts.append(document_json['introduction'])
+        texts.append(' '.join(document_json['content']))
+    page_store.close()
+    return texts
+
+
+def _get_synthetic_texts(count, length):
+    from analysis import CHARACTER_REPLACE_DICT, VALID_CHARACTER_CODES
+
+    alphabet = [chr(code) for code in VALID_CHARACTER_CODES] + \
+        list(CHARACTER_REPLACE_DICT) + list(' \n[].,()') * 8
+    generator = random.Random(0)
+    return [''.join(generator.choice(alphabet) for _ in range(length))
+            for _ in range(count)]
+
+
+def _generate_topic_texts(count, num_topics, length=200):
+    """
+    texts drawn from `num_topics` disjoint vocabularies, so they cluster
+    """
+    generator = random.Random(0)
+    vocabularies = [['topic%dword%d' % (topic, word) for word in range(50)]
+                    for topic in range(num_topics)]
+    for i in range(count):
+        yield ' '.join(generator.choice(vocabularies[i % num_topics])
+                       for _ in range(length))
+
+
+def _get_topic_texts(count, num_topics, length=200):
+    return list(_generate_topic_texts(count, num_topics, length))
+
+
+def benchmark_analysis(args):
+    from analysis import analyze, _analyze_multi_pass
+
+    texts = _read_page_texts(args.json_directory)
+    if not texts:
+        print('no pages in %s, using the pages in %s' % (
+            args.json_directory, FIXTURE_PAGES_DIR))
+        texts = _read_page_texts(FIXTURE_PAGES_DIR)
+    num_chars = sum(len(text) for text in texts)
+
+    mismatches = [text for text in texts
+                  if analyze(text) != _analyze_multi_pass(text)]
+    print('texts = %d;' % len(texts), 'chars = %d;' % num_chars,
+          'mismatches = %d;' % len(mismatches))
+
+    for name, function in [('multi-pass', _analyze_multi_pass),
+                           ('single-pass', analyze)]:
+        best_time = min(_timed(lambda: [function(t) for t in texts])[1]
+                        for _ in range(args.repeat))
+        print('%s: %.0f chars/sec' % (name, num_chars / best_time))
+
+    if mismatches:
+        sys.exit(1)
+
+
+def benchmark_extraction(args):
+    from crawler import Page
+    from extraction import EXTRACTORS
+
+    fixtures = []
+    for file_name in sorted(os.listdir(args.html_directory)):
+        if file_name.endswith('.html'):
+            with open(os.path.join(args.html_directory, file_name),
+                      'rb') as html_file:
+                link = 'https://fa.wikipedia.org/wiki/' + file_name[:-5]
+                fixtures.append((link, html_file.read()))
+    num_bytes = sum(len(page_source) for _, page_source in fixtures)
+    print('pages = %d;' % len(fixtures), 'bytes = %d;' % num_bytes)
+    if not fixtures:
+        return
+
+    expected_pages = None
+    for extractor in sorted(EXTRACTORS):
+        try:
+            pages, seconds = _timed(lambda: [
+                Page(link, page_source, extractor).json()
+                for link, page_source in fixtures
+            ])
+        except ImportError as e:
+            print('%s: skipped (%s)' % (extractor, e))
+            continue
+        expected_pages = expected_pages or pages
+        mismatches = sum(page != expected_page for page, expected_page
+                         in zip(pages, expected_pages))
+        print('%s: %.1f pages/sec; %.2f MB/sec; mismatches = %d;' %
+              (extractor, len(fixtures) / seconds,
+               num_bytes / seconds / 1000000, mismatches))
+
+
+def check_analysis_parity(args):
+    from analysis import analyze
+    from index import PERSIAN_ANALYZER, get_analysis_settings
+    from settings import ES, INDEX_NAME
+
+    texts = _read_page_texts(args.json_directory) or \
+        _read_page_texts(FIXTURE_PAGES_DIR)
+    parity_index = INDEX_NAME + '_parity'
+    ES.indices.create(index=parity_index, body={
+        'settings': {'analysis': get_analysis_settings()},
+    })
+    mismatches = 0
+    try:
+        for text in texts:
+            tokens = [token['token'] for token in ES.indices.analyze(
+                index=parity_index,
+                body={'analyzer': PERSIAN_ANALYZER, 'text': text},
+            )['tokens']]
+            expected_tokens = analyze(text).lower().split()
+            if tokens != expected_tokens:
+                mismatches += 1
+                if mismatches <= args.show:
+                    print('text:', text[:200])
+                    print('python:', ' '.join(expected_tokens)[:200])
+                    print('elasticsearch:', ' '.join(tokens)[:200])
+                    print()
+    finally:
+        ES.indices.delete(index=parity_index)
+    print('texts = %d;' % len(texts), 'mismatches = %d;' % mismatches)
+    if mismatches:
+        sys.exit(1)
+
+
+def compare_mapping_profiles(args):
+    from bulk_ingest import bulk_ingest, ingest_settings
+    from documents import read_documents
+    from index import MAPPING_PROFILES, _configure_index, \
+        _get_insert_actions, _initialize_index
+    from settings import ES, INDEX_NAME
+
+    for mapping_profile in sorted(MAPPING_PROFILES):
+        server_side_analysis = mapping_profile == 'lean'
+        index_name = '%s_%s' % (INDEX_NAME, mapping_profile)
+        actions = list(_get_insert_actions(read_documents(
+            args.json_directory), None, server_side_analysis))
+        for action in actions:
+            action['_index'] = index_name
+
+        _initialize_index(index_name)
+        try:
+            _configure_index(server_side_analysis, mapping_profile,
+                             index_name)
+            with ingest_settings(ES, index_name):
+                (num_actions, num_bytes), seconds = _timed(
+                    bulk_ingest, ES, actions)
+            store_size = ES.indices.stats(index=index_name)['indices'][
+                index_name]['primaries']['store']['size_in_bytes']
+        finally:
+            ES.indices.delete(index=index_name)
+        print('%s: docs = %d; request MB = %.2f; ingest seconds = %.2f; '
+              'index MB = %.2f;' % (mapping_profile, num_actions,
+                                    num_bytes / 1000000, seconds,
+                                    store_size / 1000000))
+
+
+class _BulkStandInHandler(BaseHTTPRequestHandler):
+    """
+    stand-in for the elasticsearch _bulk endpoint: waits `latency` seconds
+    per request and rejects each action with 429 at `rejection_rate`
+    """
+    protocol_version = 'HTTP/1.1'
+    latency = 0
+    rejection_rate = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        items = []
+        for line in body.decode().splitlines()[::2]:
+            op_type = next(iter(json.loads(line)))
+            status = 429 if random.random() < self.rejection_rate else 201
+            items.append({op_type: {'status': status}})
+        sleep(self.latency)
+        response = json.dumps({'errors': any(
+            item[next(iter(item))]['status'] != 201 for item in items),
+            'items': items}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer is python 3.7+
+    daemon_threads = True
+
+
+def benchmark_bulk(args):
+    from elasticsearch import Elasticsearch
+
+    from bulk_ingest import bulk_ingest
+
+    _BulkStandInHandler.latency = args.latency
+    _BulkStandInHandler.rejection_rate = args.rejection_rate
+    server = _ThreadingHTTPServer(('127.0.0.1', 0), _BulkStandInHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    client = Elasticsearch(hosts=[{'host': '127.0.0.1',
+                                   'port': server.server_port}],
+                           maxsize=max(args.workers))
+
+    texts = _get_synthetic_texts(args.num_documents, 2000)
+    actions = [{'_index': 'benchmark', '_type': 'wiki',
+                '_source': {'content': text}} for text in texts]
+    for workers in args.workers:
+        (num_actions, num_bytes), seconds = _timed(
+            bulk_ingest, client, actions, workers, args.chunk_size,
+            max_retries=10, initial_backoff=0.01)
+        print('workers = %d: %.1f docs/sec; %.2f MB/sec' %
+              (workers, num_actions / seconds, num_bytes / seconds / 1000000))
+    server.shutdown()
+
+
+def _get_latency_summary(latencies):
+    latencies = sorted(latencies)
+    return 'mean = %.2f ms; p50 = %.2f ms; p95 = %.2f ms;' % (
+        sum(latencies) / len(latencies) * 1000,
+        latencies[len(latencies) // 2] * 1000,
+        latencies[int(len(latencies) * 0.95)] * 1000)
+
+
+def compare_search_backends(args):
+    from elasticsearch import ConnectionError
+
+    from local_search import LocalIndex
+    from search import get_search_body
+    from settings import ES, INDEX_NAME
+
+    local_index = LocalIndex(args.local_index_directory)
+    if args.queries:
+        with open(args.queries, 'r') as queries_file:
+            queries = [line.strip() for line in queries_file if line.strip()]
+    else:
+        titles = [document['title'] for document in local_index.documents]
+        queries = random.Random(0).sample(titles,
+                                          min(args.num_queries, len(titles)))
+    print('queries = %d;' % len(queries))
+    if not queries:
+        return
+
+    local_latencies = []
+    local_ids = []
+    for query in queries:
+        hits, seconds = _timed(local_index.search, query, 1, 1, 1, -1,
+                               args.size)
+        local_latencies.append(seconds)
+        local_ids.append([hit['_id'] for hit in hits])
+    print('local:', _get_latency_summary(local_latencies))
+
+    es_latencies = []
+    overlap = 0
+    try:
+        for query, ids in zip(queries, local_ids):
+            response, seconds = _timed(ES.search, index=INDEX_NAME,
+                                       body=get_search_body(
+                                           query, 1, 1, 1, -1, args.size))
+            es_latencies.append(seconds)
+            es_ids = [hit['_id'] for hit in response['hits']['hits']]
+            overlap += len(set(ids) & set(es_ids)) / (len(es_ids) or 1)
+    except ConnectionError:
+        print('elasticsearch: skipped (not reachable)')
+        return
+    print('elasticsearch:', _get_latency_summary(es_latencies),
+          'top %d overlap = %.3f;' % (args.size, overlap / len(queries)))
+
+
+def _measure_startup(modules):
+    """
+    import cli and `modules` in a fresh interpreter with -X importtime;
+    returns (wall seconds, import microseconds, heavy packages imported).
+    python 3.6 has no -X importtime, so there the wall time stands in for
+    the import time
+    """
+    (process, seconds) = _timed(subprocess.run, [
+        sys.executable, '-X', 'importtime', '-c',
+        'import sys, %s; print(" ".join(sys.modules))' %
+        ', '.join(['cli'] + modules)
+    ], cwd=BASE_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    import_microseconds = None
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):  # top level import
+            import_microseconds = (import_microseconds or 0) + \
+                int(cumulative)
+    if import_microseconds is None:
+        import_microseconds = int(seconds * 1000000)
+    packages = set(module.split('.')[0]
+                   for module in process.stdout.split())
+    return seconds, import_microseconds, sorted(
+        packages.intersection(HEAVY_PACKAGES))
+
+
+def benchmark_startup(args):
+    baseline = {}
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.loads(baseline_file.read())
+
+    results = {}
+    regressions = []
+    for command in [None] + sorted(STARTUP_COMMAND_MODULES):
+        modules = STARTUP_COMMAND_MODULES.get(command, [])
+        measurements = [_measure_startup(modules)
+                        for _ in range(args.repeat)]
+        seconds = min(measurement[0] for measurement in measurements)
+        import_microseconds = min(measurement[1]
+                                  for measurement in measurements)
+        name = command or '(parse only)'
+        results[name] = import_microseconds
+        message = '%s: wall = %.1f ms; imports = %.1f ms; heavy = %s;' % (
+            name, seconds * 1000, import_microseconds / 1000,
+            ', '.join(measurements[0][2]) or '-')
+        if name in baseline:
+            change = import_microseconds / baseline[name] - 1
+            message += ' vs baseline = %+.0f%%;' % (change * 100)
+            if change > args.tolerance:
+                message += ' REGRESSION'
+                regressions.append(name)
+        print(message)
+
+    if args.baseline and (args.save or not baseline):
+        with open(args.baseline, 'w') as baseline_file:
+            baseline_file.write(json.dumps(results, indent=2, sort_keys=True))
+        print('baseline saved to %s' % args.baseline)
+    if regressions:
+        sys.exit(1)
+
+
+class _CountStandIn():
+    """
+    stand-in for the elasticsearch count api that evaluates the bool queries
+    of cluster._get_mutual_information over documents held in memory
+    """
+
+    def __init__(self, document_features, labels):
+        self.num_calls = 0
+        self.all_documents = set(range(len(labels)))
+        self.feature_documents = {}
+        for document, features in enumerate(document_features):
+            for feature in features:
+                self.feature_documents.setdefault(feature, set()).add(
+                    document)
+        self.label_documents = {}
+        for document, label in enumerate(labels):
+            self.label_documents.setdefault(label, set()).add(document)
+
+    def _get_documents(self, clause):
+        if 'multi_match' in clause:
+            return self.feature_documents.get(
+                clause['multi_match']['query'], set())
+        return self.label_documents.get(clause['term']['cluster.id'], set())
+
+    def count(self, index, body):
+        self.num_calls += 1
+        query = body['query']['bool']
+        documents = set(self.all_documents)
+        for clause in query.get('must', []):
+            documents &= self._get_documents(clause)
+        for clause in query.get('must_not', []):
+            documents -= self._get_documents(clause)
+        return {'count': len(documents)}
+
+
+def benchmark_labels(args):
+    import numpy as np
+    from sklearn.cluster import KMeans
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    from analysis import analyze
+    from cluster import _get_contingency_counts, _get_mutual_information, \
+        _mutual_information
+
+    texts = [analyze(text) for text in _read_page_texts(args.json_directory)]
+    if not texts:
+        print('no pages in %s, using synthetic texts' % args.json_directory)
+        texts = [analyze(text) for text in _get_synthetic_texts(300, 3000)]
+    vectorizer = TfidfVectorizer(analyzer='word', min_df=0)
+    vectors = vectorizer.fit_transform(texts)
+    features = vectorizer.get_feature_names()
+    labels = KMeans(n_clusters=args.k, random_state=0).fit(vectors).labels_
+    print('documents = %d;' % len(texts), 'features = %d;' % len(features),
+          'k = %d;' % args.k)
+
+    mutual_information, seconds = _timed(
+        lambda: _mutual_information(*_get_contingency_counts(
+            vectors, labels, args.k)))
+    print('vectorized: %.3f sec' % seconds)
+
+    analyzer = vectorizer.build_analyzer()
+    client = _CountStandIn([set(analyzer(text)) for text in texts],
+                           labels.tolist())
+    sampled_features = random.Random(0).sample(
+        range(len(features)), min(args.num_features, len(features)))
+    max_difference = 0
+    start = perf_counter()
+    for feature_index in sampled_features:
+        for label_id in range(args.k):
+            value = _get_mutual_information(features[feature_index],
+                                            label_id, client)
+            max_difference = max(max_difference, abs(
+                value - mutual_information[label_id, feature_index]))
+    seconds = perf_counter() - start
+    print('count queries: %.3f sec for %d features (%d round trips, %d for '
+          'all features);' % (seconds, len(sampled_features),
+                              client.num_calls, 4 * args.k * len(features)),
+          'max difference = %g;' % max_difference)
+    if not np.isclose(max_difference, 0, atol=1e-9):
+        sys.exit(1)
+
+
+def benchmark_k_selection(args):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    from cluster import _get_k
+
+    texts = _get_topic_texts(args.num_documents, args.num_topics)
+    documents = {'vectors': TfidfVectorizer().fit_transform(texts)}
+    results = []
+    for strategy, estimator, workers in [('linear', 'kmeans', 1),
+                                         ('linear', 'kmeans', args.workers),
+                                         ('bracketed', 'kmeans', args.workers),
+                                         ('bracketed', 'minibatch',
+                                          args.workers)]:
+        (k, _), seconds = _timed(_get_k, args.max_k, documents, strategy,
+                                 estimator, workers, seed=0)
+        results.append('%s/%s with %d workers: k = %d; %.1f sec' % (
+            strategy, estimator, workers, k, seconds))
+    print()
+    print('topics = %d;' % args.num_topics)
+    print('\n'.join(results))
+
+
+def _get_matrix_bytes(matrix):
+    if hasattr(matrix, 'indptr'):  # sparse
+        return matrix.data.nbytes + matrix.indices.nbytes + \
+            matrix.indptr.nbytes
+    return matrix.nbytes
+
+
+def benchmark_reduction(args):
+    from sklearn.cluster import KMeans
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics import adjusted_rand_score
+
+    from analysis import analyze
+    from cluster import REDUCTIONS, _reduce_documents
+
+    texts = [analyze(text) for text in _read_page_texts(args.json_directory)]
+    if not texts:
+        print('no pages in %s, using synthetic texts' % args.json_directory)
+        texts = _get_topic_texts(2000, args.k)
+    baseline_labels = None
+    for reduction, min_df, max_df in [('none', 0, 1.0)] + [
+            (reduction, args.min_df, args.max_df)
+            for reduction in sorted(REDUCTIONS)]:
+        start = perf_counter()
+        documents = {'vectors': TfidfVectorizer(
+            min_df=min_df, max_df=max_df).fit_transform(texts)}
+        _reduce_documents(documents, reduction, args.components, seed=0)
+        reduce_seconds = perf_counter() - start
+        model, fit_seconds = _timed(KMeans(n_clusters=args.k,
+                                           random_state=0).fit,
+                                    documents['vectors'])
+        if baseline_labels is None:
+            baseline_labels = model.labels_
+        print('%s (df %s..%s): dimensions = %d; matrix MB = %.2f; '
+              'vectorize+reduce sec = %.2f; fit sec = %.2f; ARI = %.3f;' % (
+                  reduction, min_df, max_df, documents['vectors'].shape[1],
+                  _get_matrix_bytes(documents['vectors']) / 1000000,
+                  reduce_seconds, fit_seconds,
+                  adjusted_rand_score(baseline_labels, model.labels_)))
+
+
+def _get_topic_batches(num_documents, num_topics, batch_size):
+    texts = _generate_topic_texts(num_documents, num_topics)
+    for start in range(0, num_documents, batch_size):
+        ids = tuple(range(start, min(start + batch_size, num_documents)))
+        yield ids, tuple(next(texts) for _ in ids)
+
+
+def _cluster_for_memory(streaming, num_documents, k, batch_size,
+                        num_features):
+    """
+    run in a fresh process; returns (peak rss in MB, seconds)
+    """
+    import resource
+
+    from cluster import MiniBatchKMeans, TfidfVectorizer, \
+        _fit_streaming_model, _get_streamed_totals
+
+    start = perf_counter()
+    if streaming:
+        def get_batches():
+            return _get_topic_batches(num_documents, k, batch_size)
+
+        vectorizer, model = _fit_streaming_model(get_batches, k,
+                                                 num_features, seed=0)
+        _get_streamed_totals(get_batches, vectorizer, model)
+    else:
+        texts = _get_topic_texts(num_documents, k)
+        vectors = TfidfVectorizer(min_df=0).fit_transform(texts)
+        MiniBatchKMeans(n_clusters=k, random_state=0).fit(vectors).predict(
+            vectors)
+    seconds = perf_counter() - start
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, seconds
+
+
+def benchmark_streaming(args):
+    import multiprocessing
+
+    context = multiprocessing.get_context('spawn')  # a clean peak rss
+    for num_documents in args.num_documents:
+        for streaming in [False, True]:
+            with context.Pool(1) as pool:
+                peak_megabytes, seconds = pool.apply(
+                    _cluster_for_memory, (streaming, num_documents, args.k,
+                                          args.batch_size,
+                                          args.hash_features))
+            print('%s: documents = %d; peak RSS MB = %.1f; seconds = %.1f;'
+                  % ('streaming' if streaming else 'in memory', num_documents,
+                     peak_megabytes, seconds))
+
+
+def benchmark_write_back(args):
+    import numpy as np
+    from elasticsearch.helpers import scan
+
+    from cluster import CLUSTER_WRITE_BACKS
+    from settings import DOC_TYPE, ES, INDEX_NAME
+
+    document_ids = [document['_id'] for document in scan(ES, query={
+        '_source': False,
+        'query': {'match_all': {}},
+    }, index=INDEX_NAME, doc_type=DOC_TYPE)]
+    random_state = np.random.RandomState(0)
+    labels = random_state.randint(args.k, size=len(document_ids))
+    changed = random_state.rand(len(labels)) < args.changed
+    changed_labels = labels.copy()
+    changed_labels[changed] = (labels[changed] + 1) % args.k
+    cluster_labels = [['cluster%d' % label_id] for label_id in range(args.k)]
+    for write_back in sorted(CLUSTER_WRITE_BACKS):
+        CLUSTER_WRITE_BACKS['grouped'](document_ids, labels, cluster_labels,
+                                       ES)
+        (num_requests, num_updated), seconds = _timed(
+            CLUSTER_WRITE_BACKS[write_back], document_ids, changed_labels,
+            cluster_labels, ES)
+        print('%s: documents = %d; updated = %d; requests = %d; '
+              'seconds = %.2f;' % (write_back, len(document_ids),
+                                   num_updated, num_requests, seconds))
+
+
+def add_analysis_parser(subparsers):
+    parser = subparsers.add_parser('analysis', description="Compare the "
+                                                           "single-pass "
+                                                           "analyzer with "
+                                                           "the multi-pass "
+                                                           "one")
+    parser.add_argument('-j', '--json-directory', default=DEFAULT_PAGES_DIR,
+                        help="Directory to read wikipedia pages data json "
+                             "files from")
+    parser.add_argument('-r', '--repeat', default=3, type=int,
+                        help="number of timing rounds (best one is kept)")
+    parser.set_defaults(handle=benchmark_analysis)
+
+
+def add_extraction_parser(subparsers):
+    parser = subparsers.add_parser('extraction', description="Compare parse "
+                                                             "throughput of "
+                                                             "the html "
+                                                             "extraction "
+                                                             "backends")
+    parser.add_argument('html_directory', nargs='?',
+                        default=FIXTURE_HTML_DIR,
+                        help="Directory of saved wikipedia .html pages")
+    parser.set_defaults(handle=benchmark_extraction)
+
+
+def add_parity_parser(subparsers):
+    parser = subparsers.add_parser('parity', description="Compare tokens of "
+                                                         "the elasticsearch "
+                                                         "persian_analyzer "
+                                                         "with analyze()")
+    parser.add_argument('-j', '--json-directory', default=DEFAULT_PAGES_DIR,
+                        help="Directory to read wikipedia pages data from")
+    parser.add_argument('-s', '--show', default=5, type=int,
+                        help="number of mismatches to print")
+    parser.set_defaults(handle=check_analysis_parity)
+
+
+def add_mapping_parser(subparsers):
+    parser = subparsers.add_parser('mapping', description="Compare index "
+                                                          "size and ingest "
+                                                          "time of the "
+                                                          "mapping profiles")
+    parser.add_argument('-j', '--json-directory', default=DEFAULT_PAGES_DIR,
+                        help="Directory to read wikipedia pages data from")
+    parser.set_defaults(handle=compare_mapping_profiles)
+
+
+def add_bulk_parser(subparsers):
+    parser = subparsers.add_parser('bulk', description="Measure bulk ingest "
+                                                       "throughput against a "
+                                                       "stand-in _bulk "
+                                                       "endpoint")
+    parser.add_argument('-n', '--num-documents', default=2000, type=int)
+    parser.add_argument('-w', '--workers', default=[1, 4], type=int,
+                        nargs='+', help="bulk worker counts to compare")
+    parser.add_argument('-c', '--chunk-size', default=100, type=int)
+    parser.add_argument('-l', '--latency', default=0.05, type=float,
+                        help="stand-in latency per request in seconds")
+    parser.add_argument('-r', '--rejection-rate', default=0.05, type=float,
+                        help="fraction of actions rejected with 429")
+    parser.set_defaults(handle=benchmark_bulk)
+
+
+def add_search_parser(subparsers):
+    from settings import LOCAL_INDEX_DIR
+
+    parser = subparsers.add_parser('search', description="Compare query "
+                                                         "latency of the "
+                                                         "local and "
+                                                         "elasticsearch "
+                                                         "search backends")
+    parser.add_argument('-l', '--local-index-directory',
+                        default=LOCAL_INDEX_DIR)
+    parser.add_argument('-q', '--queries',
+                        help="file with one query per line (default: "
+                             "sampled page titles)")
+    parser.add_argument('-n', '--num-queries', default=200, type=int)
+    parser.add_argument('-s', '--size', default=10, type=int)
+    parser.set_defaults(handle=compare_search_backends)
+
+
+def add_labels_parser(subparsers):
+    parser = subparsers.add_parser('labels', description="Compare the "
+                                                         "vectorized mutual "
+                                                         "information with "
+                                                         "the count query "
+                                                         "one")
+    parser.add_argument('-j', '--json-directory', default=DEFAULT_PAGES_DIR,
+                        help="Directory to read wikipedia pages data from")
+    parser.add_argument('-k', default=8, type=int, help="number of clusters")
+    parser.add_argument('-n', '--num-features', default=200, type=int,
+                        help="features to compute with count queries")
+    parser.set_defaults(handle=benchmark_labels)
+
+
+def add_k_selection_parser(subparsers):
+    parser = subparsers.add_parser('kselect', description="Compare k "
+                                                          "selection "
+                                                          "strategies on "
+                                                          "synthetic topics")
+    parser.add_argument('-n', '--num-documents', default=2000, type=int)
+    parser.add_argument('-t', '--num-topics', default=12, type=int)
+    parser.add_argument('-k', '--max-k', default=-1, type=int)
+    parser.add_argument('-w', '--workers', default=os.cpu_count() or 1,
+                        type=int)
+    parser.set_defaults(handle=benchmark_k_selection)
+
+
+def add_reduction_parser(subparsers):
+    from settings import REDUCTION_COMPONENTS
+
+    parser = subparsers.add_parser('reduction', description="Compare "
+                                                            "K-means on "
+                                                            "reduced "
+                                                            "vectors with "
+                                                            "the unreduced "
+                                                            "baseline")
+    parser.add_argument('-j', '--json-directory', default=DEFAULT_PAGES_DIR,
+                        help="Directory to read wikipedia pages data from")
+    parser.add_argument('-k', default=12, type=int, help="number of clusters")
+    parser.add_argument('-n', '--components', default=REDUCTION_COMPONENTS,
+                        type=int)
+    parser.add_argument('--min-df', default=2, type=int,
+                        help="minimum document frequency for the reduced "
+                             "runs")
+    parser.add_argument('--max-df', default=0.5, type=float,
+                        help="maximum document frequency (fraction) for the "
+                             "reduced runs")
+    parser.set_defaults(handle=benchmark_reduction)
+
+
+def add_streaming_parser(subparsers):
+    from settings import STREAM_BATCH_SIZE, STREAM_FEATURES
+
+    parser = subparsers.add_parser('streaming', description="Compare peak "
+                                                            "memory of "
+                                                            "streaming and "
+                                                            "in-memory "
+                                                            "clustering as "
+                                                            "the corpus "
+                                                            "grows")
+    parser.add_argument('-n', '--num-documents', default=[5000, 20000, 80000],
+                        type=int, nargs='+')
+    parser.add_argument('-k', default=12, type=int, help="number of clusters")
+    parser.add_argument('-b', '--batch-size', default=STREAM_BATCH_SIZE,
+                        type=int)
+    parser.add_argument('--hash-features', default=STREAM_FEATURES, type=int)
+    parser.set_defaults(handle=benchmark_streaming)
+
+
+def add_write_back_parser(subparsers):
+    parser = subparsers.add_parser('writeback', description="Compare the "
+                                                            "cluster write-"
+                                                            "backs on the "
+                                                            "index (this "
+                                                            "overwrites its "
+                                                            "clusters, run "
+                                                            "cluster again "
+                                                            "afterwards)")
+    parser.add_argument('-k', default=12, type=int, help="number of clusters")
+    parser.add_argument('-c', '--changed', default=0.1, type=float,
+                        help="fraction of documents that change cluster")
+    parser.set_defaults(handle=benchmark_write_back)
+
+
+def add_startup_parser(subparsers):
+    parser = subparsers.add_parser('startup', description="Measure the "
+                                                          "cold start "
+                                                          "import cost of "
+                                                          "each cli command")
+    parser.add_argument('-b', '--baseline',
+                        help="json file of import times to compare with "
+                             "(written if it does not exist)")
+    parser.add_argument('-s', '--save', action='store_true',
+                        help="overwrite the baseline with this run")
+    parser.add_argument('-t', '--tolerance', default=0.2, type=float,
+                        help="allowed slowdown before a command is flagged "
+                             "as a regression")
+    parser.add_argument('-r', '--repeat', default=5, type=int,
+                        help="number of runs per command (fastest is kept)")
+    parser.set_defaults(handle=benchmark_startup)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.set_defaults(handle=lambda args: parser.print_usage())
+    subparsers = parser.add_subparsers(title="benchmarks")
+    add_analysis_parser(subparsers)
+    add_extraction_parser(subparsers)
+    add_parity_parser(subparsers)
+    add_mapping_parser(subparsers)
+    add_bulk_parser(subparsers)
+    add_search_parser(subparsers)
+    add_labels_parser(subparsers)
+    add_k_selection_parser(subparsers)
+    add_reduction_parser(subparsers)
+    add_streaming_parser(subparsers)
+    add_write_back_parser(subparsers)
+    add_startup_parser(subparsers)
+    args = parser.parse_args()
+    args.handle(args)
+
+if __name__ == '__main__':
+    main()
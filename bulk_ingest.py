@@ -0,0 +1,150 @@
+import json
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import perf_counter, sleep
+
+from elasticsearch import TransportError
+from elasticsearch.helpers import BulkIndexError, expand_action
+
+import metrics
+from settings import BULK_CHUNK_SIZE, BULK_INITIAL_BACKOFF, \
+    BULK_MAX_CHUNK_BYTES, BULK_MAX_RETRIES, BULK_WORKERS
+
+
+TOO_MANY_REQUESTS = 429
+
+
+def _serialize(action):
+    action_line, data = expand_action(action)
+    lines = [json.dumps(action_line, ensure_ascii=False)]
+    if data is not None:
+        lines.append(json.dumps(data, ensure_ascii=False))
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def _get_chunks(actions, chunk_size, max_chunk_bytes):
+    """
+    group serialized actions into chunks of at most `chunk_size` actions and
+    `max_chunk_bytes` bytes (a single larger action gets a chunk of its own)
+    """
+    chunk = []
+    chunk_bytes = 0
+    for action in actions:
+        serialized_action = _serialize(action)
+        if chunk and (len(chunk) >= chunk_size or
+                      chunk_bytes + len(serialized_action) > max_chunk_bytes):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(serialized_action)
+        chunk_bytes += len(serialized_action)
+    if chunk:
+        yield chunk
+
+
+def _send_chunk(client, chunk, max_retries, initial_backoff):
+    """
+    send one chunk, resending the actions rejected with 429 after an
+    exponential backoff; returns (number of actions, bytes, errors)
+    """
+    num_actions = len(chunk)
+    num_bytes = sum(len(serialized_action) for serialized_action in chunk)
+    errors = []
+    for attempt in range(max_retries + 1):
+        if attempt:
+            sleep(initial_backoff * 2 ** (attempt - 1))
+        try:
+            with metrics.span('bulk'):
+                response = client.bulk(body=b''.join(chunk).decode())
+        except TransportError as e:
+            if e.status_code != TOO_MANY_REQUESTS or attempt == max_retries:
+                raise
+            continue
+        rejected_chunk = []
+        for serialized_action, item in zip(chunk, response['items']):
+            result = next(iter(item.values()))
+            if 200 <= result.get('status', 500) < 300:
+                continue
+            if result['status'] == TOO_MANY_REQUESTS and \
+                    attempt < max_retries:
+                rejected_chunk.append(serialized_action)
+            else:
+                errors.append(item)
+        if not rejected_chunk:
+            break
+        chunk = rejected_chunk
+    return num_actions, num_bytes, errors
+
+
+def _update_progress(num_actions, num_bytes, seconds):
+    seconds = seconds or sys.float_info.min
+    sys.stdout.write('\r[%d docs; %.1f docs/sec; %.2f MB/sec]' % (
+        num_actions, num_actions / seconds, num_bytes / seconds / 1000000))
+    sys.stdout.flush()
+
+
+def bulk_ingest(client, actions, workers=BULK_WORKERS,
+                chunk_size=BULK_CHUNK_SIZE,
+                max_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+                max_retries=BULK_MAX_RETRIES,
+                initial_backoff=BULK_INITIAL_BACKOFF):
+    """
+    send bulk `actions` with `workers` concurrent bulk requests, printing
+    throughput as chunks complete; raises BulkIndexError if any action
+    failed, after all of them were sent. returns (number of actions, bytes)
+    """
+    num_actions = 0
+    num_bytes = 0
+    errors = []
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        chunks = _get_chunks(actions, chunk_size, max_chunk_bytes)
+        while True:
+            while len(in_flight) < 2 * workers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                in_flight.append(executor.submit(
+                    _send_chunk, client, chunk, max_retries, initial_backoff))
+            if not in_flight:
+                break
+            chunk_actions, chunk_bytes, chunk_errors = \
+                in_flight.popleft().result()
+            num_actions += chunk_actions
+            num_bytes += chunk_bytes
+            metrics.count('bulk_documents', chunk_actions)
+            metrics.count('bulk_bytes', chunk_bytes)
+            errors += chunk_errors
+            _update_progress(num_actions, num_bytes, perf_counter() - start)
+    print()  # newline after progress
+    if errors:
+        raise BulkIndexError('%d document(s) failed to index.' % len(errors),
+                             errors)
+    return num_actions, num_bytes
+
+
+@contextmanager
+def ingest_settings(client, index, force_merge=True):
+    """
+    turn off refresh and replicas while loading `index`, then restore them
+    (and force-merge the index if `force_merge`)
+    """
+    index_settings = client.indices.get_settings(
+        index=index)[index]['settings']['index']
+    client.indices.put_settings(index=index, body={'index': {
+        'refresh_interval': '-1',
+        'number_of_replicas': 0,
+    }})
+    try:
+        yield
+    finally:
+        client.indices.put_settings(index=index, body={'index': {
+            'refresh_interval': index_settings.get('refresh_interval', '1s'),
+            'number_of_replicas': index_settings.get('number_of_replicas', 0),
+        }})
+    client.indices.refresh(index=index)
+    if force_merge:
+        client.indices.forcemerge(index=index, max_num_segments=1)
@@ -1,11 +1,24 @@
 #!/usr/bin/env python
+# the modules behind each command are imported by its handler, so a command
+# only pays for the libraries it uses (see 'benchmarks.py startup')
 import argparse
+import sys
 
-from cluster import cluster
-from crawler import crawl
-from index import create_index, delete_index
-from settings import DEFAULT_PAGES_DIR
-from search import search
+import metrics
+from extraction import EXTRACTORS
+from page_store import PAGE_STORE_CLASSES
+from settings import BATCH_SEARCH_SIZE, BULK_CHUNK_SIZE, \
+    BULK_MAX_CHUNK_BYTES, BULK_WORKERS, CLUSTER_WRITE_BACK_NAMES, \
+    CRAWL_CONCURRENCY, CRAWL_PER_HOST_CONCURRENCY, DEFAULT_EXTRACTOR, \
+    DEFAULT_PAGE_CACHE_PATH, DEFAULT_PAGES_DIR, FRONTIER_MEMORY_LIMIT, \
+    K_MEANS_ESTIMATOR_NAMES, K_SELECTION_STRATEGY_NAMES, \
+    MAPPING_PROFILE_NAMES, REDUCTION_COMPONENTS, REDUCTION_NAMES, \
+    SEARCH_BACKENDS, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SERVE_HOST, \
+    SERVE_PORT, SERVE_WORKERS, STREAM_BATCH_SIZE, STREAM_FEATURES
+
+
+def _document_frequency(value):
+    return float(value) if '.' in value else int(value)
 
 
 def handle_default(args):
@@ -13,79 +26,333 @@ def handle_default(args):
 
 
 def handle_crawl(args):
-    crawl(args.out_degree, args.num_pages, args.urls, args.json_directory)
+    from crawler import crawl
+
+    if not args.urls and not args.resume and not args.offline:
+        args.print_usage()
+        return
+    if args.offline and args.no_cache:
+        args.print_usage()
+        return
+    crawl(args.out_degree, args.num_pages, args.urls, args.json_directory,
+          args.concurrency, args.per_host_concurrency, args.resume,
+          frontier_memory_limit=args.frontier_memory_limit,
+          bloom_filter_capacity=args.bloom_filter_capacity,
+          extractor=args.extractor,
+          page_cache_path=None if args.no_cache else args.cache_file,
+          offline=args.offline, store_format=args.store_format)
+
+
+def handle_convert(args):
+    from page_store import convert_page_store
+
+    convert_page_store(args.source, args.destination, args.store_format)
 
 
 def handle_index(args):
-    if args.delete_index:
+    if args.backend == 'local':
+        if args.delete_index or args.update:  # it is always rebuilt
+            args.print_usage()
+            return
+        from local_search import build_local_index
+
+        build_local_index(args.json_directory, workers=args.workers)
+    elif args.delete_index:
+        from index import delete_index
+
         delete_index()
+    elif args.update:
+        from index import update_index
+
+        update_index(args.json_directory, args.workers, args.bulk_workers,
+                     args.bulk_chunk_size, args.bulk_chunk_bytes,
+                     args.server_side_analysis, args.mapping_profile,
+                     not args.no_cluster_assignment)
     else:
-        create_index(args.json_directory)
+        from index import create_index
+
+        create_index(args.json_directory, args.workers, args.bulk_workers,
+                     args.bulk_chunk_size, args.bulk_chunk_bytes,
+                     args.server_side_analysis, args.mapping_profile,
+                     not args.no_cluster_assignment)
 
 
 def handle_cluster(args):
-    cluster(args.max_k)
+    if args.streaming:
+        if args.max_k < 1:
+            args.print_usage()
+            return
+        from cluster import cluster_streaming
+
+        try:
+            cluster_streaming(args.max_k, args.batch_size,
+                              args.hash_features)
+        except ValueError as error:  # fewer documents than clusters
+            print(error)
+        return
+    from cluster import cluster
+
+    cluster(args.max_k, args.k_strategy, args.estimator, args.workers,
+            args.reduction, args.components, args.min_df, args.max_df,
+            args.rebuild_features, args.write_back)
 
 
 def handle_search(args):
-    search(args.query, args.title_weight, args.introduction_weight,
-           args.content_weight, args.cluster_id)
+    from search import search, search_batch
+
+    if args.batch:
+        search_batch(args.batch, args.output, args.title_weight,
+                     args.introduction_weight, args.content_weight,
+                     args.cluster_id, args.size, args.pages, args.batch_size,
+                     args.backend)
+    elif args.query:
+        search(args.query, args.title_weight, args.introduction_weight,
+               args.content_weight, args.cluster_id, args.backend)
+    else:
+        args.print_usage()
+
+
+def handle_serve(args):
+    from service import serve
+
+    serve(args.host, args.port, args.workers, args.cache_size,
+          args.cache_ttl)
 
 
 def add_crawl_parser(subparsers):
     parser = subparsers.add_parser('crawl', description="Crawl wikipedia pages"
                                                         " and save them in"
                                                         " destination folder")
-    parser.add_argument('urls', nargs='+', help="starting page url",
+    parser.add_argument('urls', nargs='*', help="starting page url",
                         metavar='url')
     parser.add_argument('-d', '--out-degree', default=10, type=int,
                         help="maximum out-degree of pages")
     parser.add_argument('-p', '--num-pages', default=1000, type=int,
                         help="maximum number of pages to crawl")
     parser.add_argument('-j', '--json-directory', default=DEFAULT_PAGES_DIR,
-                        help="Directory to store wikipedia pages data as "
-                             "json files")
-    parser.set_defaults(handle=handle_crawl)
+                        help="Directory to store wikipedia pages data in "
+                             "(json files or segment store)")
+    parser.add_argument('-c', '--concurrency', default=CRAWL_CONCURRENCY,
+                        type=int, help="maximum number of pages fetched at "
+                                       "the same time")
+    parser.add_argument('--per-host-concurrency',
+                        default=CRAWL_PER_HOST_CONCURRENCY, type=int,
+                        help="maximum number of connections to one host")
+    parser.add_argument('-r', '--resume', action='store_true',
+                        help="continue an interrupted crawl from the "
+                             "checkpoint in the json directory (urls are "
+                             "only crawled if there is no checkpoint)")
+    parser.add_argument('--frontier-memory-limit',
+                        default=FRONTIER_MEMORY_LIMIT, type=int,
+                        help="number of queued urls kept in memory before "
+                             "spilling to disk")
+    parser.add_argument('--bloom-filter-capacity', default=0, type=int,
+                        help="remember seen urls in a bloom filter sized for "
+                             "this many urls instead of an exact hash set")
+    parser.add_argument('-e', '--extractor', default=DEFAULT_EXTRACTOR,
+                        choices=sorted(EXTRACTORS),
+                        help="html parsing backend (lxml is an optional "
+                             "dependency)")
+    parser.add_argument('--cache-file', default=DEFAULT_PAGE_CACHE_PATH,
+                        help="File to keep raw pages in, pages that did not "
+                             "change are not downloaded again")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Don't use the raw page cache")
+    parser.add_argument('-s', '--store-format', choices=sorted(
+        PAGE_STORE_CLASSES), help="Format of a new page store in the json "
+                                  "directory (default: directory)")
+    parser.add_argument('-o', '--offline', action='store_true',
+                        help="Rebuild pages from the raw page cache without "
+                             "network access (every cached page if no url "
+                             "is given)")
+    parser.set_defaults(handle=handle_crawl, print_usage=parser.print_usage)
+
+
+def add_convert_parser(subparsers):
+    parser = subparsers.add_parser('convert', description="Copy crawled "
+                                                          "pages to a page "
+                                                          "store of another "
+                                                          "format")
+    parser.add_argument('source', help="page store to read")
+    parser.add_argument('destination', help="page store to write")
+    parser.add_argument('-s', '--store-format', required=True,
+                        choices=sorted(PAGE_STORE_CLASSES),
+                        help="format of the destination page store")
+    parser.set_defaults(handle=handle_convert)
 
 
 def add_index_parser(subparsers):
     parser = subparsers.add_parser('index', description="Handle indexing")
     parser.add_argument('-j', '--json-directory', default=DEFAULT_PAGES_DIR,
-                        help="Directory to read wikipedia pages data json "
-                             "files from")
+                        help="Directory to read wikipedia pages data from "
+                             "(json files or segment store)")
     parser.add_argument('-d', '--delete-index', action='store_true',
                         help="Delete index")
-    parser.set_defaults(handle=handle_index)
+    parser.add_argument('-u', '--update', action='store_true',
+                        help="Only index new and changed pages and delete "
+                             "pages that are gone from the json directory")
+    parser.add_argument('-s', '--server-side-analysis', action='store_true',
+                        help="Normalize persian text with an elasticsearch "
+                             "analyzer instead of in python (for a new "
+                             "index)")
+    parser.add_argument('-m', '--mapping-profile', default='default',
+                        choices=MAPPING_PROFILE_NAMES,
+                        help="Mapping of a new index, 'lean' stores and "
+                             "indexes only what search needs (and implies "
+                             "--server-side-analysis)")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="number of analysis processes (default: number "
+                             "of cpus)")
+    parser.add_argument('--bulk-workers', type=int, default=BULK_WORKERS,
+                        help="number of concurrent bulk requests")
+    parser.add_argument('--bulk-chunk-size', type=int, default=BULK_CHUNK_SIZE,
+                        help="maximum number of documents per bulk request")
+    parser.add_argument('--bulk-chunk-bytes', type=int,
+                        default=BULK_MAX_CHUNK_BYTES,
+                        help="maximum size of a bulk request in bytes")
+    parser.add_argument('--backend', default='elasticsearch',
+                        choices=SEARCH_BACKENDS,
+                        help="'local' builds the embedded search index from "
+                             "the json directory instead (it is always "
+                             "rebuilt, so -d and -u do not apply)")
+    parser.add_argument('--no-cluster-assignment', action='store_true',
+                        help="Do not give documents their nearest cluster "
+                             "from the saved cluster model")
+    parser.set_defaults(handle=handle_index, print_usage=parser.print_usage)
 
 
 def add_cluster_parser(subparsers):
     parser = subparsers.add_parser('cluster', description="Cluster wiki pages")
     parser.add_argument('-k', '--max-k', type=int, default=-1,
                         help="maximum K for K-means algorithm")
-    parser.set_defaults(handle=handle_cluster)
+    parser.add_argument('-s', '--k-strategy', default='linear',
+                        choices=K_SELECTION_STRATEGY_NAMES,
+                        help="'bracketed' doubles K until the inertia "
+                             "improvement is small, then narrows it down")
+    parser.add_argument('-e', '--estimator', default='kmeans',
+                        choices=K_MEANS_ESTIMATOR_NAMES,
+                        help="'minibatch' fits faster on large corpora")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="number of K-means processes (default: number "
+                             "of cpus)")
+    parser.add_argument('-r', '--reduction', default='none',
+                        choices=REDUCTION_NAMES,
+                        help="reduce the tf-idf vectors before K-means with "
+                             "truncated SVD (LSA) or a sparse random "
+                             "projection")
+    parser.add_argument('-n', '--components', type=int,
+                        default=REDUCTION_COMPONENTS,
+                        help="number of dimensions to reduce to")
+    parser.add_argument('--min-df', type=_document_frequency, default=0,
+                        help="ignore terms in fewer documents than this "
+                             "(a float is a fraction of the documents)")
+    parser.add_argument('--max-df', type=_document_frequency, default=1.0,
+                        help="ignore terms in more documents than this "
+                             "(a float is a fraction of the documents)")
+    parser.add_argument('--rebuild-features', action='store_true',
+                        help="Rebuild the tf-idf matrix even if the cached "
+                             "one is still valid")
+    parser.add_argument('--write-back', default='grouped',
+                        choices=CLUSTER_WRITE_BACK_NAMES,
+                        help="'grouped' updates only the documents whose "
+                             "cluster changed, with one update by query per "
+                             "cluster; 'per-document' updates every document")
+    parser.add_argument('-S', '--streaming', action='store_true',
+                        help="Cluster in bounded memory into exactly -k "
+                             "clusters with hashed features and mini-batch "
+                             "K-means")
+    parser.add_argument('-b', '--batch-size', type=int,
+                        default=STREAM_BATCH_SIZE,
+                        help="documents per batch in streaming mode")
+    parser.add_argument('--hash-features', type=int, default=STREAM_FEATURES,
+                        help="number of hash buckets in streaming mode")
+    parser.set_defaults(handle=handle_cluster, print_usage=parser.print_usage)
 
 
 def add_search_parser(subparsers):
     parser = subparsers.add_parser('search', description="Search wiki pages")
-    parser.add_argument('query')
+    parser.add_argument('query', nargs='?')
     parser.add_argument('-t', '--title-weight', type=int, default=1)
     parser.add_argument('-i', '--introduction-weight', type=int, default=1)
     parser.add_argument('-c', '--content-weight', type=int, default=1)
     parser.add_argument('-C', '--cluster-id', type=int, default=-1,
                         help="Cluster id to search within")
-    parser.set_defaults(handle=handle_search)
+    parser.add_argument('-b', '--batch', metavar='QUERIES_FILE',
+                        help="Search every line of this file through "
+                             "_msearch and write json lines")
+    parser.add_argument('-o', '--output', default='-',
+                        help="File to write batch results to (default: "
+                             "stdout)")
+    parser.add_argument('-s', '--size', type=int, default=10,
+                        help="Hits per page in batch mode")
+    parser.add_argument('-P', '--pages', type=int, default=1,
+                        help="Pages per query in batch mode (search_after)")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SEARCH_SIZE,
+                        help="Queries per _msearch request")
+    parser.add_argument('--backend', default='elasticsearch',
+                        choices=SEARCH_BACKENDS,
+                        help="'local' searches the index built by 'index "
+                             "--backend local' without elasticsearch")
+    parser.set_defaults(handle=handle_search, print_usage=parser.print_usage)
+
+
+def add_serve_parser(subparsers):
+    parser = subparsers.add_parser('serve', description="Serve searches as "
+                                                        "json over http")
+    parser.add_argument('-H', '--host', default=SERVE_HOST)
+    parser.add_argument('-p', '--port', type=int, default=SERVE_PORT)
+    parser.add_argument('-w', '--workers', type=int, default=SERVE_WORKERS,
+                        help="maximum number of concurrent elasticsearch "
+                             "requests")
+    parser.add_argument('--cache-size', type=int, default=SEARCH_CACHE_SIZE,
+                        help="maximum number of cached results (0 disables "
+                             "the cache)")
+    parser.add_argument('--cache-ttl', type=float, default=SEARCH_CACHE_TTL,
+                        help="seconds a cached result is kept")
+    parser.set_defaults(handle=handle_serve)
+
+
+def _run(args):
+    """
+    run the command inside a span named after it, writing the metrics report
+    and the profile (if asked to) even if it fails
+    """
+    if args.profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with metrics.span(args.command or 'usage'):
+            args.handle(args)
+    finally:
+        if args.profile:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.metrics_out:
+            metrics.write_report(args.metrics_out, command=args.command,
+                                 argv=sys.argv[1:])
 
 
 def main():
     parser = argparse.ArgumentParser()
+    parser.add_argument('--metrics-out',
+                        help="write a json report of timing spans, counters "
+                             "(bytes, documents, elasticsearch round trips) "
+                             "and peak memory to this file ('-' for stdout)")
+    parser.add_argument('--profile',
+                        help="write cProfile stats of the command to this "
+                             "file (read it with pstats)")
     parser.set_defaults(handle=handle_default, print_usage=parser.print_usage)
-    subparsers = parser.add_subparsers(title="commands")
+    subparsers = parser.add_subparsers(title="commands", dest='command')
     add_crawl_parser(subparsers)
+    add_convert_parser(subparsers)
     add_index_parser(subparsers)
     add_cluster_parser(subparsers)
     add_search_parser(subparsers)
+    add_serve_parser(subparsers)
     args = parser.parse_args()
-    args.handle(args)
+    _run(args)
 
 if __name__ == '__main__':
     main() 
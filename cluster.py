@@ -1,78 +1,497 @@
-import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from itertools import chain
+from time import perf_counter
 
+import numpy as np
 from elasticsearch.helpers import scan, bulk
-from sklearn.cluster import KMeans
-from sklearn.feature_extraction.text import TfidfVectorizer
+from scipy import sparse
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import HashingVectorizer, \
+    TfidfVectorizer
+from sklearn.preprocessing import normalize
+from sklearn.random_projection import SparseRandomProjection
 
-from settings import ES, INDEX_NAME, DOC_TYPE, K_MEANS_ACCEPTABLE_DIFF, K_MEANS_RETRY, VERY_HIGH_INERTIA
+import metrics
+from generation import bump_index_generation
+from cluster_model import save_cluster_model
+from feature_cache import get_feature_cache_key, load_features, \
+    save_features
+from index import get_analyzed_text
+from local_search import LocalClusterWriter, update_clusters
+from settings import CLUSTER_LABEL_COUNT, CLUSTER_UPDATE_BATCH_SIZE, \
+    CLUSTER_UPDATE_WORKERS, ES, INDEX_NAME, DOC_TYPE, \
+    K_MEANS_ACCEPTABLE_DIFF, K_MEANS_RETRY, LOCAL_INDEX_DIR, \
+    META_DOC_TYPE, META_INDEX_NAME, REDUCTION_COMPONENTS, \
+    STREAM_BATCH_SIZE, STREAM_FEATURES, VERY_HIGH_INERTIA
 
 
-def _get_documents_and_features():
+def _get_documents_and_features(min_df=0, max_df=1.0, rebuild=False):
+    """
+    `min_df` and `max_df` prune the vocabulary like TfidfVectorizer's (an
+    int is a number of documents, a float a fraction of them). the result is
+    taken from the feature cache while the indexed content is unchanged,
+    unless `rebuild`
+    """
+    cache_key = get_feature_cache_key(min_df=min_df, max_df=max_df)
+    if not rebuild:
+        cached = load_features(cache_key)
+        if cached is not None:
+            print('using cached features')
+            return cached
+
     documents = {
         'ids': [],
         'texts': [],
         'vectors': [],
     }
-    for document in scan(ES, query={'query': {'match_all': {}}},
-                         index=INDEX_NAME, doc_type=DOC_TYPE):
+    for document in metrics.timed_iter('scan', scan(
+            ES, query={'query': {'match_all': {}}}, index=INDEX_NAME,
+            doc_type=DOC_TYPE)):
         documents['ids'].append(document['_id'])
 
-        text = document['_source']['analyzed_title'] + ' ' + \
-            document['_source']['analyzed_introduction'] + ' ' + \
-            document['_source']['analyzed_content']
-        documents['texts'].append(text)
+        documents['texts'].append(get_analyzed_text(document['_source']))
 
-    vectorizer = TfidfVectorizer(analyzer='word', min_df=0)
-    documents['vectors'] = vectorizer.fit_transform(documents['texts'])
+    vectorizer = TfidfVectorizer(analyzer='word', min_df=min_df,
+                                 max_df=max_df)
+    with metrics.span('vectorize'):
+        documents['vectors'] = vectorizer.fit_transform(documents['texts'])
+    documents['idf'] = vectorizer.idf_
+    del documents['texts']
+    features = vectorizer.get_feature_names()
+    save_features(cache_key, documents, features)
 
-    return documents, vectorizer.get_feature_names()
+    return documents, features
 
 
-def _get_k(k_limit, documents):
-    k_limit = int(k_limit)
+# a reduction returns the reduced vectors and the arrays that the cluster
+# model needs to reduce new documents the same way
+
+
+def _reduce_with_svd(vectors, num_components, seed):
+    # LSA; rows are normalized again so KMeans still compares directions
+    svd = TruncatedSVD(n_components=num_components, random_state=seed)
+    return normalize(svd.fit_transform(vectors)), {
+        'svd_components': svd.components_,
+    }
+
+
+def _reduce_with_projection(vectors, num_components, seed):
+    projection = SparseRandomProjection(n_components=num_components,
+                                        random_state=seed)
+    reduced_vectors = projection.fit_transform(vectors)
+    components = sparse.csr_matrix(projection.components_)
+    return reduced_vectors, {
+        'projection_data': components.data,
+        'projection_indices': components.indices,
+        'projection_indptr': components.indptr,
+        'projection_shape': np.array(components.shape),
+    }
+
+
+REDUCTIONS = {
+    'none': None,
+    'svd': _reduce_with_svd,
+    'projection': _reduce_with_projection,
+}
+
+
+def _reduce_documents(documents, reduction, num_components, seed=None):
+    """
+    replace documents['vectors'] with `num_components` dimensional ones
+    (the tf-idf matrix is kept as documents['term_vectors'] for labeling)
+    """
+    documents['term_vectors'] = documents['vectors']
+    documents['reduction_arrays'] = {}
+    if REDUCTIONS[reduction] is None:
+        return
+    num_features = documents['vectors'].shape[1]
+    # TruncatedSVD needs fewer components than features
+    num_components = max(1, min(num_components, num_features - 1))
+    start = perf_counter()
+    documents['vectors'], documents['reduction_arrays'] = \
+        REDUCTIONS[reduction](documents['vectors'], num_components, seed)
+    print('features = %d;' % num_features,
+          '%s components = %d;' % (reduction, num_components),
+          'seconds = %.1f;' % (perf_counter() - start))
+
+
+K_MEANS_ESTIMATORS = {
+    'kmeans': KMeans,
+    'minibatch': MiniBatchKMeans,
+}
+# vectors that forked k selection processes inherit (python 3.6 executors
+# take no initializer)
+_k_means_worker = {}
+
 
+def _fit_k_means(k, seed, estimator, vectors=None):
+    if vectors is None:
+        vectors = _k_means_worker['vectors']
+    return K_MEANS_ESTIMATORS[estimator](n_clusters=k,
+                                         random_state=seed).fit(vectors)
+
+
+class _KSweep():
+    """
+    fits each requested k K_MEANS_RETRY times on a process pool, keeping the
+    average inertia of every k and the best (lowest inertia) model of every k
+    that can still be selected. the vectors are sent with every fit unless
+    `vectors` is None and the workers inherited them
+    """
+
+    def __init__(self, executor, seed, estimator, vectors=None):
+        self.executor = executor
+        self.seed = seed
+        self.estimator = estimator
+        self.vectors = vectors
+        self.inertias = {}
+        self.models = {}
+        self.num_fits = 0
+
+    def evaluate(self, ks):
+        futures = {
+            k: [self.executor.submit(_fit_k_means, k,
+                                     self.seed + k * K_MEANS_RETRY + i,
+                                     self.estimator, self.vectors)
+                for i in range(K_MEANS_RETRY)]
+            for k in set(ks) if k >= 1 and k not in self.inertias
+        }
+        for k in sorted(futures):
+            models = [future.result() for future in futures[k]]
+            self.num_fits += len(models)
+            self.inertias[k] = sum(model.inertia_ for model in models) / \
+                len(models)
+            self.models[k] = min(models, key=lambda model: model.inertia_)
+            for neighbour in [k - 1, k, k + 1]:
+                if neighbour in self.models and \
+                        not self._can_be_selected(neighbour):
+                    del self.models[neighbour]
+            message = 'k = %d; inertia = %f;' % (k, self.inertias[k])
+            if k == 1 or k - 1 in self.inertias:
+                diff = self.get_diff(k)
+                message += ' diff = %s' % (str(diff) if diff < 1000000
+                                           else 'huge!')
+            print(message)
+
+    def get_diff(self, k):
+        last_inertia = self.inertias[k - 1] if k > 1 else VERY_HIGH_INERTIA
+        return last_inertia - self.inertias[k]
+
+    def is_acceptable(self, k):
+        return self.get_diff(k) >= K_MEANS_ACCEPTABLE_DIFF
+
+    def _is_known(self, k):
+        return k in self.inertias and (k == 1 or k - 1 in self.inertias)
+
+    def _can_be_selected(self, k):
+        # both strategies select an acceptable k whose successor is not
+        # acceptable, so the centroids of any other k can be dropped
+        if self._is_known(k) and not self.is_acceptable(k):
+            return False
+        return not (self._is_known(k + 1) and self.is_acceptable(k + 1))
+
+
+def _select_k_linearly(sweep, max_k, num_probes):
+    """
+    the first k whose inertia improvement is too small, minus one; the next
+    `num_probes` values of k are fitted together
+    """
     k = 1
-    last_inertia_average = VERY_HIGH_INERTIA
-    while k_limit == -1 or k <= k_limit:
-        inertia_sum = 0
-        for i in range(K_MEANS_RETRY):
-            kmeans = KMeans(n_clusters=k).fit(documents['vectors'])
-            inertia_sum += kmeans.inertia_
-        inertia_average = inertia_sum / K_MEANS_RETRY
-        diff = last_inertia_average - inertia_average
-
-        print('k = %d;' % k, 'inertia = %f;' % inertia_average, 'diff = %s' %
-              (str(diff) if diff < 1000000 else 'huge!'))
-
-        if diff < K_MEANS_ACCEPTABLE_DIFF:
+    while k <= max_k:
+        probes = list(range(k, min(k + num_probes, max_k + 1)))
+        sweep.evaluate(probes)
+        for k in probes:
+            if not sweep.is_acceptable(k):
+                return k - 1
+        k += 1
+    return max_k
+
+
+def _select_k_bracketed(sweep, max_k, num_probes):
+    """
+    same rule as _select_k_linearly assuming the improvement shrinks as k
+    grows: double k until the improvement is too small, then narrow that
+    bracket down with `num_probes` evenly spaced values of k at a time
+    """
+    acceptable_k, unacceptable_k = 1, 2
+    while True:
+        unacceptable_k = min(unacceptable_k, max_k)
+        sweep.evaluate([unacceptable_k - 1, unacceptable_k])
+        if not sweep.is_acceptable(unacceptable_k):
             break
-        else:
-            last_inertia_average = inertia_average
-            k += 1
-    k -= 1
-    print('selected k = %d;' % k)
-    return k
+        if unacceptable_k == max_k:
+            return max_k
+        acceptable_k, unacceptable_k = unacceptable_k, unacceptable_k * 2
 
+    while unacceptable_k - acceptable_k > 1:
+        step = (unacceptable_k - acceptable_k) / (num_probes + 1)
+        probes = sorted(set(
+            min(max(int(round(acceptable_k + step * i)), acceptable_k + 1),
+                unacceptable_k - 1)
+            for i in range(1, num_probes + 1)
+        ))
+        sweep.evaluate(chain.from_iterable((k - 1, k) for k in probes))
+        for k in probes:
+            if not sweep.is_acceptable(k):
+                unacceptable_k = k
+                break
+            acceptable_k = k
+    return unacceptable_k - 1
 
-def _get_cluster_update_operations(k, documents):
-    kmeans = KMeans(n_clusters=k).fit(documents['vectors'])
-    for index, label_id in enumerate(kmeans.labels_.tolist()):
+
+K_SELECTION_STRATEGIES = {
+    'linear': _select_k_linearly,
+    'bracketed': _select_k_bracketed,
+}
+
+
+def _get_k(k_limit, documents, strategy='linear', estimator='kmeans',
+           workers=None, seed=None):
+    """
+    returns the selected k and the best of its fitted models
+    """
+    k_limit = int(k_limit)
+    num_documents = documents['vectors'].shape[0]
+    max_k = num_documents if k_limit == -1 else \
+        max(1, min(k_limit, num_documents))
+    workers = workers or os.cpu_count() or 1
+    num_probes = max(1, workers // K_MEANS_RETRY)
+    if seed is None:
+        seed = np.random.randint(2 ** 30)
+
+    start = perf_counter()
+    # the pool forks its processes on the first fit, after this is set
+    inherited = multiprocessing.get_start_method() == 'fork'
+    if inherited:
+        _k_means_worker['vectors'] = documents['vectors']
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            sweep = _KSweep(executor, seed, estimator,
+                            None if inherited else documents['vectors'])
+            k = K_SELECTION_STRATEGIES[strategy](sweep, max_k, num_probes)
+            sweep.evaluate([k])
+    finally:
+        _k_means_worker.clear()
+    print('selected k = %d;' % k, 'strategy = %s;' % strategy,
+          'estimator = %s;' % estimator, 'fits = %d;' % sweep.num_fits,
+          'seconds = %.1f;' % (perf_counter() - start))
+    return k, sweep.models[k]
+
+
+CLUSTER_SUMMARY_DOC_ID = 'clusters'
+# leaves documents that already have the cluster untouched
+CLUSTER_UPDATE_SCRIPT = (
+    "if (ctx._source['cluster.id'] == params.id && "
+    "ctx._source['cluster.label'] == params.label) { ctx.op = 'noop' } "
+    "else { ctx._source['cluster.id'] = params.id; "
+    "ctx._source['cluster.label'] = params.label }"
+)
+
+
+def _get_label_text(cluster_labels, label_id):
+    return ' '.join(cluster_labels[label_id])
+
+
+def _get_cluster_update_operations(document_ids, labels, cluster_labels):
+    for document_id, label_id in zip(document_ids, labels.tolist()):
         yield {
             '_op_type': 'update',
             '_index': INDEX_NAME,
             '_type': DOC_TYPE,
-            '_id': documents['ids'][index],
+            '_id': document_id,
             'doc': {
                 'cluster.id': label_id,
+                'cluster.label': _get_label_text(cluster_labels, label_id),
             }
         }
 
 
-def _get_mutual_information(feature, label_id):
+def _write_clusters_per_document(document_ids, labels, cluster_labels,
+                                 client):
+    """
+    one partial update of every document, 100 to a bulk request
+    """
+    num_updated, _ = bulk(client, _get_cluster_update_operations(
+        document_ids, labels, cluster_labels), stats_only=False,
+        chunk_size=100)
+    return -(-len(document_ids) // 100), num_updated
+
+
+def _get_current_clusters(client):
+    """
+    (cluster id, cluster label) of every indexed document, scanned without
+    the rest of their source
+    """
+    client.indices.refresh(index=INDEX_NAME)  # makes earlier updates visible
+    return {
+        document['_id']: (document['_source'].get('cluster.id'),
+                          document['_source'].get('cluster.label'))
+        for document in scan(client, query={
+            '_source': ['cluster.id', 'cluster.label'],
+            'query': {'match_all': {}},
+        }, index=INDEX_NAME, doc_type=DOC_TYPE)
+    }
+
+
+def _update_cluster_by_query(client, label_id, label_text, query):
+    # a document written concurrently (by index, which assigns clusters
+    # itself) is skipped instead of failing the whole request
+    response = client.update_by_query(index=INDEX_NAME, doc_type=DOC_TYPE,
+                                      conflicts='proceed', body={
+                                          'query': query,
+                                          'script': {
+                                              'inline': CLUSTER_UPDATE_SCRIPT,
+                                              'lang': 'painless',
+                                              'params': {
+                                                  'id': label_id,
+                                                  'label': label_text,
+                                              },
+                                          },
+                                      })
+    metrics.count('write_back_conflicts', response['version_conflicts'])
+    return response['updated']
+
+
+def _write_clusters_grouped(document_ids, labels, cluster_labels, client,
+                            workers=CLUSTER_UPDATE_WORKERS,
+                            batch_size=CLUSTER_UPDATE_BATCH_SIZE):
+    """
+    skip the documents whose cluster did not change and update the others
+    with one update by query per cluster and `batch_size` ids, `workers` of
+    them at a time
+    """
+    current_clusters = _get_current_clusters(client)
+    cluster_document_ids = {}
+    for document_id, label_id in zip(document_ids, labels.tolist()):
+        label_text = _get_label_text(cluster_labels, label_id)
+        if current_clusters.get(document_id) != (label_id, label_text):
+            cluster_document_ids.setdefault(label_id, []).append(document_id)
+    requests = [
+        (label_id, _get_label_text(cluster_labels, label_id),
+         {'ids': {'values': ids[start:start + batch_size]}})
+        for label_id, ids in sorted(cluster_document_ids.items())
+        for start in range(0, len(ids), batch_size)
+    ]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        num_updated = sum(executor.map(
+            lambda request: _update_cluster_by_query(client, *request),
+            requests))
+    return len(requests), num_updated
+
+
+# a write-back stores cluster ids and labels in the index and returns the
+# number of requests and of updated documents
+CLUSTER_WRITE_BACKS = {
+    'grouped': _write_clusters_grouped,
+    'per-document': _write_clusters_per_document,
+}
+
+
+def _print_write_back(write_back, num_documents, num_requests, num_updated,
+                      seconds):
+    print('write-back = %s;' % write_back,
+          'updated = %d;' % num_updated,
+          'unchanged = %d;' % (num_documents - num_updated),
+          'requests = %d;' % num_requests,
+          'seconds = %.2f;' % seconds)
+
+
+def _write_clusters(document_ids, labels, cluster_labels, write_back,
+                    client=ES):
+    start = perf_counter()
+    num_requests, num_updated = CLUSTER_WRITE_BACKS[write_back](
+        document_ids, labels, cluster_labels, client)
+    _print_write_back(write_back, len(document_ids), num_requests,
+                      num_updated, perf_counter() - start)
+
+
+def _save_cluster_summary(cluster_labels, cluster_sizes, client=ES):
+    client.index(index=META_INDEX_NAME, doc_type=META_DOC_TYPE,
+                 id=CLUSTER_SUMMARY_DOC_ID, body={
+                     'clusters': [{
+                         'id': label_id,
+                         'labels': cluster_labels[label_id],
+                         'size': int(cluster_sizes[label_id]),
+                     } for label_id in range(len(cluster_labels))],
+                     'updated': datetime.now().isoformat(),
+                 })
+
+
+def _mutual_information(n11, n10, n01, n00):
     """
     http://nlp.stanford.edu/IR-book/html/htmledition/mutual-information-1.html
+    element-wise over arrays of document counts; like the scalar formula, a
+    term whose count is zero adds nothing and empty marginals count as one
     """
-    n11 = ES.count(index=INDEX_NAME, body={
+    n11, n10, n01, n00 = [np.asarray(count, dtype=np.float64)
+                          for count in (n11, n10, n01, n00)]
+    n1x = np.maximum(n10 + n11, 1.0)
+    nx1 = np.maximum(n01 + n11, 1.0)
+    n0x = np.maximum(n00 + n01, 1.0)
+    nx0 = np.maximum(n00 + n10, 1.0)
+    n = np.maximum(n00 + n01 + n10 + n11, 1.0)
+
+    result = 0
+    with np.errstate(divide='ignore', invalid='ignore'):  # log2(0) is unused
+        for count, row_total, column_total in [(n11, n1x, nx1),
+                                               (n01, n0x, nx1),
+                                               (n10, n1x, nx0),
+                                               (n00, n0x, nx0)]:
+            result += np.where(count > 0, (count / n) * np.log2(
+                (n * count) / (row_total * column_total)), 0)
+    return result
+
+
+def _get_presence(vectors):
+    presence = sparse.csr_matrix(vectors, copy=True)
+    presence.eliminate_zeros()
+    presence.data = np.ones_like(presence.data)
+    return presence
+
+
+def _get_cluster_feature_counts(presence, labels, k):
+    """
+    sparse k x features matrix of the number of documents of each cluster
+    that contain each feature
+    """
+    num_documents = presence.shape[0]
+    cluster_indicator = sparse.csr_matrix(
+        (np.ones(num_documents), (np.arange(num_documents), labels)),
+        shape=(num_documents, k))
+    return cluster_indicator.T.dot(presence)
+
+
+def _get_contingency_counts_from_totals(n11, document_frequencies,
+                                        cluster_sizes, num_documents):
+    n10 = np.asarray(document_frequencies).reshape(1, -1) - n11
+    n01 = np.asarray(cluster_sizes)[:, np.newaxis] - n11
+    n00 = num_documents - n11 - n10 - n01
+    return n11, n10, n01, n00
+
+
+def _get_contingency_counts(vectors, labels, k):
+    """
+    (n11, n10, n01, n00) as k x features arrays: the number of documents
+    that do / do not contain each feature and are / are not in each cluster
+    """
+    presence = _get_presence(vectors)
+    return _get_contingency_counts_from_totals(
+        _get_cluster_feature_counts(presence, labels, k).toarray(),
+        presence.sum(axis=0), np.bincount(labels, minlength=k),
+        presence.shape[0])
+
+
+def _get_mutual_information(feature, label_id, client=ES):
+    """
+    the mutual information of one feature and cluster from four count
+    queries (the vectorized _get_cluster_labels does without them; kept for
+    'benchmarks.py labels')
+    """
+    n11 = client.count(index=INDEX_NAME, body={
         'query': {
             'bool': {
                 'must': [
@@ -93,7 +512,7 @@ def _get_mutual_information(feature, label_id):
             },
         },
     })['count']
-    n10 = ES.count(index=INDEX_NAME, body={
+    n10 = client.count(index=INDEX_NAME, body={
         'query': {
             'bool': {
                 'must': [
@@ -116,7 +535,7 @@ def _get_mutual_information(feature, label_id):
             },
         },
     })['count']
-    n01 = ES.count(index=INDEX_NAME, body={
+    n01 = client.count(index=INDEX_NAME, body={
         'query': {
             'bool': {
                 'must': [
@@ -139,7 +558,7 @@ def _get_mutual_information(feature, label_id):
             },
         },
     })['count']
-    n00 = ES.count(index=INDEX_NAME, body={
+    n00 = client.count(index=INDEX_NAME, body={
         'query': {
             'bool': {
                 'must_not': [
@@ -160,49 +579,301 @@ def _get_mutual_information(feature, label_id):
             },
         },
     })['count']
-    n1x = float(n10 + n11) or 1.0
-    nx1 = float(n01 + n11) or 1.0
-    n0x = float(n00 + n01) or 1.0
-    nx0 = float(n00 + n10) or 1.0
-    n = float(n00 + n01 + n10 + n11) or 1.0
+    return float(_mutual_information(n11, n10, n01, n00))
 
-    result = 0
-    try:
-        result += (n11 / n) * math.log2((n * n11) / (n1x * nx1))
-    except ValueError:
-        pass
-    try:
-        result += (n01 / n) * math.log2((n * n01) / (n0x * nx1))
-    except ValueError:
-        pass
-    try:
-        result += (n10 / n) * math.log2((n * n10) / (n1x * nx0))
-    except ValueError:
-        pass
-    try:
-        result += (n00 / n) * math.log2((n * n00) / (n0x * nx0))
-    except ValueError:
-        pass
-    return result
 
+def _print_cluster_labels(mutual_information, features):
+    """
+    print and return the best labels of every cluster
+    """
+    labels = []
+    for cluster_id in range(mutual_information.shape[0]):
+        # stable, so ties keep the vocabulary order like sorted() did
+        best_features = np.argsort(-mutual_information[cluster_id],
+                                   kind='mergesort')[:CLUSTER_LABEL_COUNT]
+        cluster_labels = [features[feature_index]
+                          for feature_index in best_features]
+        print('cluster_id = %s;' % cluster_id,
+              'labels = %s;' % str(cluster_labels))
+        labels.append(cluster_labels)
+    return labels
 
-def _get_cluster_labels(k, features):
+
+def _get_cluster_labels(k, features, vectors, labels):
     print('finding cluster labels...')
-    cluster_to_labels = {}
-    for i in range(k):
-        cluster_to_labels[i] = []
-        for feature in features:
-            cluster_to_labels[i].append([_get_mutual_information(feature, i),
-                                         feature])
-    for cluster_id, possible_cluster_labels in cluster_to_labels.items():
-        labels = [item[1] for item in sorted(possible_cluster_labels,
-                                             key=lambda x: -x[0])[:5]]
-        print('cluster_id = %s;' % cluster_id, 'labels = %s;' % str(labels))
-
-
-def cluster(k_limit):
-    documents, features = _get_documents_and_features()
-    k = _get_k(k_limit, documents)
-    bulk(ES, _get_cluster_update_operations(k, documents), stats_only=False,
-         chunk_size=100)
-    _get_cluster_labels(k, features)
+    return _print_cluster_labels(_mutual_information(
+        *_get_contingency_counts(vectors, labels, k)), features)
+
+
+def _scan_batches(batch_size, with_clusters=False):
+    """
+    (ids, analyzed texts) of every indexed document, `batch_size` at a time,
+    followed with `with_clusters` by their current (cluster id, cluster
+    label)
+    """
+    batch = []
+    for document in metrics.timed_iter('scan', scan(ES, query={
+        '_source': {'excludes': ['links']},
+        'query': {'match_all': {}},
+    }, index=INDEX_NAME, doc_type=DOC_TYPE, size=batch_size)):
+        source = document['_source']
+        item = (document['_id'], get_analyzed_text(source))
+        if with_clusters:
+            item += ((source.get('cluster.id'), source.get('cluster.label')),)
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield tuple(zip(*batch))
+            batch = []
+    if batch:
+        yield tuple(zip(*batch))
+
+
+class _StreamingVectorizer():
+    """
+    tf-idf over hashed terms, with document frequencies counted batch by
+    batch by partial_fit(), so neither a vocabulary nor the corpus is kept
+    in memory. every hash bucket is named after the first term seen in it
+    """
+
+    def __init__(self, num_features):
+        self.hashing_vectorizer = HashingVectorizer(
+            n_features=num_features, non_negative=True, norm=None)
+        self.document_frequencies = np.zeros(num_features)
+        self.num_documents = 0
+        self.idf = None
+        self.feature_names = np.empty(num_features, dtype=object)
+
+    def _name_features(self, texts):
+        analyzer = self.hashing_vectorizer.build_analyzer()
+        terms = sorted(set(chain.from_iterable(analyzer(text)
+                                               for text in texts)))
+        if not terms:
+            return
+        term_vectors = self.hashing_vectorizer.transform(terms)
+        single_bucket = np.diff(term_vectors.indptr) == 1
+        buckets = term_vectors.indices[term_vectors.indptr[:-1][
+            single_bucket]]
+        terms = np.array(terms, dtype=object)[single_bucket]
+        unnamed = np.equal(self.feature_names[buckets], None)
+        self.feature_names[buckets[unnamed]] = terms[unnamed]
+
+    def partial_fit(self, texts):
+        counts = self.hashing_vectorizer.transform(texts)
+        counts.sum_duplicates()
+        self.document_frequencies += np.bincount(
+            counts.indices, minlength=len(self.document_frequencies))
+        self.num_documents += len(texts)
+        self._name_features(texts)
+        # smoothed like TfidfVectorizer's
+        self.idf = np.log((1.0 + self.num_documents) /
+                          (1.0 + self.document_frequencies)) + 1
+
+    def transform(self, texts):
+        return normalize(self.hashing_vectorizer.transform(texts).dot(
+            sparse.diags(self.idf, 0)))
+
+
+def _fit_streaming_model(get_batches, k, num_features, seed=None):
+    """
+    `get_batches()` must return a new iterator of (ids, texts) batches each
+    time it is called; one pass counts document frequencies and another
+    trains MiniBatchKMeans with partial_fit
+    """
+    vectorizer = _StreamingVectorizer(num_features)
+    for _, texts in get_batches():
+        with metrics.span('vectorize'):
+            vectorizer.partial_fit(texts)
+    print('documents = %d;' % vectorizer.num_documents)
+    if vectorizer.num_documents < k:
+        raise ValueError('cannot make %d clusters of %d documents' %
+                         (k, vectorizer.num_documents))
+    model = MiniBatchKMeans(n_clusters=k, random_state=seed)
+    pending_vectors = []
+    for _, texts in get_batches():
+        with metrics.span('vectorize'):
+            pending_vectors.append(vectorizer.transform(texts))
+        # partial_fit needs at least k documents, so small batches are
+        # merged; the last few documents may only be assigned, not trained on
+        if sum(vectors.shape[0] for vectors in pending_vectors) >= k:
+            with metrics.span('kmeans'):
+                model.partial_fit(sparse.vstack(pending_vectors))
+            pending_vectors = []
+    return vectorizer, model
+
+
+def _assign_streamed_batch(texts, vectorizer, model):
+    """
+    returns the vectors of `texts`, their cluster ids and their distances to
+    the centroids of those clusters
+    """
+    with metrics.span('vectorize'):
+        vectors = vectorizer.transform(texts)
+    with metrics.span('kmeans'):
+        distances = model.transform(vectors)
+    labels = distances.argmin(axis=1)
+    return vectors, labels, distances[np.arange(len(labels)), labels]
+
+
+def _get_streamed_totals(get_batches, vectorizer, model):
+    """
+    assign every document and return the cluster x feature document counts
+    ('n11'), the cluster sizes ('sizes') and the sum of the distances to the
+    centroids ('distance')
+    """
+    k = model.n_clusters
+    totals = {
+        'n11': np.zeros((k, len(vectorizer.idf))),
+        'sizes': np.zeros(k),
+        'distance': 0.0,
+    }
+    for _, texts in get_batches():
+        vectors, labels, distances = _assign_streamed_batch(
+            texts, vectorizer, model)
+        totals['distance'] += distances.sum()
+        totals['sizes'] += np.bincount(labels, minlength=k)
+        with metrics.span('labeling'):
+            counts = _get_cluster_feature_counts(
+                _get_presence(vectors), labels, k).tocoo()
+            np.add.at(totals['n11'], (counts.row, counts.col), counts.data)
+    return totals
+
+
+def _write_streamed_clusters(get_batches, vectorizer, model, cluster_labels,
+                             local_clusters, client=ES,
+                             batch_size=CLUSTER_UPDATE_BATCH_SIZE):
+    """
+    assign every document again and update the ones whose cluster id or
+    label changed, with one update by query per cluster and `batch_size`
+    ids; `get_batches()` must return batches with the current clusters and
+    `local_clusters` is a LocalClusterWriter or None. returns the number of
+    requests and of updated documents
+    """
+    label_texts = [_get_label_text(cluster_labels, label_id)
+                   for label_id in range(len(cluster_labels))]
+    changed_ids = {}  # cluster id -> ids of the documents moving to it
+    num_requests = 0
+    num_updated = 0
+
+    def send(label_id):
+        nonlocal num_requests, num_updated
+        num_requests += 1
+        num_updated += _update_cluster_by_query(
+            client, label_id, label_texts[label_id],
+            {'ids': {'values': changed_ids.pop(label_id)}})
+
+    for ids, texts, current_clusters in get_batches():
+        _, labels, _ = _assign_streamed_batch(texts, vectorizer, model)
+        if local_clusters is not None:
+            local_clusters.update(ids, labels)
+        for document_id, current_cluster, label_id in zip(
+                ids, current_clusters, labels.tolist()):
+            if current_cluster == (label_id, label_texts[label_id]):
+                continue
+            changed_ids.setdefault(label_id, []).append(document_id)
+            if len(changed_ids[label_id]) == batch_size:
+                send(label_id)
+    for label_id in sorted(changed_ids):
+        send(label_id)
+    return num_requests, num_updated
+
+
+def cluster_streaming(k, batch_size=STREAM_BATCH_SIZE,
+                      num_features=STREAM_FEATURES):
+    """
+    cluster into exactly `k` clusters in bounded memory: documents are
+    scanned `batch_size` at a time in four passes (document frequencies,
+    training, assignment for the labels, assignment for the write-back) and
+    only the documents whose cluster changed are written, grouped per
+    cluster
+    """
+    def get_batches():
+        return _scan_batches(batch_size)
+
+    vectorizer, model = _fit_streaming_model(get_batches, k, num_features)
+    totals = _get_streamed_totals(get_batches, vectorizer, model)
+    metrics.count('clustered_documents', vectorizer.num_documents)
+
+    print('finding cluster labels...')
+    with metrics.span('labeling'):
+        mutual_information = _mutual_information(
+            *_get_contingency_counts_from_totals(
+                totals['n11'], vectorizer.document_frequencies,
+                totals['sizes'], vectorizer.num_documents))
+        mutual_information[:, np.equal(vectorizer.feature_names, None)] = \
+            -np.inf  # buckets no term fell into
+        cluster_labels = _print_cluster_labels(mutual_information,
+                                               vectorizer.feature_names)
+
+    local_clusters = LocalClusterWriter() \
+        if os.path.exists(LOCAL_INDEX_DIR) else None
+    start = perf_counter()
+    try:
+        with metrics.span('write_back'):
+            num_requests, num_updated = _write_streamed_clusters(
+                lambda: _scan_batches(batch_size, with_clusters=True),
+                vectorizer, model, cluster_labels, local_clusters)
+    finally:
+        bump_index_generation('cluster')
+    _print_write_back('grouped', vectorizer.num_documents, num_requests,
+                      num_updated, perf_counter() - start)
+    if local_clusters is not None:
+        local_clusters.close()
+    _save_cluster_summary(cluster_labels, totals['sizes'])
+    version = save_cluster_model({
+        'vectorizer': 'hashing',
+        'num_features': num_features,
+        'reduction': 'none',
+        'num_documents': vectorizer.num_documents,
+        'mean_distance': totals['distance'] / vectorizer.num_documents,
+        'labels': cluster_labels,
+    }, {
+        'idf': vectorizer.idf,
+        'centroids': model.cluster_centers_,
+    })
+    print('saved cluster model version %d;' % version)
+
+
+def _save_model(documents, features, reduction, model, cluster_labels):
+    distances = model.transform(documents['vectors']).min(axis=1)
+    version = save_cluster_model({
+        'vectorizer': 'vocabulary',
+        'reduction': reduction,
+        'num_documents': len(documents['ids']),
+        'mean_distance': float(distances.mean()),
+        'labels': cluster_labels,
+    }, dict(documents['reduction_arrays'], idf=documents['idf'],
+            centroids=model.cluster_centers_), features)
+    print('saved cluster model version %d;' % version)
+
+
+def cluster(k_limit, k_strategy='linear', estimator='kmeans', workers=None,
+            reduction='none', num_components=REDUCTION_COMPONENTS, min_df=0,
+            max_df=1.0, rebuild_features=False, write_back='grouped'):
+    """
+    `k_strategy` is a key of K_SELECTION_STRATEGIES, `estimator` a key of
+    K_MEANS_ESTIMATORS, `workers` the number of k selection processes,
+    `reduction` a key of REDUCTIONS and `write_back` a key of
+    CLUSTER_WRITE_BACKS
+    """
+    documents, features = _get_documents_and_features(min_df, max_df,
+                                                      rebuild_features)
+    metrics.count('clustered_documents', len(documents['ids']))
+    with metrics.span('reduce'):
+        _reduce_documents(documents, reduction, num_components)
+    with metrics.span('kmeans'):
+        k, model = _get_k(k_limit, documents, k_strategy, estimator,
+                          workers)
+    labels = model.labels_
+    with metrics.span('labeling'):
+        cluster_labels = _get_cluster_labels(
+            k, features, documents['term_vectors'], labels)
+    try:
+        with metrics.span('write_back'):
+            _write_clusters(documents['ids'], labels, cluster_labels,
+                            write_back)
+    finally:
+        bump_index_generation('cluster')
+    _save_cluster_summary(cluster_labels, np.bincount(labels, minlength=k))
+    if os.path.exists(LOCAL_INDEX_DIR):
+        update_clusters(dict(zip(documents['ids'], labels.tolist())))
+    _save_model(documents, features, reduction, model, cluster_labels)
@@ -0,0 +1,163 @@
+"""
+persisted cluster model: every cluster run saves what it fitted (the
+vectorizer's vocabulary or hashing parameters, the idf, the reduction,
+the centroids and the cluster labels) to CLUSTER_MODEL_DIR/model-NNNNN, and
+CLUSTER_MODEL_DIR/current names the newest one. index.py loads it to give
+new and changed documents their nearest centroid without a refit; numpy
+arrays are memory-mapped
+"""
+import json
+import os
+import shutil
+from datetime import datetime
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, \
+    HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from settings import CLUSTER_MODEL_DIR, CLUSTER_MODEL_KEEP
+
+
+MODEL_FORMAT = 1
+CURRENT_FILE_NAME = 'current'
+META_FILE_NAME = 'meta.json'
+VOCABULARY_FILE_NAME = 'vocabulary.json'
+
+
+def _get_model_path(model_dir, version):
+    return os.path.join(model_dir, 'model-%05d' % version)
+
+
+def _get_current_version(model_dir):
+    try:
+        with open(os.path.join(model_dir, CURRENT_FILE_NAME), 'r') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _get_saved_versions(model_dir):
+    versions = []
+    for file_name in os.listdir(model_dir):
+        prefix, _, version = file_name.partition('-')
+        if prefix == 'model' and version.isdigit():
+            versions.append(int(version))
+    return versions
+
+
+def save_cluster_model(meta, arrays, vocabulary=None,
+                       model_dir=CLUSTER_MODEL_DIR):
+    """
+    write a new model version and make it the current one; `meta` must have
+    'vectorizer' ('vocabulary' with `vocabulary` given, or 'hashing' with
+    'num_features'), 'reduction', 'mean_distance' and 'labels', and `arrays`
+    'idf', 'centroids' and the arrays of the reduction. returns the version
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    # a model may have been saved without `current` being written
+    version = max(_get_saved_versions(model_dir) +
+                  [_get_current_version(model_dir) or 0]) + 1
+    path = _get_model_path(model_dir, version)
+    temporary_path = path + '.tmp'
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    os.makedirs(temporary_path)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(temporary_path, name + '.npy'), array)
+    if vocabulary is not None:
+        with open(os.path.join(temporary_path, VOCABULARY_FILE_NAME),
+                  'w') as vocabulary_file:
+            vocabulary_file.write(json.dumps(vocabulary, ensure_ascii=False))
+    meta = dict(meta, format=MODEL_FORMAT, version=version,
+                created=datetime.now().isoformat())
+    with open(os.path.join(temporary_path, META_FILE_NAME), 'w') as meta_file:
+        meta_file.write(json.dumps(meta, ensure_ascii=False, indent=2))
+    os.rename(temporary_path, path)
+
+    current_path = os.path.join(model_dir, CURRENT_FILE_NAME)
+    with open(current_path + '.tmp', 'w') as current_file:
+        current_file.write('%d\n' % version)
+    os.replace(current_path + '.tmp', current_path)
+
+    for old_version in range(1, version - CLUSTER_MODEL_KEEP + 1):
+        shutil.rmtree(_get_model_path(model_dir, old_version),
+                      ignore_errors=True)
+    return version
+
+
+class ClusterModel():
+    def __init__(self, path):
+        with open(os.path.join(path, META_FILE_NAME), 'r') as meta_file:
+            self.meta = json.loads(meta_file.read())
+        if self.meta['format'] != MODEL_FORMAT:
+            raise ValueError('unsupported cluster model format %s' %
+                             self.meta['format'])
+        self.path = path
+        self.version = self.meta['version']
+        self.idf = self._load('idf')
+        self.centroids = self._load('centroids')
+        self.centroid_norms = (np.asarray(self.centroids) ** 2).sum(axis=1)
+
+        if self.meta['vectorizer'] == 'hashing':
+            self.vectorizer = HashingVectorizer(
+                n_features=self.meta['num_features'], non_negative=True,
+                norm=None)
+        else:
+            with open(os.path.join(path, VOCABULARY_FILE_NAME),
+                      'r') as vocabulary_file:
+                vocabulary = json.loads(vocabulary_file.read())
+            self.vectorizer = CountVectorizer(vocabulary={
+                term: index for index, term in enumerate(vocabulary)})
+
+        if self.meta['reduction'] == 'svd':
+            self.components = self._load('svd_components')
+        elif self.meta['reduction'] == 'projection':
+            self.components = sparse.csr_matrix((
+                self._load('projection_data'),
+                self._load('projection_indices'),
+                self._load('projection_indptr'),
+            ), shape=tuple(self._load('projection_shape')))
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+
+    def _get_vectors(self, texts):
+        # the same tf-idf as cluster() fitted, followed by its reduction
+        vectors = normalize(self.vectorizer.transform(texts).dot(
+            sparse.diags(np.asarray(self.idf), 0)))
+        if self.meta['reduction'] == 'svd':
+            vectors = normalize(vectors.dot(np.asarray(self.components).T))
+        elif self.meta['reduction'] == 'projection':
+            vectors = vectors.dot(self.components.T)
+        return vectors
+
+    def assign(self, texts):
+        """
+        returns the nearest centroid of each of the analyzed `texts` and the
+        distance to it
+        """
+        vectors = self._get_vectors(texts)
+        if sparse.issparse(vectors):
+            vector_norms = np.asarray(vectors.multiply(vectors).sum(axis=1))
+            products = np.asarray(vectors.dot(np.asarray(self.centroids).T))
+        else:
+            vector_norms = (vectors ** 2).sum(axis=1)[:, np.newaxis]
+            products = vectors.dot(np.asarray(self.centroids).T)
+        squared_distances = vector_norms.reshape(-1, 1) - 2 * products + \
+            self.centroid_norms
+        labels = squared_distances.argmin(axis=1)
+        distances = np.sqrt(np.maximum(
+            squared_distances[np.arange(len(labels)), labels], 0))
+        return labels, distances
+
+
+def load_cluster_model(model_dir=CLUSTER_MODEL_DIR):
+    """
+    the current model, or None if cluster has not saved one yet
+    """
+    version = _get_current_version(model_dir)
+    if version is None:
+        return None
+    return ClusterModel(_get_model_path(model_dir, version))
@@ -1,13 +1,20 @@
 import json
 import os
 import sys
-from copy import deepcopy
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin, urlparse
 
 import urllib3
-from bs4 import BeautifulSoup
 
-from settings import DEFAULT_PAGES_DIR
+import metrics
+from extraction import EXTRACTORS
+from frontier import BloomFilter, Frontier, HashedUrlSet
+from page_cache import PageCache
+from page_store import open_page_store
+from settings import CRAWL_CHECKPOINT_FILE_NAME, CRAWL_CHECKPOINT_INTERVAL, \
+    CRAWL_CONCURRENCY, CRAWL_FRONTIER_SPILL_FILE_NAME, \
+    CRAWL_PER_HOST_CONCURRENCY, DEFAULT_EXTRACTOR, FRONTIER_MEMORY_LIMIT
 
 
 urllib3.disable_warnings()  # InsecureRequestWarning
@@ -15,9 +22,30 @@ urllib3.disable_warnings()  # InsecureRequestWarning
 
 class Page():
     @staticmethod
-    def _get_page_source(url):
-        http = urllib3.PoolManager()
-        response = http.request('GET', url)
+    def _get_page_source(url, http=None, page_cache=None, offline=False):
+        """
+        with a page cache, a cached page is revalidated with a conditional
+        request, or returned as is when offline (None if it is not cached)
+        """
+        cached_page = page_cache and page_cache.get(url)
+        if offline:
+            return cached_page and cached_page.body
+
+        headers = {}
+        if cached_page and cached_page.etag:
+            headers['If-None-Match'] = cached_page.etag
+        if cached_page and cached_page.last_modified:
+            headers['If-Modified-Since'] = cached_page.last_modified
+        http = http or urllib3.PoolManager()
+        with metrics.span('fetch'):
+            response = http.request('GET', url, headers=headers)
+        metrics.count('fetched_pages')
+        metrics.count('fetched_bytes', len(response.data))
+        if cached_page and response.status == 304:  # not modified
+            return cached_page.body
+        if page_cache and response.status == 200:
+            page_cache.put(url, response.data, response.headers.get('ETag'),
+                           response.headers.get('Last-Modified'))
         return response.data
 
     @staticmethod
@@ -48,38 +76,32 @@ class Page():
 
         return url
 
-    def __init__(self, link):
+    def __init__(self, link, page_source=None, extractor=DEFAULT_EXTRACTOR):
         self.link = link
 
         self.data = {'page_link': link}
-        page_source = Page._get_page_source(link)
-        page_soup = BeautifulSoup(page_source, 'html.parser')
+        if page_source is None:
+            page_source = Page._get_page_source(link)
+        with metrics.span('parse'):
+            title_text, worthy_contents, links = \
+                EXTRACTORS[extractor](page_source)
 
-        # remove script tags
-        [s.extract() for s in page_soup('script')]
-
-        title_text = page_soup.find(id='firstHeading').get_text().strip()
         self.data['title'] = title_text
 
-        content_soup = page_soup.find(id='mw-content-text')
-        worthy_content_soups = content_soup.find_all(['p', 'blockquote'],
-                                                     recursive=False)
         introduction_set = False
         self.data['content'] = []
         self.data['introduction'] = ''
-        for worthy_content_soup in worthy_content_soups:
-            worthy_content_text = worthy_content_soup.get_text().strip()
+        for tag_name, worthy_content_text in worthy_contents:
             if worthy_content_text:  # don't append empty strings
-                if worthy_content_soup.name == 'p' and not introduction_set:
+                if tag_name == 'p' and not introduction_set:
                     self.data['introduction'] = worthy_content_text
                     introduction_set = True
                 else:
                     self.data['content'].append(worthy_content_text)
 
         self.data['links'] = []
-        for link_in_page in page_soup.find_all('a'):
-            url = self._clean_url(link_in_page.get('href'))
-            text = link_in_page.get_text().strip()
+        for href, text in links:
+            url = self._clean_url(href)
             if url:  # don't append empty links
                 self.data['links'].append({
                     'url': url,
@@ -88,6 +110,13 @@ class Page():
         if 'introduction' not in self.data:
             print("OH OH!", link)
 
+    @classmethod
+    def from_json(cls, data):
+        page = cls.__new__(cls)
+        page.link = data['page_link']
+        page.data = data
+        return page
+
     def crawlable_urls(self):
         return [x['url'] for x in self.data['links']]
 
@@ -100,23 +129,150 @@ def _update_progress(count, max):
     sys.stdout.flush()
 
 
-def crawl(out_degree, max_pages, input_pages, pages_dir):
-    queue = list(deepcopy(input_pages))
-    index = 0
-    crawled_page_objects = list()
-    crawled_page_urls = set()
-    _update_progress(0, max_pages)
-    while len(crawled_page_urls) < max_pages and index < len(queue):
-        page_url = queue[index]
-        if page_url not in crawled_page_urls:
-            page = Page(page_url)
-            crawled_page_objects.append(page)
-            queue += page.crawlable_urls()[:out_degree]
-            crawled_page_urls.add(page_url)
-            _update_progress(len(crawled_page_urls), max_pages)
-        index += 1
-    print()  # newline after progress bar
-
-    for i, page in enumerate(crawled_page_objects):
-        with open(os.path.join(pages_dir, '%d.json' % i), 'w') as output_file:
-            output_file.write('%s' % json.dumps(page.json()))
+def _read_page(page_store, page_url):
+    """
+    return the page already written for `page_url` by an interrupted crawl,
+    or None if it was not written. pages are looked up by url rather than by
+    number, since pages skipped offline take a place in the fetch queue but
+    not a number
+    """
+    data = page_store.read_url(page_url)
+    if not data or data.get('page_link') != page_url:
+        return None
+    return Page.from_json(data)
+
+
+def _get_checkpoint_path(pages_dir):
+    return os.path.join(pages_dir, CRAWL_CHECKPOINT_FILE_NAME)
+
+
+def _get_spill_path(pages_dir):
+    return os.path.join(pages_dir, CRAWL_FRONTIER_SPILL_FILE_NAME)
+
+
+def _save_checkpoint(pages_dir, frontier, fetches, num_crawled_pages):
+    checkpoint_path = _get_checkpoint_path(pages_dir)
+    checkpoint = {
+        'num_crawled_pages': num_crawled_pages,
+        # fetched but not yet parsed pages are not crawled yet
+        'frontier': frontier.save(checkpoint_path,
+                                  [fetch[0] for fetch in fetches]),
+    }
+    with open(checkpoint_path + '.tmp', 'w') as checkpoint_file:
+        checkpoint_file.write(json.dumps(checkpoint))
+    os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+
+def _load_checkpoint(pages_dir):
+    checkpoint_path = _get_checkpoint_path(pages_dir)
+    with open(checkpoint_path, 'r') as checkpoint_file:
+        checkpoint = json.loads(checkpoint_file.read())
+    frontier = Frontier.load(checkpoint_path, _get_spill_path(pages_dir),
+                             checkpoint['frontier'])
+    return frontier, checkpoint['num_crawled_pages']
+
+
+def _remove_checkpoint(pages_dir):
+    checkpoint_path = _get_checkpoint_path(pages_dir)
+    for path in [checkpoint_path, checkpoint_path + '.queue',
+                 checkpoint_path + '.seen']:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def crawl(out_degree, max_pages, input_pages, pages_dir,
+          concurrency=CRAWL_CONCURRENCY,
+          per_host_concurrency=CRAWL_PER_HOST_CONCURRENCY, resume=False,
+          checkpoint_interval=CRAWL_CHECKPOINT_INTERVAL,
+          frontier_memory_limit=FRONTIER_MEMORY_LIMIT,
+          bloom_filter_capacity=0, extractor=DEFAULT_EXTRACTOR,
+          page_cache_path=None, offline=False, store_format=None):
+    """
+    breadth-first crawl; up to `concurrency` pages are fetched ahead of the
+    parser (at most `per_host_concurrency` connections per host, all taken
+    from one shared pool) while pages are parsed in queue order, so the
+    result is the same as crawling one page at a time.
+
+    the frontier drops urls it has already seen when they are enqueued
+    (using a bloom filter instead of exact url hashes if
+    `bloom_filter_capacity` is set) and spills to disk beyond
+    `frontier_memory_limit` urls. pages are parsed with the `extractor`
+    backend from extraction.EXTRACTORS.
+
+    raw pages are kept in the page cache at `page_cache_path` (if given) and
+    only downloaded again when they changed. with `offline`, pages are only
+    read from the cache and uncached ones are skipped; without input pages
+    every cached page is re-extracted.
+
+    pages are written to the page store at `pages_dir`, created in
+    `store_format` if it does not exist yet.
+
+    every page is written as soon as it is parsed and the frontier is
+    checkpointed every `checkpoint_interval` pages; with `resume`, crawling
+    continues from the checkpoint and pages written after it are read back
+    from disk instead of being fetched again. without a checkpoint, `resume`
+    starts a new crawl
+    """
+    if resume and not os.path.exists(_get_checkpoint_path(pages_dir)):
+        if not input_pages and not offline:
+            print('no crawl checkpoint to resume in %s' % pages_dir)
+            return
+        print('no crawl checkpoint in %s, starting a new crawl' % pages_dir)
+        resume = False
+    page_store = open_page_store(pages_dir, store_format)
+    page_cache = page_cache_path and PageCache(page_cache_path)
+    if offline and not input_pages:
+        input_pages = page_cache.urls()
+    if resume:
+        frontier, num_crawled_pages = _load_checkpoint(pages_dir)
+    else:
+        seen_set = BloomFilter(bloom_filter_capacity) \
+            if bloom_filter_capacity else HashedUrlSet()
+        frontier = Frontier(_get_spill_path(pages_dir), frontier_memory_limit,
+                            seen_set)
+        frontier.extend(input_pages)
+        num_crawled_pages = 0
+    http = None if offline else \
+        urllib3.PoolManager(maxsize=per_host_concurrency, block=True)
+    fetches = deque()
+    _update_progress(num_crawled_pages, max_pages)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while num_crawled_pages < max_pages:
+                while len(fetches) < concurrency and frontier and \
+                        num_crawled_pages + len(fetches) < max_pages:
+                    page_url = frontier.pop()
+                    page = resume and _read_page(page_store, page_url)
+                    fetch = None if page else executor.submit(
+                        Page._get_page_source, page_url, http, page_cache,
+                        offline)
+                    fetches.append((page_url, page, fetch))
+                if not fetches:
+                    break
+                page_url, page, fetch = fetches[0]
+                if not page:
+                    page_source = fetch.result()
+                    if page_source is None:  # offline and not cached
+                        fetches.popleft()
+                        continue
+                    page = Page(page_url, page_source, extractor)
+                    page_store.write(num_crawled_pages, page.json())
+                fetches.popleft()
+                frontier.extend(page.crawlable_urls()[:out_degree])
+                num_crawled_pages += 1
+                metrics.count('crawled_pages')
+                _update_progress(num_crawled_pages, max_pages)
+                if num_crawled_pages % checkpoint_interval == 0:
+                    _save_checkpoint(pages_dir, frontier, fetches,
+                                     num_crawled_pages)
+    except BaseException:
+        _save_checkpoint(pages_dir, frontier, fetches, num_crawled_pages)
+        raise
+    finally:
+        print()  # newline after progress bar
+        page_store.close()
+        if page_cache:
+            page_cache.close()
+
+    frontier.close()
+    _remove_checkpoint(pages_dir)
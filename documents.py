@@ -0,0 +1,32 @@
+"""
+the documents that index and local_search build from the pages of a page
+store: the page json with its content paragraphs joined and a hash of the
+page, identified by the sha1 of its link
+"""
+import json
+from hashlib import sha1
+
+from page_store import open_page_store
+
+
+ANALYZED_FIELDS = ['title', 'introduction', 'content']
+
+
+def get_document_id(page_link):
+    return sha1(page_link.encode()).hexdigest()
+
+
+def _get_content_hash(document_json):
+    return sha1(json.dumps(document_json, sort_keys=True).encode()).hexdigest()
+
+
+def read_documents(pages_dir):
+    """
+    yield the documents of the page store at `pages_dir` one at a time
+    """
+    page_store = open_page_store(pages_dir)
+    for document_json in page_store:
+        document_json['content_hash'] = _get_content_hash(document_json)
+        document_json['content'] = ' '.join(document_json['content'])
+        yield document_json
+    page_store.close()
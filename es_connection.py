@@ -0,0 +1,19 @@
+"""
+elasticsearch connection that adds every request to the pipeline metrics:
+the round trip, its time and the bytes of its request and response bodies
+"""
+from elasticsearch import Urllib3HttpConnection
+
+import metrics
+
+
+class CountingConnection(Urllib3HttpConnection):
+    def perform_request(self, method, url, params=None, body=None,
+                        timeout=None, ignore=()):
+        metrics.count('es_requests')
+        metrics.count('es_request_bytes', len(body or b''))
+        with metrics.span('elasticsearch'):
+            status, headers, data = super().perform_request(
+                method, url, params, body, timeout, ignore)
+        metrics.count('es_response_bytes', len(data.encode()))
+        return status, headers, data
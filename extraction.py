@@ -0,0 +1,69 @@
+"""
+html extraction backends for crawler.Page
+
+every backend takes the raw page source and returns
+(title text, [(tag name, text) of each p/blockquote directly under
+mw-content-text], [(href, text) of each a tag]), all after removing script
+tags and stripping whitespace from texts
+"""
+
+
+WORTHY_CONTENT_TAGS = ['p', 'blockquote']
+
+
+def extract_with_html_parser(page_source):
+    from bs4 import BeautifulSoup
+
+    page_soup = BeautifulSoup(page_source, 'html.parser')
+
+    # remove script tags
+    [s.extract() for s in page_soup('script')]
+
+    title_text = page_soup.find(id='firstHeading').get_text().strip()
+
+    content_soup = page_soup.find(id='mw-content-text')
+    worthy_contents = [
+        (worthy_content_soup.name, worthy_content_soup.get_text().strip())
+        for worthy_content_soup in content_soup.find_all(WORTHY_CONTENT_TAGS,
+                                                         recursive=False)
+    ]
+
+    links = [(link_soup.get('href'), link_soup.get_text().strip())
+             for link_soup in page_soup.find_all('a')]
+
+    return title_text, worthy_contents, links
+
+
+def extract_with_lxml(page_source):
+    """
+    same output as extract_with_html_parser using lxml's C parser; only the
+    title, the direct children of the content element and the a tags are
+    visited
+    """
+    from lxml import html  # optional dependency
+
+    tree = html.fromstring(page_source)
+
+    # remove script tags (drop_tree keeps the text that follows the tag)
+    for script in list(tree.iter('script')):
+        script.drop_tree()
+
+    title_text = tree.get_element_by_id('firstHeading').text_content().strip()
+
+    content_element = tree.get_element_by_id('mw-content-text')
+    worthy_contents = [
+        (child.tag, child.text_content().strip())
+        for child in content_element
+        if child.tag in WORTHY_CONTENT_TAGS
+    ]
+
+    links = [(link_element.get('href'), link_element.text_content().strip())
+             for link_element in tree.iter('a')]
+
+    return title_text, worthy_contents, links
+
+
+EXTRACTORS = {
+    'html.parser': extract_with_html_parser,
+    'lxml': extract_with_lxml,
+}
@@ -0,0 +1,69 @@
+"""
+cached feature matrix: the tf-idf matrix of a cluster run (as the data,
+indices and indptr of its csr form), the document ids, the feature names
+and the idf, saved in one .npz file together with the key they were built
+under. the key holds the 'content' index generation, so the cache goes
+stale as soon as index writes to the index
+"""
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+
+from generation import get_index_generation
+from settings import FEATURE_CACHE_PATH, INDEX_NAME
+
+
+CACHE_FORMAT = 1
+
+
+def get_feature_cache_key(**parameters):
+    """
+    `parameters` are those of the vectorizer that built the matrix
+    """
+    return json.dumps(dict(
+        parameters,
+        format=CACHE_FORMAT,
+        index=INDEX_NAME,
+        generation=get_index_generation()['content'],
+    ), sort_keys=True)
+
+
+def load_features(key, path=FEATURE_CACHE_PATH):
+    """
+    returns (documents, features) as saved by save_features(), or None if
+    there is no cache or it was built under another key
+    """
+    try:
+        cache = np.load(path)
+    except (OSError, ValueError):
+        return None
+    with cache:
+        if 'key' not in cache.files or str(cache['key']) != key:
+            return None
+        documents = {
+            'ids': cache['ids'].tolist(),
+            'vectors': sparse.csr_matrix(
+                (cache['data'], cache['indices'], cache['indptr']),
+                shape=tuple(cache['shape'])),
+            'idf': cache['idf'],
+        }
+        return documents, cache['features'].tolist()
+
+
+def save_features(key, documents, features, path=FEATURE_CACHE_PATH):
+    vectors = sparse.csr_matrix(documents['vectors'])
+    temporary_path = path + '.tmp.npz'  # savez would add the extension
+    np.savez(
+        temporary_path,
+        key=np.array(key),
+        data=vectors.data,
+        indices=vectors.indices,
+        indptr=vectors.indptr,
+        shape=np.array(vectors.shape),
+        ids=np.array(documents['ids'], dtype=str),
+        features=np.array(features, dtype=str),
+        idf=documents['idf'],
+    )
+    os.replace(temporary_path, path)
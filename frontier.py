@@ -0,0 +1,219 @@
+import math
+import os
+from array import array
+from collections import deque
+from hashlib import blake2b
+
+from settings import FRONTIER_BLOOM_ERROR_RATE, FRONTIER_MEMORY_LIMIT
+
+
+def _replace(path, write):
+    with open(path + '.tmp', 'wb') as output_file:
+        write(output_file)
+    os.replace(path + '.tmp', path)
+
+
+class HashedUrlSet():
+    """
+    exact seen-set that keeps a 64-bit hash of every url instead of the url
+    """
+    kind = 'hashed'
+
+    def __init__(self):
+        self._hashes = set()
+
+    @staticmethod
+    def _hash(url):
+        digest = blake2b(url.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'little')
+
+    def add(self, url):
+        url_hash = HashedUrlSet._hash(url)
+        if url_hash in self._hashes:
+            return False
+        self._hashes.add(url_hash)
+        return True
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def state(self):
+        return {'kind': self.kind}
+
+    def save(self, path):
+        _replace(path, lambda f: array('Q', self._hashes).tofile(f))
+
+    @classmethod
+    def load(cls, path, state):
+        seen_set = cls()
+        hashes = array('Q')
+        with open(path, 'rb') as input_file:
+            hashes.frombytes(input_file.read())
+        seen_set._hashes = set(hashes)
+        return seen_set
+
+
+class BloomFilter():
+    """
+    approximate seen-set of fixed size; a url that was never added is
+    reported as seen with probability `error_rate` once `capacity` urls are
+    added, so such a url is never crawled
+    """
+    kind = 'bloom'
+
+    def __init__(self, capacity, error_rate=FRONTIER_BLOOM_ERROR_RATE):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1, not %d' % capacity)
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be between 0 and 1, not %r' %
+                             error_rate)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._num_bits = max(8, int(-capacity * math.log(error_rate) /
+                                    math.log(2) ** 2))
+        self._num_hashes = max(1, round(self._num_bits / capacity *
+                                        math.log(2)))
+        self._bits = bytearray((self._num_bits + 7) // 8)
+        self._count = 0
+
+    def _positions(self, url):
+        digest = blake2b(url.encode(), digest_size=16).digest()
+        hash_1 = int.from_bytes(digest[:8], 'little')
+        hash_2 = int.from_bytes(digest[8:], 'little')
+        for i in range(self._num_hashes):
+            yield (hash_1 + i * hash_2) % self._num_bits
+
+    def add(self, url):
+        is_new = False
+        for position in self._positions(url):
+            if not self._bits[position >> 3] & (1 << (position & 7)):
+                self._bits[position >> 3] |= 1 << (position & 7)
+                is_new = True
+        self._count += is_new
+        return is_new
+
+    def __len__(self):
+        return self._count
+
+    def state(self):
+        return {
+            'kind': self.kind,
+            'capacity': self.capacity,
+            'error_rate': self.error_rate,
+            'count': self._count,
+        }
+
+    def save(self, path):
+        _replace(path, lambda f: f.write(self._bits))
+
+    @classmethod
+    def load(cls, path, state):
+        seen_set = cls(state['capacity'], state['error_rate'])
+        with open(path, 'rb') as input_file:
+            seen_set._bits = bytearray(input_file.read())
+        seen_set._count = state['count']
+        return seen_set
+
+
+SEEN_SET_CLASSES = {
+    HashedUrlSet.kind: HashedUrlSet,
+    BloomFilter.kind: BloomFilter,
+}
+
+
+class Frontier():
+    """
+    FIFO queue of urls to crawl that rejects every url it has seen before.
+    at most `memory_limit` urls are kept in memory, the rest are appended to
+    the file at `spill_path` and read back in order when memory runs empty
+    """
+
+    def __init__(self, spill_path, memory_limit=FRONTIER_MEMORY_LIMIT,
+                 seen_set=None):
+        if memory_limit < 1:  # pop() reads spilled urls into memory
+            raise ValueError('memory_limit must be at least 1, not %d' %
+                             memory_limit)
+        self.spill_path = spill_path
+        self.memory_limit = memory_limit
+        self.seen_set = seen_set or HashedUrlSet()
+        self._memory = deque()
+        self._spill_file = None
+        self._spill_read_offset = 0
+        self._num_spilled = 0
+
+    def _push(self, url):
+        if self._num_spilled or len(self._memory) >= self.memory_limit:
+            if not self._spill_file:
+                self._spill_file = open(self.spill_path, 'w+b')
+            self._spill_file.seek(0, os.SEEK_END)
+            self._spill_file.write(url.encode() + b'\n')
+            self._num_spilled += 1
+        else:
+            self._memory.append(url)
+
+    def _read_spilled(self, count):
+        self._spill_file.seek(self._spill_read_offset)
+        urls = [self._spill_file.readline().decode().rstrip('\n')
+                for _ in range(min(count, self._num_spilled))]
+        self._spill_read_offset = self._spill_file.tell()
+        self._num_spilled -= len(urls)
+        if not self._num_spilled:  # everything was read, free the disk space
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+            self._spill_read_offset = 0
+        return urls
+
+    def add(self, url):
+        if self.seen_set.add(url):
+            self._push(url)
+            return True
+        return False
+
+    def extend(self, urls):
+        for url in urls:
+            self.add(url)
+
+    def pop(self):
+        if not self._memory and self._num_spilled:
+            self._memory.extend(self._read_spilled(self.memory_limit))
+        return self._memory.popleft()
+
+    def __len__(self):
+        return len(self._memory) + self._num_spilled
+
+    def close(self):
+        if self._spill_file:
+            self._spill_file.close()
+            self._spill_file = None
+            os.remove(self.spill_path)
+
+    def save(self, path, head=()):
+        """
+        write the queued urls (after `head`, urls that were popped but should
+        be crawled again on load) and the seen-set next to `path`
+        """
+        def write_queue(output_file):
+            for url in list(head) + list(self._memory):
+                output_file.write(url.encode() + b'\n')
+            if self._num_spilled:
+                self._spill_file.seek(self._spill_read_offset)
+                for _ in range(self._num_spilled):
+                    output_file.write(self._spill_file.readline())
+
+        _replace(path + '.queue', write_queue)
+        self.seen_set.save(path + '.seen')
+        return {
+            'memory_limit': self.memory_limit,
+            'seen_set': self.seen_set.state(),
+        }
+
+    @classmethod
+    def load(cls, path, spill_path, state):
+        seen_set_state = state['seen_set']
+        seen_set = SEEN_SET_CLASSES[seen_set_state['kind']].load(
+            path + '.seen', seen_set_state)
+        frontier = cls(spill_path, state['memory_limit'], seen_set)
+        with open(path + '.queue', 'rb') as input_file:
+            for line in input_file:
+                frontier._push(line.decode().rstrip('\n'))
+        return frontier
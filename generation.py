@@ -0,0 +1,36 @@
+"""
+index generation marker: a document in the meta index counting how many
+times the indexed content ('content', bumped by index) and the cluster
+assignments ('cluster', bumped by cluster) changed, so caches built on
+the index can tell when they are stale
+"""
+from settings import ES, META_DOC_TYPE, META_INDEX_NAME
+
+
+GENERATION_DOC_ID = 'generation'
+GENERATION_KINDS = ['content', 'cluster']
+
+
+def get_index_generation(client=ES):
+    from elasticsearch import NotFoundError  # local searches never get here
+
+    try:
+        return client.get(index=META_INDEX_NAME, doc_type=META_DOC_TYPE,
+                          id=GENERATION_DOC_ID)['_source']
+    except NotFoundError:
+        return {kind: 0 for kind in GENERATION_KINDS}
+
+
+def bump_index_generation(kind, client=ES):
+    client.update(index=META_INDEX_NAME, doc_type=META_DOC_TYPE,
+                  id=GENERATION_DOC_ID, retry_on_conflict=5, body={
+                      'script': {
+                          'inline': 'ctx._source[params.kind] += 1',
+                          'lang': 'painless',
+                          'params': {'kind': kind},
+                      },
+                      'upsert': {
+                          other_kind: int(other_kind == kind)
+                          for other_kind in GENERATION_KINDS
+                      },
+                  })
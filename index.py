@@ -1,46 +1,151 @@
-import json
 import os
 import random
+import sys
+from collections import Counter
+from itertools import chain, tee
 from pprint import pprint
 from time import sleep
 
-from elasticsearch.helpers import bulk
+from elasticsearch.helpers import scan
 
-from analysis import analyze
-from settings import ES, INDEX_NAME, DOC_TYPE
+import metrics
+from analysis import CHARACTER_REPLACE_DICT, TOKEN_PATTERN, analyze, \
+    analyze_many
+from bulk_ingest import bulk_ingest, ingest_settings
+from documents import ANALYZED_FIELDS, get_document_id, read_documents
+from generation import bump_index_generation
+from settings import BULK_CHUNK_SIZE, BULK_MAX_CHUNK_BYTES, BULK_WORKERS, \
+    CLUSTER_ASSIGN_BATCH_SIZE, CLUSTER_DRIFT_THRESHOLD, CLUSTER_MODEL_DIR, \
+    DOC_TYPE, ES, INDEX_NAME
 
 
-def _initialize_index():
+PERSIAN_ANALYZER = 'persian_analyzer'
+BRACKETS_DEPTH = 8
+
+
+def _initialize_index(index_name=INDEX_NAME):
     body = {
         'number_of_shards': 1,
         'number_of_replicas': 0,
     }
-    ES.indices.create(index=INDEX_NAME, body=body)
+    ES.indices.create(index=index_name, body=body)
 
 
 def _get_cluster_health():
     return ES.cluster.health()  # JSON format
 
 
-def _configure_index():
-    settings_body = {
-        'analysis': {
-            'char_filter': {},
-            'tokenizer': {},
-            'filter': {},
-            'analyzer': {
-                'custom_analyzer': {
-                    'tokenizer': 'standard',
-                },
+def _get_character_mapping(character):
+    return '\\u%04x' % ord(character)
+
+
+def _get_brackets_pattern(depth):
+    """
+    a pattern that removes what analysis.remove_inside_brackets() removes
+    from texts whose brackets nest at most `depth` levels deep: bracketed
+    groups, the text between an unmatched ']' and the '[' that balances it,
+    and everything after a bracket that is never balanced. the groups are
+    unrolled, so text between brackets is matched by one character class
+    loop rather than by a repetition per character
+    """
+    opened = r'\[[^\[\]]*\]'
+    closed = r'\][^\[\]]*\['
+    for _ in range(depth - 1):
+        opened = r'\[[^\[\]]*(?:%s[^\[\]]*)*\]' % opened
+        closed = r'\][^\[\]]*(?:%s[^\[\]]*)*\[' % closed
+    return r'(?s)%s|%s|[\[\]].*' % (opened, closed)
+
+
+def get_analysis_settings():
+    """
+    `persian_analyzer` does what analysis.analyze() does, followed by the
+    lowercasing that the standard analyzer applies to the analyzed_* fields.
+    brackets nested deeper than BRACKETS_DEPTH levels remove the rest of the
+    text, where analyze() would keep what follows them
+    """
+    return {
+        'char_filter': {
+            'persian_brackets': {
+                'type': 'pattern_replace',
+                'pattern': _get_brackets_pattern(BRACKETS_DEPTH),
+                'replacement': '',
+            },
+            'persian_characters': {
+                'type': 'mapping',
+                'mappings': [
+                    '%s => %s' % (_get_character_mapping(character),
+                                  ''.join(_get_character_mapping(c)
+                                          for c in replacement))
+                    for character, replacement
+                    in sorted(CHARACTER_REPLACE_DICT.items())
+                ],
+            },
+        },
+        'tokenizer': {
+            'persian_tokenizer': {
+                'type': 'pattern',
+                'pattern': TOKEN_PATTERN.pattern,
+                'group': 0,
             },
         },
+        'filter': {},
+        'analyzer': {
+            'custom_analyzer': {
+                'tokenizer': 'standard',
+            },
+            PERSIAN_ANALYZER: {
+                'type': 'custom',
+                'char_filter': ['persian_brackets', 'persian_characters'],
+                'tokenizer': 'persian_tokenizer',
+                'filter': ['lowercase'],
+            },
+        },
+    }
+
+
+def _apply_lean_mapping_profile(mapping_body):
+    """
+    storage-optimized mapping: urls are keywords, links are kept in _source
+    only, raw texts are not searchable and the analyzed copies are indexed
+    without positions and left out of _source. partial updates reindex from
+    _source, so this needs server side analysis to rebuild the copies
+    """
+    properties = mapping_body['properties']
+    mapping_body['_source'] = {
+        'excludes': ['analyzed_' + field for field in ANALYZED_FIELDS],
+    }
+    properties['page_link'] = {
+        'type': 'keyword',
+    }
+    properties['content_hash'].update({
+        'index': False,
+        'doc_values': False,
+    })
+    properties['links'] = {
+        'type': 'object',
+        'enabled': False,
     }
+    for field in ANALYZED_FIELDS:
+        properties[field]['index'] = False
+        properties['analyzed_' + field]['index_options'] = 'freqs'
+    properties['cluster']['properties']['label']['norms'] = False
 
+
+MAPPING_PROFILES = {
+    'default': lambda mapping_body: None,
+    'lean': _apply_lean_mapping_profile,
+}
+
+
+def _get_mapping_body(server_side_analysis=False, mapping_profile='default'):
     mapping_body = {
         'properties': {
             'page_link': {
                 'type': 'text',
             },
+            'content_hash': {
+                'type': 'keyword',
+            },
             'title': {
                 'type': 'text',
             },
@@ -82,56 +187,259 @@ def _configure_index():
         },
     }
 
+    mapping_body['_meta'] = {
+        'server_side_analysis': server_side_analysis,
+        'mapping_profile': mapping_profile,
+    }
+    if server_side_analysis:
+        # analyzed_* fields are filled from the raw fields by elasticsearch
+        for field in ANALYZED_FIELDS:
+            mapping_body['properties'][field]['copy_to'] = 'analyzed_' + field
+            mapping_body['properties']['analyzed_' + field]['analyzer'] = \
+                PERSIAN_ANALYZER
+    MAPPING_PROFILES[mapping_profile](mapping_body)
+    return mapping_body
+
+
+def _configure_index(server_side_analysis=False, mapping_profile='default',
+                     index_name=INDEX_NAME):
+    settings_body = {
+        'analysis': get_analysis_settings(),
+    }
+    mapping_body = _get_mapping_body(server_side_analysis, mapping_profile)
+
     while _get_cluster_health()['status'] != 'green':
         sleep(0.5)  # seconds
-    ES.indices.close(index=INDEX_NAME)
-    ES.indices.put_settings(index=INDEX_NAME, body=settings_body)
-    ES.indices.open(index=INDEX_NAME)
-    ES.indices.put_mapping(index=INDEX_NAME, doc_type=DOC_TYPE,
+    ES.indices.close(index=index_name)
+    ES.indices.put_settings(index=index_name, body=settings_body)
+    ES.indices.open(index=index_name)
+    ES.indices.put_mapping(index=index_name, doc_type=DOC_TYPE,
                            body=mapping_body)
 
 
-def _get_insert_actions(pages_dir):
-    index_file_paths = [
-        os.path.join(pages_dir, file_name)
-        for file_name in os.listdir(pages_dir)
-        if os.path.isfile(os.path.join(pages_dir, file_name)) and
-        file_name.endswith('.json')
-        ]
-    for index_file_path in index_file_paths:
-        with open(index_file_path, 'r') as index_file:
-            document_json = json.loads(index_file.read())
-            content = ' '.join(document_json['content'])
-            yield {
-                '_op_type': 'index',
-                '_index': INDEX_NAME,
-                '_type': DOC_TYPE,
-                '_source': {
-                    'page_link': document_json['page_link'],
-                    'title': document_json['title'],
-                    'analyzed_title': analyze(document_json['title']),
-                    'introduction': document_json['introduction'],
-                    'analyzed_introduction':
-                        analyze(document_json['introduction']),
-                    'content': content,
-                    'analyzed_content': analyze(content),
-                    'links': document_json['links'],
-                }
-            }
-
-
-def _bulk_action(pages_dir):
-    bulk(ES, _get_insert_actions(pages_dir), stats_only=False, chunk_size=50)
-
-
-def create_index(pages_dir):
+def _is_server_side_analysis():
+    mapping = ES.indices.get_mapping(index=INDEX_NAME, doc_type=DOC_TYPE)
+    return mapping[INDEX_NAME]['mappings'][DOC_TYPE].get('_meta', {}).get(
+        'server_side_analysis', False)
+
+
+def get_analyzed_text(source):
+    # analyzed_* fields are not in _source with server side analysis
+    return ' '.join(
+        source['analyzed_' + field] if 'analyzed_' + field in source
+        else analyze(source[field]) for field in ANALYZED_FIELDS
+    )
+
+
+def _get_insert_actions(documents, workers, server_side_analysis=False):
+    if server_side_analysis:
+        analyzed_texts = None
+    else:
+        documents, documents_to_analyze = tee(documents)
+        analyzed_texts = metrics.timed_iter('analyze', analyze_many(
+            chain.from_iterable(
+                [document[field] for field in ANALYZED_FIELDS]
+                for document in documents_to_analyze
+            ), workers=workers))
+    for document in documents:
+        source = {
+            'page_link': document['page_link'],
+            'content_hash': document['content_hash'],
+            'title': document['title'],
+            'introduction': document['introduction'],
+            'content': document['content'],
+            'links': document['links'],
+        }
+        if analyzed_texts:
+            for field in ANALYZED_FIELDS:
+                source['analyzed_' + field] = next(analyzed_texts)
+        yield {
+            '_op_type': 'index',
+            '_index': INDEX_NAME,
+            '_type': DOC_TYPE,
+            '_id': get_document_id(document['page_link']),
+            '_source': source,
+        }
+
+
+def _get_indexed_content_hashes():
+    return {
+        document['_id']: document['_source'].get('content_hash')
+        for document in metrics.timed_iter('scan', scan(ES, query={
+            '_source': ['content_hash'],
+            'query': {'match_all': {}},
+        }, index=INDEX_NAME, doc_type=DOC_TYPE))
+    }
+
+
+def _get_changed_documents(documents, indexed_content_hashes, report):
+    """
+    yield the documents that are not indexed or were indexed with another
+    content; indexed documents are removed from `indexed_content_hashes`
+    """
+    for document in documents:
+        document_id = get_document_id(document['page_link'])
+        if document_id not in indexed_content_hashes:
+            report['added'] += 1
+        elif indexed_content_hashes.pop(document_id) != \
+                document['content_hash']:
+            report['updated'] += 1
+        else:
+            report['unchanged'] += 1
+            continue
+        yield document
+
+
+def _get_update_actions(pages_dir, workers, report):
+    indexed_content_hashes = _get_indexed_content_hashes()
+    for action in _get_insert_actions(_get_changed_documents(
+            read_documents(pages_dir), indexed_content_hashes, report),
+            workers, _is_server_side_analysis()):
+        yield action
+
+    # only the pages that are no longer in the page store are left
+    for document_id in indexed_content_hashes:
+        report['deleted'] += 1
+        yield {
+            '_op_type': 'delete',
+            '_index': INDEX_NAME,
+            '_type': DOC_TYPE,
+            '_id': document_id,
+        }
+
+
+def _get_batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _load_cluster_model():
+    if not os.path.exists(CLUSTER_MODEL_DIR):
+        return None
+    from cluster_model import load_cluster_model  # imports scikit-learn
+
+    return load_cluster_model()
+
+
+def _assign_clusters(actions, cluster_model, report):
+    """
+    give the indexed documents the nearest centroid of the saved cluster
+    model, adding their number and distances to `report`
+    """
+    for batch in _get_batches(actions, CLUSTER_ASSIGN_BATCH_SIZE):
+        index_actions = [action for action in batch
+                         if action['_op_type'] == 'index']
+        if index_actions:
+            with metrics.span('assign'):
+                labels, distances = cluster_model.assign([
+                    get_analyzed_text(action['_source'])
+                    for action in index_actions
+                ])
+            for action, label_id in zip(index_actions, labels.tolist()):
+                action['_source']['cluster.id'] = label_id
+                action['_source']['cluster.label'] = ' '.join(
+                    cluster_model.meta['labels'][label_id])
+            report['assigned'] += len(index_actions)
+            report['distance'] += float(distances.sum())
+        for action in batch:
+            yield action
+
+
+def _print_cluster_drift(cluster_model, report):
+    """
+    drift is how much farther from their centroids the newly assigned
+    documents are than the documents the model was trained on
+    """
+    if not report['assigned']:
+        return
+    mean_distance = report['distance'] / report['assigned']
+    drift = mean_distance / (cluster_model.meta['mean_distance'] or
+                             sys.float_info.min)
+    print('cluster model version = %d;' % cluster_model.version,
+          'assigned = %d;' % report['assigned'],
+          'mean distance = %.4f;' % mean_distance,
+          'training mean distance = %.4f;' %
+          cluster_model.meta['mean_distance'],
+          'drift = %.2f;' % drift)
+    if drift > CLUSTER_DRIFT_THRESHOLD:
+        print('drift is above %.2f, consider running cluster again' %
+              CLUSTER_DRIFT_THRESHOLD)
+
+
+def _bulk_action(actions, bulk_workers, bulk_chunk_size, bulk_chunk_bytes,
+                 force_merge=True):
+    try:
+        with ingest_settings(ES, INDEX_NAME, force_merge):
+            bulk_ingest(ES, actions, bulk_workers, bulk_chunk_size,
+                        bulk_chunk_bytes)
+    finally:  # a failed bulk may still have written some documents
+        bump_index_generation('content')
+
+
+def create_index(pages_dir, workers=None, bulk_workers=BULK_WORKERS,
+                 bulk_chunk_size=BULK_CHUNK_SIZE,
+                 bulk_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+                 server_side_analysis=False, mapping_profile='default',
+                 assign_clusters=True):
+    """
+    with `server_side_analysis`, the analyzed_* fields are produced by
+    elasticsearch's persian_analyzer instead of analysis.analyze() and are
+    not stored in _source. `mapping_profile` is a key of MAPPING_PROFILES.
+    with `assign_clusters`, documents get their cluster from the saved
+    cluster model if there is one
+    """
+    server_side_analysis = server_side_analysis or mapping_profile == 'lean'
     _initialize_index()
-    _configure_index()
-    _bulk_action(pages_dir)
+    _configure_index(server_side_analysis, mapping_profile)
+    actions = _get_insert_actions(read_documents(pages_dir), workers,
+                                  server_side_analysis)
+    cluster_model = _load_cluster_model() if assign_clusters else None
+    report = Counter()
+    if cluster_model:
+        actions = _assign_clusters(actions, cluster_model, report)
+    _bulk_action(actions, bulk_workers, bulk_chunk_size, bulk_chunk_bytes)
+    if cluster_model:
+        _print_cluster_drift(cluster_model, report)
+
+
+def update_index(pages_dir, workers=None, bulk_workers=BULK_WORKERS,
+                 bulk_chunk_size=BULK_CHUNK_SIZE,
+                 bulk_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+                 server_side_analysis=False, mapping_profile='default',
+                 assign_clusters=True):
+    """
+    index only the new and changed pages of the page store and delete the
+    pages that are no longer in it. an existing index keeps the analysis
+    mode and mapping it was created with
+    """
+    if not ES.indices.exists(index=INDEX_NAME):
+        _initialize_index()
+        _configure_index(server_side_analysis or mapping_profile == 'lean',
+                         mapping_profile)
+    report = Counter()
+    actions = _get_update_actions(pages_dir, workers, report)
+    cluster_model = _load_cluster_model() if assign_clusters else None
+    if cluster_model:
+        actions = _assign_clusters(actions, cluster_model, report)
+    _bulk_action(actions, bulk_workers, bulk_chunk_size, bulk_chunk_bytes,
+                 force_merge=False)
+    print('added = %d;' % report['added'],
+          'updated = %d;' % report['updated'],
+          'unchanged = %d;' % report['unchanged'],
+          'deleted = %d;' % report['deleted'])
+    if cluster_model:
+        _print_cluster_drift(cluster_model, report)
 
 
 def delete_index():
     ES.indices.delete(index=INDEX_NAME)
+    bump_index_generation('content')
 
 
 def check_index():
@@ -0,0 +1,234 @@
+"""
+embedded search backend that needs no elasticsearch: a BM25 inverted index
+over the analyzed title, introduction and content of the page store, saved
+as numpy arrays that are memory-mapped at search time. for every field,
+FIELD.offsets.npy holds where the postings of each term (numbered as in
+terms.json) start in FIELD.documents.npy and FIELD.frequencies.npy, and
+FIELD.lengths.npy holds the number of tokens of every document
+"""
+import json
+import os
+from array import array
+from itertools import chain, tee
+
+import numpy as np
+
+from analysis import analyze, analyze_many
+from documents import ANALYZED_FIELDS, get_document_id, read_documents
+from settings import BM25_B, BM25_K1, LOCAL_INDEX_DIR
+
+
+DOCUMENTS_FILE_NAME = 'documents.json'
+TERMS_FILE_NAME = 'terms.json'
+CLUSTERS_FILE_NAME = 'clusters.npy'
+NO_CLUSTER = -1
+
+
+def _get_tokens(analyzed_text):
+    # what the standard analyzer of the analyzed_* fields does to the text
+    return analyzed_text.lower().split()
+
+
+def _get_array_path(index_dir, field, name):
+    return os.path.join(index_dir, '%s.%s.npy' % (field, name))
+
+
+def _save_json(path, data):
+    with open(path, 'w') as output_file:
+        output_file.write(json.dumps(data, ensure_ascii=False))
+
+
+def _save_postings(index_dir, field, num_terms, term_ids, document_numbers,
+                   frequencies, lengths):
+    term_ids = np.frombuffer(term_ids, dtype=np.int32)
+    order = np.argsort(term_ids, kind='mergesort')  # keeps documents sorted
+    offsets = np.zeros(num_terms + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_ids, minlength=num_terms), out=offsets[1:])
+    np.save(_get_array_path(index_dir, field, 'offsets'), offsets)
+    np.save(_get_array_path(index_dir, field, 'documents'),
+            np.frombuffer(document_numbers, dtype=np.int32)[order])
+    np.save(_get_array_path(index_dir, field, 'frequencies'),
+            np.frombuffer(frequencies, dtype=np.float32)[order])
+    np.save(_get_array_path(index_dir, field, 'lengths'),
+            np.frombuffer(lengths, dtype=np.float32))
+
+
+def build_local_index(pages_dir, index_dir=LOCAL_INDEX_DIR, workers=None):
+    """
+    analyze every page of the page store and write the local index to
+    `index_dir`; pages are read and analyzed as the postings are built, so
+    only the postings and a summary of each page are held in memory. cluster
+    ids of pages that were already in it are kept
+    """
+    old_clusters = {}
+    if os.path.exists(os.path.join(index_dir, DOCUMENTS_FILE_NAME)):
+        old_index = LocalIndex(index_dir)
+        old_clusters = {document['id']: int(cluster_id)
+                        for document, cluster_id
+                        in zip(old_index.documents, old_index.clusters)}
+    os.makedirs(index_dir, exist_ok=True)
+
+    documents, documents_to_analyze = tee(read_documents(pages_dir))
+    analyzed_texts = analyze_many(chain.from_iterable(
+        [document[field] for field in ANALYZED_FIELDS]
+        for document in documents_to_analyze
+    ), workers=workers)
+    term_to_id = {}
+    postings = {field: (array('i'), array('i'), array('f'), array('f'))
+                for field in ANALYZED_FIELDS}
+    document_summaries = []
+    for document_number, document in enumerate(documents):
+        document_summaries.append({
+            'id': get_document_id(document['page_link']),
+            'page_link': document['page_link'],
+            'title': document['title'],
+        })
+        for field in ANALYZED_FIELDS:
+            term_ids, document_numbers, frequencies, lengths = \
+                postings[field]
+            tokens = _get_tokens(next(analyzed_texts))
+            term_frequencies = {}
+            for token in tokens:
+                term_frequencies[token] = term_frequencies.get(token, 0) + 1
+            for term, frequency in term_frequencies.items():
+                term_ids.append(term_to_id.setdefault(term, len(term_to_id)))
+                document_numbers.append(document_number)
+                frequencies.append(frequency)
+            lengths.append(len(tokens))
+
+    for field in ANALYZED_FIELDS:
+        _save_postings(index_dir, field, len(term_to_id), *postings[field])
+    _save_json(os.path.join(index_dir, TERMS_FILE_NAME),
+               sorted(term_to_id, key=term_to_id.get))
+    _save_json(os.path.join(index_dir, DOCUMENTS_FILE_NAME),
+               document_summaries)
+    np.save(os.path.join(index_dir, CLUSTERS_FILE_NAME), np.array(
+        [old_clusters.get(document['id'], NO_CLUSTER)
+         for document in document_summaries], dtype=np.int32))
+    print('documents = %d;' % len(document_summaries),
+          'terms = %d;' % len(term_to_id))
+
+
+class LocalClusterWriter():
+    """
+    sets the cluster ids of the local index a batch at a time, keeping only
+    a sorted array of its document ids and an array of their clusters in
+    memory; close() writes them, and documents that were given no cluster
+    have none
+    """
+
+    def __init__(self, index_dir=LOCAL_INDEX_DIR):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, DOCUMENTS_FILE_NAME), 'r') as f:
+            document_ids = np.array([document['id'] for document
+                                     in json.loads(f.read())], dtype='S')
+        self._order = np.argsort(document_ids)
+        self._sorted_ids = document_ids[self._order]
+        self.clusters = np.full(len(document_ids), NO_CLUSTER,
+                                dtype=np.int32)
+
+    def update(self, document_ids, cluster_ids):
+        if not len(self._sorted_ids) or not len(document_ids):
+            return
+        document_ids = np.array(document_ids, dtype='S')
+        positions = np.minimum(np.searchsorted(self._sorted_ids,
+                                               document_ids),
+                               len(self._sorted_ids) - 1)
+        found = self._sorted_ids[positions] == document_ids
+        self.clusters[self._order[positions[found]]] = \
+            np.asarray(cluster_ids)[found]
+
+    def close(self):
+        temporary_path = os.path.join(self.index_dir, 'clusters.tmp.npy')
+        np.save(temporary_path, self.clusters)
+        os.replace(temporary_path,
+                   os.path.join(self.index_dir, CLUSTERS_FILE_NAME))
+
+
+def update_clusters(document_id_to_cluster, index_dir=LOCAL_INDEX_DIR):
+    """
+    store the cluster ids computed by cluster.cluster() in the local index
+    """
+    writer = LocalClusterWriter(index_dir)
+    writer.update(list(document_id_to_cluster),
+                  list(document_id_to_cluster.values()))
+    writer.close()
+
+
+class LocalIndex():
+    """
+    scores follow lucene's BM25 (without its lossy encoding of document
+    lengths) and, like elasticsearch's multi_match, a document gets the
+    best of its weighted field scores
+    """
+
+    def __init__(self, index_dir=LOCAL_INDEX_DIR):
+        with open(os.path.join(index_dir, DOCUMENTS_FILE_NAME), 'r') as f:
+            self.documents = json.loads(f.read())
+        with open(os.path.join(index_dir, TERMS_FILE_NAME), 'r') as f:
+            self.term_to_id = {term: term_id for term_id, term
+                               in enumerate(json.loads(f.read()))}
+        self.clusters = np.load(os.path.join(index_dir, CLUSTERS_FILE_NAME))
+        self.fields = {}
+        for field in ANALYZED_FIELDS:
+            postings = {name: np.load(_get_array_path(index_dir, field, name),
+                                      mmap_mode='r')
+                        for name in ['offsets', 'documents', 'frequencies']}
+            lengths = np.load(_get_array_path(index_dir, field, 'lengths'))
+            num_documents = np.count_nonzero(lengths)
+            postings['num_documents'] = num_documents
+            postings['length_norms'] = BM25_K1 * (
+                1 - BM25_B + BM25_B * lengths /
+                (lengths.sum() / (num_documents or 1)))
+            self.fields[field] = postings
+
+    def _get_field_scores(self, field, term_ids, matched):
+        postings = self.fields[field]
+        scores = np.zeros(len(self.documents), dtype=np.float64)
+        for term_id in term_ids:
+            start, end = postings['offsets'][term_id:term_id + 2]
+            if start == end:
+                continue
+            document_numbers = postings['documents'][start:end]
+            frequencies = postings['frequencies'][start:end]
+            idf = np.log(1 + (postings['num_documents'] - (end - start) +
+                              0.5) / (end - start + 0.5))
+            # documents are unique within the postings of a term
+            scores[document_numbers] += idf * frequencies * (BM25_K1 + 1) / (
+                frequencies + postings['length_norms'][document_numbers])
+            matched[document_numbers] = True
+        return scores
+
+    def search(self, query, title_weight, introduction_weight,
+               content_weight, cluster_id, size=10):
+        """
+        returns hits shaped like elasticsearch's, best first
+        """
+        field_weights = {
+            'title': float(title_weight),
+            'introduction': float(introduction_weight),
+            'content': float(content_weight),
+        }
+        term_ids = [self.term_to_id[token]
+                    for token in _get_tokens(analyze(query))
+                    if token in self.term_to_id]
+        matched = np.zeros(len(self.documents), dtype=bool)
+        scores = np.zeros(len(self.documents), dtype=np.float64)
+        for field in ANALYZED_FIELDS:
+            np.maximum(scores, field_weights[field] * self._get_field_scores(
+                field, term_ids, matched), out=scores)
+        if int(cluster_id) >= 0:
+            matched &= self.clusters == int(cluster_id)
+
+        document_numbers = np.flatnonzero(matched)
+        document_numbers = document_numbers[np.argsort(
+            -scores[document_numbers], kind='mergesort')[:size]]
+        return [{
+            '_id': self.documents[document_number]['id'],
+            '_score': float(scores[document_number]),
+            '_source': {
+                'page_link': self.documents[document_number]['page_link'],
+                'title': self.documents[document_number]['title'],
+                'cluster.id': int(self.clusters[document_number]),
+            },
+        } for document_number in document_numbers.tolist()]
@@ -0,0 +1,96 @@
+"""
+pipeline metrics of one run: named timing spans (fetch, parse, analyze,
+bulk, scan, vectorize, kmeans, labeling, query, ...), counters of bytes,
+documents and elasticsearch round trips, and peak memory. cli.py writes
+them as json with --metrics-out.
+
+a span may be entered many times, from many threads, and spans overlap
+(bulk requests run while documents are analyzed), so span totals are not
+meant to add up to the run time. work done in worker processes is only
+seen through the time the parent waits for it
+"""
+import json
+import resource
+import sys
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+
+_lock = threading.Lock()
+_start = perf_counter()
+_spans = {}
+_counters = {}
+
+
+def add_span(name, seconds):
+    with _lock:
+        totals = _spans.setdefault(name, {'count': 0, 'seconds': 0.0})
+        totals['count'] += 1
+        totals['seconds'] += seconds
+
+
+@contextmanager
+def span(name):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        add_span(name, perf_counter() - start)
+
+
+def timed_iter(name, iterable):
+    """
+    yield the items of `iterable`, adding the time spent producing them (and
+    not the time spent by the consumer) to the span `name`
+    """
+    iterator = iter(iterable)
+    seconds = 0.0
+    try:
+        while True:
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                seconds += perf_counter() - start
+            yield item
+    finally:
+        add_span(name, seconds)
+
+
+def count(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def _get_peak_memory(who):
+    # ru_maxrss is in kilobytes, except on macos
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_report():
+    with _lock:
+        return {
+            'seconds': perf_counter() - _start,
+            'spans': {name: dict(totals) for name, totals in _spans.items()},
+            'counters': dict(_counters),
+            'peak_memory_bytes': _get_peak_memory(resource.RUSAGE_SELF),
+            'children_peak_memory_bytes': _get_peak_memory(
+                resource.RUSAGE_CHILDREN),
+        }
+
+
+def write_report(path, **fields):
+    """
+    write the report, with `fields` added, to `path` ('-' is stdout)
+    """
+    report = json.dumps(dict(get_report(), **fields), ensure_ascii=False,
+                        indent=2, sort_keys=True)
+    if path == '-':
+        print(report)
+        return
+    with open(path, 'w') as report_file:
+        report_file.write(report + '\n')
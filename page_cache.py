@@ -0,0 +1,70 @@
+import sqlite3
+import zlib
+from collections import namedtuple
+from threading import Lock
+from urllib.parse import urldefrag, urlparse
+
+
+CachedPage = namedtuple('CachedPage', ['body', 'etag', 'last_modified'])
+
+
+def normalize_url(url):
+    url = urldefrag(url)[0]
+    parsed = urlparse(url)
+    return parsed._replace(scheme=parsed.scheme.lower(),
+                           netloc=parsed.netloc.lower()).geturl()
+
+
+class PageCache():
+    """
+    raw page sources compressed with zlib in a sqlite file, keyed by
+    normalized url together with their ETag / Last-Modified validators.
+    safe to share between fetching threads
+    """
+
+    def __init__(self, path):
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body BLOB)'
+        )
+
+    def get(self, url):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT body, etag, last_modified FROM pages WHERE url = ?',
+                (normalize_url(url),)
+            ).fetchone()
+        if not row:
+            return None
+        return CachedPage(zlib.decompress(row[0]), row[1], row[2])
+
+    def put(self, url, body, etag=None, last_modified=None):
+        compressed_body = zlib.compress(body)
+        values = (etag, last_modified, compressed_body, normalize_url(url))
+        with self._lock, self._connection:
+            # update in place so urls() keeps the first insertion order
+            updated = self._connection.execute(
+                'UPDATE pages SET etag = ?, last_modified = ?, body = ? '
+                'WHERE url = ?', values
+            ).rowcount
+            if not updated:
+                self._connection.execute(
+                    'INSERT INTO pages (etag, last_modified, body, url) '
+                    'VALUES (?, ?, ?, ?)', values
+                )
+
+    def urls(self):
+        """
+        cached urls in the order they were first stored
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT url FROM pages ORDER BY rowid').fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,228 @@
+"""
+crawled page storage: either one N.json file per page (DirectoryPageStore)
+or append-only segment files of compressed records plus an offset index
+(SegmentPageStore); open_page_store() picks the format of an existing store
+"""
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from settings import PAGE_STORE_SEGMENT_SIZE
+
+
+class DirectoryPageStore():
+    format = 'directory'
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._url_to_id = None
+
+    def _get_page_path(self, page_id):
+        return os.path.join(self.path, '%d.json' % page_id)
+
+    def ids(self):
+        return sorted(
+            int(file_name[:-5]) for file_name in os.listdir(self.path)
+            if file_name.endswith('.json') and file_name[:-5].isdigit() and
+            os.path.isfile(os.path.join(self.path, file_name))
+        )
+
+    def write(self, page_id, document):
+        with open(self._get_page_path(page_id), 'w') as output_file:
+            output_file.write('%s' % json.dumps(document))
+        if self._url_to_id is not None:
+            self._url_to_id[document['page_link']] = page_id
+
+    def read(self, page_id):
+        try:
+            with open(self._get_page_path(page_id), 'r') as input_file:
+                return json.loads(input_file.read())
+        except (OSError, ValueError):
+            return None
+
+    def read_url(self, url):
+        if self._url_to_id is None:  # reads every page once
+            self._url_to_id = {document['page_link']: page_id
+                               for page_id, document in self.items()}
+        page_id = self._url_to_id.get(url)
+        return None if page_id is None else self.read(page_id)
+
+    def items(self):
+        for page_id in self.ids():
+            document = self.read(page_id)
+            if document is not None:
+                yield page_id, document
+
+    def __iter__(self):
+        for _, document in self.items():
+            yield document
+
+    def close(self):
+        pass
+
+
+class SegmentPageStore():
+    """
+    every record is a 4-byte little-endian length followed by the zlib
+    compressed json document; index.tsv has one
+    `id<TAB>segment<TAB>offset<TAB>length<TAB>url` line per record and
+    random reads go through mmap. a record that was cut off by a crash is
+    dropped when the store is opened again
+    """
+    format = 'segment'
+    INDEX_FILE_NAME = 'index.tsv'
+    _LENGTH = struct.Struct('<I')
+
+    def __init__(self, path, segment_size=PAGE_STORE_SEGMENT_SIZE):
+        self.path = path
+        self.segment_size = segment_size
+        os.makedirs(path, exist_ok=True)
+        self._locations = {}  # id -> (segment number, offset, length)
+        self._url_to_id = {}
+        self._maps = {}
+        self._load_index()
+        self._segment_number = max(
+            [location[0] for location in self._locations.values()] or [0])
+        self._segment_file = open(self._get_segment_path(
+            self._segment_number), 'ab')
+        self._segment_file.truncate(self._get_segment_end())
+        self._segment_file.seek(0, os.SEEK_END)
+
+    @staticmethod
+    def is_segment_store(path):
+        return os.path.isfile(os.path.join(path,
+                                           SegmentPageStore.INDEX_FILE_NAME))
+
+    def _get_segment_path(self, segment_number):
+        return os.path.join(self.path, 'segment-%05d.seg' % segment_number)
+
+    def _get_index_path(self):
+        return os.path.join(self.path, SegmentPageStore.INDEX_FILE_NAME)
+
+    def _load_index(self):
+        valid_size = 0
+        if os.path.exists(self._get_index_path()):
+            with open(self._get_index_path(), 'rb') as index_file:
+                for line in index_file:
+                    if not line.endswith(b'\n'):  # cut off by a crash
+                        break
+                    valid_size += len(line)
+                    page_id, segment_number, offset, length, url = \
+                        line.decode().rstrip('\n').split('\t', 4)
+                    self._locations[int(page_id)] = (
+                        int(segment_number), int(offset), int(length))
+                    self._url_to_id[url] = int(page_id)
+        self._index_file = open(self._get_index_path(), 'ab')
+        self._index_file.truncate(valid_size)
+
+    def _get_segment_end(self):
+        ends = [offset + length for segment_number, offset, length
+                in self._locations.values()
+                if segment_number == self._segment_number]
+        return max(ends or [0])
+
+    def ids(self):
+        return sorted(self._locations)
+
+    def write(self, page_id, document):
+        if self._segment_file.tell() >= self.segment_size:
+            self._segment_file.close()
+            self._segment_number += 1
+            self._segment_file = open(self._get_segment_path(
+                self._segment_number), 'ab')
+        record = zlib.compress(json.dumps(document).encode())
+        offset = self._segment_file.tell() + self._LENGTH.size
+        self._segment_file.write(self._LENGTH.pack(len(record)) + record)
+        self._segment_file.flush()
+        self._index_file.write(('%d\t%d\t%d\t%d\t%s\n' % (
+            page_id, self._segment_number, offset, len(record),
+            document['page_link'])).encode())
+        self._index_file.flush()
+        self._locations[page_id] = (self._segment_number, offset,
+                                    len(record))
+        self._url_to_id[document['page_link']] = page_id
+
+    def _get_map(self, segment_number, end):
+        segment_map = self._maps.get(segment_number)
+        if segment_map is None or len(segment_map) < end:  # segment grew
+            if segment_map is not None:
+                segment_map.close()
+            with open(self._get_segment_path(segment_number), 'rb') as f:
+                segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment_number] = segment_map
+        return segment_map
+
+    def read(self, page_id):
+        location = self._locations.get(page_id)
+        if location is None:
+            return None
+        segment_number, offset, length = location
+        segment_map = self._get_map(segment_number, offset + length)
+        return json.loads(zlib.decompress(segment_map[offset:offset + length])
+                          .decode())
+
+    def read_url(self, url):
+        page_id = self._url_to_id.get(url)
+        return None if page_id is None else self.read(page_id)
+
+    def items(self):
+        """
+        stream every record by reading the segments sequentially
+        """
+        offset_to_id = {location[:2]: page_id
+                        for page_id, location in self._locations.items()}
+        for segment_number in range(self._segment_number + 1):
+            with open(self._get_segment_path(segment_number), 'rb') as f:
+                offset = 0
+                while True:
+                    header = f.read(self._LENGTH.size)
+                    if len(header) < self._LENGTH.size:
+                        break
+                    length = self._LENGTH.unpack(header)[0]
+                    offset += self._LENGTH.size
+                    record = f.read(length)
+                    page_id = offset_to_id.get((segment_number, offset))
+                    offset += length
+                    if page_id is not None:  # skip overwritten records
+                        yield page_id, json.loads(
+                            zlib.decompress(record).decode())
+
+    def __iter__(self):
+        for _, document in self.items():
+            yield document
+
+    def close(self):
+        for segment_map in self._maps.values():
+            segment_map.close()
+        self._maps = {}
+        self._segment_file.close()
+        self._index_file.close()
+
+
+PAGE_STORE_CLASSES = {
+    DirectoryPageStore.format: DirectoryPageStore,
+    SegmentPageStore.format: SegmentPageStore,
+}
+
+
+def open_page_store(path, store_format=None):
+    """
+    open the store at `path` in its existing format, or in `store_format`
+    (directory by default) if it holds no segment store yet
+    """
+    if SegmentPageStore.is_segment_store(path):
+        store_format = SegmentPageStore.format
+    os.makedirs(path, exist_ok=True)
+    return PAGE_STORE_CLASSES[store_format or DirectoryPageStore.format](path)
+
+
+def convert_page_store(source_path, destination_path, store_format):
+    source = open_page_store(source_path)
+    destination = PAGE_STORE_CLASSES[store_format](destination_path)
+    for page_id, document in source.items():
+        destination.write(page_id, document)
+    source.close()
+    destination.close()
@@ -1,9 +1,100 @@
+import json
+import sys
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic, perf_counter
+
+import metrics
 from analysis import analyze
-from settings import ES, INDEX_NAME
+from generation import get_index_generation
+from settings import BATCH_SEARCH_SIZE, ES, INDEX_NAME, \
+    SEARCH_CACHE_CHECK_INTERVAL, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL
 
 
-def search(query, title_weight, introduction_weight, content_weight,
-           cluster_id):
+BATCH_SOURCE_FIELDS = ['page_link', 'title', 'cluster.id']
+
+
+class SearchCache():
+    """
+    LRU cache of search results that expire after `ttl` seconds; everything
+    is dropped when the index generation changes, which is checked at most
+    every `generation_check_interval` seconds
+    """
+
+    def __init__(self, max_size=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL,
+                 generation_check_interval=SEARCH_CACHE_CHECK_INTERVAL,
+                 get_generation=get_index_generation):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation_check_interval = generation_check_interval
+        self._get_generation = get_generation
+        self._generation = None
+        self._next_generation_check = 0
+        self._entries = OrderedDict()  # key -> (expiry time, result)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def get_key(analyzed_query, title_weight, introduction_weight,
+                content_weight, cluster_id, size=None):
+        return (analyzed_query, float(title_weight),
+                float(introduction_weight), float(content_weight),
+                int(cluster_id), size)
+
+    def _check_generation(self):
+        now = monotonic()
+        if now < self._next_generation_check:
+            return
+        self._next_generation_check = now + self.generation_check_interval
+        generation = self._get_generation()
+        with self._lock:
+            if generation != self._generation:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._generation = generation
+
+    def get(self, key):
+        self._check_generation()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] <= monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'generation': self._generation,
+        }
+
+
+def get_search_body(query, title_weight, introduction_weight, content_weight,
+                    cluster_id, size=None):
     title_weight = float(title_weight)
     introduction_weight = float(introduction_weight)
     content_weight = float(content_weight)
@@ -34,10 +125,157 @@ def search(query, title_weight, introduction_weight, content_weight,
                 'cluster.id': cluster_id,
             },
         })
-    hits = ES.search(index=INDEX_NAME, body=search_body)['hits']['hits']
+    if size is not None:
+        search_body['size'] = size
+    return search_body
+
+
+def search(query, title_weight, introduction_weight, content_weight,
+           cluster_id, backend='elasticsearch'):
+    if backend == 'local':
+        from local_search import LocalIndex
+
+        local_index = LocalIndex()
+        with metrics.span('query'):
+            hits = local_index.search(query, title_weight,
+                                      introduction_weight, content_weight,
+                                      cluster_id)
+    else:
+        search_body = get_search_body(query, title_weight,
+                                      introduction_weight, content_weight,
+                                      cluster_id)
+        with metrics.span('query'):
+            hits = ES.search(index=INDEX_NAME,
+                             body=search_body)['hits']['hits']
+    metrics.count('queries')
     for hit in hits:
         print('id:', hit['_id'])
         print('link:', hit['_source']['page_link'])
         print('title:', hit['_source']['title'])
         print('cluster_id:', hit['_source']['cluster.id'])
         print()
+
+
+def get_hit_summary(hit):
+    return {
+        'id': hit['_id'],
+        'score': hit['_score'],
+        'link': hit['_source']['page_link'],
+        'title': hit['_source']['title'],
+        'cluster_id': hit['_source'].get('cluster.id'),
+    }
+
+
+def _get_msearch_body(searches, title_weight, introduction_weight,
+                      content_weight, cluster_id, size):
+    body = []
+    for search_state in searches:
+        search_body = get_search_body(search_state['query'], title_weight,
+                                      introduction_weight, content_weight,
+                                      cluster_id, size)
+        search_body['_source'] = BATCH_SOURCE_FIELDS
+        search_body['sort'] = ['_score', {'_uid': 'asc'}]  # for search_after
+        # without it, hits sorted on more than one field have no _score
+        search_body['track_scores'] = True
+        if search_state['search_after']:
+            search_body['search_after'] = search_state['search_after']
+        body += [{'index': INDEX_NAME}, search_body]
+    return body
+
+
+def _search_batch(queries, title_weight, introduction_weight, content_weight,
+                  cluster_id, size, num_pages, client=ES):
+    """
+    run `queries` through _msearch, fetching up to `num_pages` pages of
+    `size` hits per query with search_after
+    """
+    searches = [{
+        'query': query,
+        'search_after': None,
+        'hits': [],
+        'took_ms': 0,
+        'latency_ms': 0.0,
+    } for query in queries]
+    pending_searches = searches
+    for _ in range(num_pages):
+        if not pending_searches:
+            break
+        body = _get_msearch_body(pending_searches, title_weight,
+                                 introduction_weight, content_weight,
+                                 cluster_id, size)
+        start = perf_counter()
+        with metrics.span('query'):
+            responses = client.msearch(body=body)['responses']
+        latency_ms = (perf_counter() - start) * 1000
+        metrics.count('queries', len(pending_searches))
+
+        next_pending_searches = []
+        for search_state, response in zip(pending_searches, responses):
+            search_state['latency_ms'] += latency_ms
+            if 'error' in response:
+                search_state['error'] = response['error']
+                continue
+            search_state['took_ms'] += response['took']
+            hits = response['hits']['hits']
+            search_state['hits'] += [get_hit_summary(hit) for hit in hits]
+            if len(hits) == size:
+                search_state['search_after'] = hits[-1]['sort']
+                next_pending_searches.append(search_state)
+        pending_searches = next_pending_searches
+
+    for search_state in searches:
+        del search_state['search_after']
+    return searches
+
+
+def _search_batch_locally(local_index, queries, title_weight,
+                          introduction_weight, content_weight, cluster_id,
+                          size, num_pages):
+    results = []
+    for query in queries:
+        start = perf_counter()
+        with metrics.span('query'):
+            hits = local_index.search(query, title_weight,
+                                      introduction_weight, content_weight,
+                                      cluster_id, size * num_pages)
+        latency_ms = (perf_counter() - start) * 1000
+        metrics.count('queries')
+        results.append({
+            'query': query,
+            'hits': [get_hit_summary(hit) for hit in hits],
+            'took_ms': int(latency_ms),
+            'latency_ms': latency_ms,
+        })
+    return results
+
+
+def search_batch(queries_path, output_path, title_weight, introduction_weight,
+                 content_weight, cluster_id, size=10, num_pages=1,
+                 batch_size=BATCH_SEARCH_SIZE, backend='elasticsearch'):
+    """
+    search every line of `queries_path` and write one json line per query
+    with its hits and latency to `output_path` ('-' for stdout)
+    """
+    if backend == 'local':
+        from local_search import LocalIndex
+
+        local_index = LocalIndex()
+    with open(queries_path, 'r') as queries_file:
+        queries = [line.strip() for line in queries_file if line.strip()]
+    output_file = sys.stdout if output_path == '-' else \
+        open(output_path, 'w')
+    for start in range(0, len(queries), batch_size):
+        if backend == 'local':
+            results = _search_batch_locally(
+                local_index, queries[start:start + batch_size], title_weight,
+                introduction_weight, content_weight, cluster_id, size,
+                num_pages)
+        else:
+            results = _search_batch(
+                queries[start:start + batch_size], title_weight,
+                introduction_weight, content_weight, cluster_id, size,
+                num_pages)
+        for result in results:
+            output_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+    if output_file is not sys.stdout:
+        output_file.close()
@@ -0,0 +1,159 @@
+"""
+long-running http search service: GET /search?q=...&title_weight=...&
+introduction_weight=...&content_weight=...&cluster_id=...&size=... returns
+the hits as json. queries are built with search.get_search_body() and sent
+from a thread pool through one pooled elasticsearch client; results are
+kept in a search.SearchCache whose counters are served at GET /stats
+"""
+import asyncio
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from elasticsearch import Elasticsearch, TransportError
+
+import metrics
+from analysis import analyze
+from es_connection import CountingConnection
+from generation import get_index_generation
+from search import SearchCache, get_hit_summary, get_search_body
+from settings import ES_HOST, ES_PORT, ES_TIMEOUT, INDEX_NAME, \
+    SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SERVE_WORKERS
+
+
+class SearchService():
+    """
+    results are cached if `cache_size` > 0; the cache follows the index
+    generation read through the service's own client
+    """
+
+    def __init__(self, client=None, workers=SERVE_WORKERS,
+                 cache_size=SEARCH_CACHE_SIZE, cache_ttl=SEARCH_CACHE_TTL):
+        self.client = client or Elasticsearch(
+            hosts=[{'host': ES_HOST, 'port': ES_PORT}], timeout=ES_TIMEOUT,
+            maxsize=workers, connection_class=CountingConnection)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.cache = SearchCache(
+            cache_size, cache_ttl,
+            get_generation=lambda: get_index_generation(self.client),
+        ) if cache_size > 0 else None
+
+    def _search(self, parameters):
+        # analyze() is idempotent, so the analyzed query builds the same body
+        search_arguments = (
+            analyze(parameters['q']),
+            parameters.get('title_weight', 1),
+            parameters.get('introduction_weight', 1),
+            parameters.get('content_weight', 1),
+            parameters.get('cluster_id', -1),
+            int(parameters.get('size', 10)),
+        )
+        if self.cache is None:
+            return self._search_elasticsearch(search_arguments)
+        cache_key = SearchCache.get_key(*search_arguments)
+        result = self.cache.get(cache_key)
+        if result is None:
+            result = self._search_elasticsearch(search_arguments)
+            self.cache.put(cache_key, result)
+        return result
+
+    def _search_elasticsearch(self, search_arguments):
+        search_body = get_search_body(*search_arguments)
+        with metrics.span('query'):
+            response = self.client.search(index=INDEX_NAME, body=search_body)
+        return {
+            'took': response['took'],
+            'total': response['hits']['total'],
+            'hits': [get_hit_summary(hit) for hit in response['hits']['hits']],
+        }
+
+    async def _route(self, method, target):
+        url = urlsplit(target)
+        if method != 'GET':
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'use GET'}
+        if url.path == '/health':
+            return HTTPStatus.OK, {'status': 'ok'}
+        if url.path == '/stats':
+            return HTTPStatus.OK, {
+                'cache': self.cache.stats() if self.cache else None,
+            }
+        if url.path != '/search':
+            return HTTPStatus.NOT_FOUND, {'error': 'not found'}
+
+        parameters = {name: values[-1] for name, values
+                      in parse_qs(url.query).items()}
+        if not parameters.get('q'):
+            return HTTPStatus.BAD_REQUEST, {'error': 'q is required'}
+        loop = asyncio.get_event_loop()
+        try:
+            result = await loop.run_in_executor(self.executor, self._search,
+                                                parameters)
+        except ValueError as e:  # bad number in a parameter
+            return HTTPStatus.BAD_REQUEST, {'error': str(e)}
+        except TransportError as e:
+            return HTTPStatus.BAD_GATEWAY, {'error': str(e)}
+        return HTTPStatus.OK, result
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = \
+                    request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if 'content-length' in headers:  # bodies are ignored
+                    await reader.readexactly(int(headers['content-length']))
+
+                try:
+                    status, result = await self._route(method, target)
+                except Exception:  # a bug rather than a bad request
+                    traceback.print_exc()
+                    status, result = HTTPStatus.INTERNAL_SERVER_ERROR, {
+                        'error': 'internal server error'}
+                keep_alive = version == 'HTTP/1.1' and \
+                    headers.get('connection', '').lower() != 'close'
+                body = json.dumps(result, ensure_ascii=False).encode()
+                writer.write((
+                    'HTTP/1.1 %d %s\r\n'
+                    'Content-Type: application/json; charset=utf-8\r\n'
+                    'Content-Length: %d\r\n'
+                    'Connection: %s\r\n\r\n' % (
+                        status.value, status.phrase, len(body),
+                        'keep-alive' if keep_alive else 'close')
+                ).encode() + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass  # malformed request or client went away
+        finally:
+            writer.close()
+
+
+def serve(host, port, workers=SERVE_WORKERS, cache_size=SEARCH_CACHE_SIZE,
+          cache_ttl=SEARCH_CACHE_TTL):
+    service = SearchService(workers=workers, cache_size=cache_size,
+                            cache_ttl=cache_ttl)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(asyncio.start_server(
+        service.handle_connection, host, port))
+    print('serving on http://%s:%d' % (host, port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    service.executor.shutdown()
+    loop.close()
@@ -1,20 +1,94 @@
 import os
 import sys
 
-from elasticsearch import Elasticsearch
-
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 DEFAULT_PAGES_DIR = os.path.join(BASE_DIR, 'pages')
+PAGE_STORE_SEGMENT_SIZE = 64 * 1024 * 1024  # bytes
+
+
+ES_HOST = os.environ.get('MIR3_ES_HOST', 'localhost')
+ES_PORT = os.environ.get('MIR3_ES_PORT', '9200')
+ES_TIMEOUT = float(os.environ.get('MIR3_ES_TIMEOUT', '10'))  # seconds
+
+
+class _LazyElasticsearch():
+    """
+    stands in for the elasticsearch client, which (with the elasticsearch
+    package) is only created on first use
+    """
+
+    def __init__(self):
+        self._client = None
+
+    def __getattr__(self, name):
+        if self._client is None:
+            from elasticsearch import Elasticsearch
+
+            from es_connection import CountingConnection
 
+            self._client = Elasticsearch(
+                hosts=[{'host': ES_HOST, 'port': ES_PORT}],
+                timeout=ES_TIMEOUT, connection_class=CountingConnection)
+        return getattr(self._client, name)
 
-ES_HOST = 'localhost'
-ES_PORT = '9200'
-ES = Elasticsearch(hosts=[{'host': ES_HOST, 'port': ES_PORT}])
+
+ES = _LazyElasticsearch()
 INDEX_NAME = 'mir3'
 DOC_TYPE = 'wiki'
+META_INDEX_NAME = INDEX_NAME + '_meta'
+META_DOC_TYPE = 'meta'
+
+
+SERVE_HOST = '127.0.0.1'
+SERVE_PORT = 8000
+SERVE_WORKERS = 16  # concurrent elasticsearch requests
+SEARCH_CACHE_SIZE = 10000  # results
+SEARCH_CACHE_TTL = 3600  # seconds
+SEARCH_CACHE_CHECK_INTERVAL = 5  # seconds
+MAPPING_PROFILE_NAMES = ['default', 'lean']  # keys of index.MAPPING_PROFILES
+BATCH_SEARCH_SIZE = 100  # queries per _msearch request
+SEARCH_BACKENDS = ['elasticsearch', 'local']
+LOCAL_INDEX_DIR = os.path.join(BASE_DIR, 'local_index')
+BM25_K1 = 1.2  # elasticsearch's defaults
+BM25_B = 0.75
+
+
+BULK_WORKERS = 4
+BULK_CHUNK_SIZE = 500  # documents
+BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+BULK_MAX_RETRIES = 5
+BULK_INITIAL_BACKOFF = 1  # seconds
+
+
+CRAWL_CONCURRENCY = 8
+CRAWL_PER_HOST_CONCURRENCY = 4
+CRAWL_CHECKPOINT_INTERVAL = 100  # pages
+CRAWL_CHECKPOINT_FILE_NAME = '.crawl_checkpoint.json'
+CRAWL_FRONTIER_SPILL_FILE_NAME = '.crawl_frontier.spill'
+FRONTIER_MEMORY_LIMIT = 100000  # urls
+FRONTIER_BLOOM_ERROR_RATE = 0.0001
+DEFAULT_EXTRACTOR = 'html.parser'
+DEFAULT_PAGE_CACHE_PATH = os.path.join(BASE_DIR, 'page_cache.sqlite3')
 
 
 K_MEANS_ACCEPTABLE_DIFF = 1
 K_MEANS_RETRY = 5
+# keys of cluster.K_SELECTION_STRATEGIES and cluster.K_MEANS_ESTIMATORS
+K_SELECTION_STRATEGY_NAMES = ['linear', 'bracketed']
+K_MEANS_ESTIMATOR_NAMES = ['kmeans', 'minibatch']
+REDUCTION_NAMES = ['none', 'svd', 'projection']  # keys of cluster.REDUCTIONS
+REDUCTION_COMPONENTS = 100
+STREAM_BATCH_SIZE = 1000  # documents
+STREAM_FEATURES = 2 ** 18  # hash buckets
+CLUSTER_MODEL_DIR = os.path.join(BASE_DIR, 'cluster_model')
+CLUSTER_MODEL_KEEP = 2  # versions
+CLUSTER_ASSIGN_BATCH_SIZE = 500  # documents
+CLUSTER_DRIFT_THRESHOLD = 1.25  # mean distance / mean training distance
+FEATURE_CACHE_PATH = os.path.join(BASE_DIR, 'feature_cache.npz')
+# keys of cluster.CLUSTER_WRITE_BACKS
+CLUSTER_WRITE_BACK_NAMES = ['grouped', 'per-document']
+CLUSTER_UPDATE_BATCH_SIZE = 1000  # document ids per update by query
+CLUSTER_UPDATE_WORKERS = 4  # concurrent update by query requests
+CLUSTER_LABEL_COUNT = 5  # labels printed per cluster
 VERY_HIGH_INERTIA = sys.float_info.max
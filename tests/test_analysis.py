@@ -0,0 +1,119 @@
+import os
+import random
+import re
+
+import pytest
+
+from analysis import analyze, analyze_many, _analyze_multi_pass, \
+    remove_inside_brackets
+from index import BRACKETS_DEPTH, PERSIAN_ANALYZER, _get_brackets_pattern, \
+    get_analysis_settings
+from page_store import open_page_store
+
+
+FIXTURE_PAGES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                 'fixtures', 'pages')
+
+
+def _read_fixture_texts():
+    texts = []
+    page_store = open_page_store(FIXTURE_PAGES_DIR)
+    for document_json in page_store:
+        texts.append(document_json['title'])
+        texts.append(document_json['introduction'])
+        texts.extend(document_json['content'])
+    page_store.close()
+    return texts
+
+
+FIXTURE_TEXTS = _read_fixture_texts()
+
+
+def test_fixture_is_not_empty():
+    assert len(FIXTURE_TEXTS) == 20
+
+
+@pytest.mark.parametrize('text', FIXTURE_TEXTS)
+def test_single_pass_matches_multi_pass(text):
+    assert analyze(text) == _analyze_multi_pass(text)
+
+
+EXPECTED_TOKENS = [
+    ('تهران پایتخت ایران است.[۱]', 'تهران پایتخت ایران است'),
+    ('پرجمعیت‌ترین شهر در سال ۱۳۹۵', 'پرجمعیت ترین شهر در سال 1395'),
+    ('كتاب «ديوان» را مي‌خوانند؟', 'کتاب دیوان را می خوانند'),
+    ('مؤلّفهٔ همبند آن', 'مولفه همبند ان'),
+    ('اَلا یا اَیُّهَا السّاقی', 'الا یا ایها الساقی'),
+    ('Python۳ و café از سال ٢٠٠١', 'Python 3 و cafe از سال 2001'),
+    ('متن [یادداشت [۳] از [۴]] ادامه', 'متن ادامه'),
+    ('پیوند] ناقص [ادامه', 'پیوندادامه'),
+    ('پرانتز [که بسته نمی‌شود', 'پرانتز'),
+]
+
+
+@pytest.mark.parametrize('text, expected', EXPECTED_TOKENS)
+def test_analyze_gives_expected_tokens(text, expected):
+    assert analyze(text) == expected
+
+
+def _get_depth(text):
+    depth = max_depth = 0
+    for character in text:
+        depth += (character == '[') - (character == ']')
+        max_depth = max(max_depth, abs(depth))
+    return max_depth
+
+
+@pytest.mark.parametrize('workers, chunk_size', [(0, 10), (-1, 10), (2, 0)])
+def test_analyze_many_rejects_invalid_sizes(workers, chunk_size):
+    with pytest.raises(ValueError):
+        analyze_many(['a'], workers, chunk_size)
+
+
+def test_analyze_many_serially_matches_analyze():
+    texts = ['سلام دنیا', 'کتاب‌ها [۱]']
+    assert list(analyze_many(texts, workers=1, chunk_size=1)) == \
+        [analyze(text) for text in texts]
+
+
+def test_brackets_pattern_matches_analysis():
+    pattern = re.compile(_get_brackets_pattern(BRACKETS_DEPTH))
+    generator = random.Random(0)
+    for _ in range(20000):
+        text = ''.join(generator.choice('ab [][]')
+                       for _ in range(generator.randint(0, 24)))
+        if _get_depth(text) <= BRACKETS_DEPTH:
+            assert pattern.sub('', text) == remove_inside_brackets(text)
+
+
+def test_brackets_pattern_drops_text_after_deeper_brackets():
+    pattern = re.compile(_get_brackets_pattern(BRACKETS_DEPTH))
+    depth = BRACKETS_DEPTH + 1
+    text = 'a %sb%s c' % ('[' * depth, ']' * depth)
+    assert remove_inside_brackets(text) == 'a  c'
+    assert pattern.sub('', text) == 'a '
+
+
+@pytest.fixture(scope='module')
+def parity_index():
+    from settings import ES, INDEX_NAME
+
+    if not ES.ping():
+        pytest.skip('elasticsearch is not reachable')
+    index_name = INDEX_NAME + '_test_parity'
+    ES.indices.create(index=index_name, body={
+        'settings': {'analysis': get_analysis_settings()},
+    })
+    yield ES, index_name
+    ES.indices.delete(index=index_name)
+
+
+@pytest.mark.parametrize('text', FIXTURE_TEXTS + [
+    text for text, _ in EXPECTED_TOKENS])
+def test_elasticsearch_analyzer_matches_analyze(parity_index, text):
+    client, index_name = parity_index
+    tokens = [token['token'] for token in client.indices.analyze(
+        index=index_name,
+        body={'analyzer': PERSIAN_ANALYZER, 'text': text},
+    )['tokens']]
+    assert tokens == analyze(text).lower().split()
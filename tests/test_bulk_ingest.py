@@ -0,0 +1,95 @@
+import json
+
+import pytest
+from elasticsearch import TransportError
+from elasticsearch.helpers import BulkIndexError
+
+from bulk_ingest import _get_chunks, _send_chunk, bulk_ingest
+
+
+def _get_action(number, size=10):
+    return {'_index': 'test', '_type': 'page', '_id': str(number),
+            '_source': {'text': 'x' * size}}
+
+
+def _get_ids(body):
+    lines = body.splitlines()
+    return [json.loads(line)['index']['_id'] for line in lines[::2]]
+
+
+class _StandInClient():
+    """
+    answers the bulk requests with `responses` in turn: a status code for
+    the whole request, or a dict of status codes of some ids (the others
+    succeed)
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.bodies = []
+
+    def bulk(self, body):
+        self.bodies.append(body)
+        response = self.responses.pop(0) if self.responses else {}
+        if isinstance(response, int):
+            raise TransportError(response, 'rejected')
+        return {'items': [{'index': {'_id': action_id,
+                                     'status': response.get(action_id, 201)}}
+                          for action_id in _get_ids(body)]}
+
+
+def test_chunks_are_bounded_by_count_and_bytes():
+    actions = [_get_action(number, size=10 + 37 * (number % 7))
+               for number in range(200)]
+    max_bytes = 900
+    chunks = list(_get_chunks(actions, 5, max_bytes))
+    chunk_bytes = [sum(len(serialized) for serialized in chunk)
+                   for chunk in chunks]
+    assert max(len(chunk) for chunk in chunks) == 5
+    assert max(chunk_bytes) <= max_bytes
+    # both bounds closed some of the chunks
+    assert any(len(chunk) < 5 and
+               chunk_bytes[number] + len(chunks[number + 1][0]) > max_bytes
+               for number, chunk in enumerate(chunks[:-1]))
+    assert [action_id for chunk in chunks
+            for action_id in _get_ids(b''.join(chunk).decode())] == \
+        [str(number) for number in range(200)]
+
+
+def test_an_action_larger_than_max_bytes_gets_its_own_chunk():
+    actions = [_get_action(0), _get_action(1, size=1000), _get_action(2)]
+    chunks = list(_get_chunks(actions, 10, 200))
+    assert [len(chunk) for chunk in chunks] == [1, 1, 1]
+    assert len(chunks[1][0]) > 200
+
+    client = _StandInClient([])
+    assert bulk_ingest(client, actions, workers=1, chunk_size=10,
+                       max_chunk_bytes=200) == \
+        (3, sum(len(chunk[0]) for chunk in chunks))
+    assert [_get_ids(body) for body in client.bodies] == [['0'], ['1'], ['2']]
+
+
+def test_rejected_requests_and_actions_are_retried():
+    chunk = list(_get_chunks([_get_action(number) for number in range(4)],
+                             10, 10000))[0]
+    client = _StandInClient([429, {'1': 429, '2': 400}, {'1': 429}, {}])
+    num_actions, num_bytes, errors = _send_chunk(client, chunk, 5, 0)
+    assert num_actions == 4
+    assert num_bytes == sum(len(serialized) for serialized in chunk)
+    assert [_get_ids(body) for body in client.bodies] == \
+        [['0', '1', '2', '3'], ['0', '1', '2', '3'], ['1'], ['1']]
+    assert errors == [{'index': {'_id': '2', 'status': 400}}]
+
+
+def test_retries_give_up_after_max_retries():
+    chunk = list(_get_chunks([_get_action(0)], 10, 10000))[0]
+    client = _StandInClient([{'0': 429}] * 3)
+    assert _send_chunk(client, chunk, 2, 0)[2] == \
+        [{'index': {'_id': '0', 'status': 429}}]
+    assert len(client.bodies) == 3
+
+    with pytest.raises(TransportError):
+        _send_chunk(_StandInClient([429] * 3), chunk, 2, 0)
+    with pytest.raises(BulkIndexError):
+        bulk_ingest(_StandInClient([{'0': 400}]), [_get_action(0)],
+                    workers=1, initial_backoff=0)
@@ -0,0 +1,209 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import cluster
+import feature_cache
+from cluster import K_SELECTION_STRATEGIES, _get_k, _KSweep
+
+
+def _get_blobs(num_blobs, per_blob=20, seed=0):
+    # far apart blobs, so inertia stops improving past `num_blobs` clusters
+    generator = np.random.RandomState(seed)
+    centers = generator.uniform(-100, 100, (num_blobs, 5))
+    return np.vstack([center + generator.normal(0, 0.01, (per_blob, 5))
+                      for center in centers])
+
+
+@pytest.mark.parametrize('num_probes', [1, 3])
+def test_strategies_select_the_same_k_and_keep_few_models(num_probes):
+    vectors = _get_blobs(5)
+    selected = {}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for strategy, select in sorted(K_SELECTION_STRATEGIES.items()):
+            sweep = _KSweep(executor, 0, 'kmeans', vectors)
+            k = select(sweep, 12, num_probes)
+            assert list(sweep.models) == [k]
+            selected[strategy] = k
+    assert selected == {'bracketed': 5, 'linear': 5}
+
+
+def test_get_k_returns_a_model_of_the_selected_k():
+    documents = {'vectors': _get_blobs(3)}
+    for strategy in sorted(K_SELECTION_STRATEGIES):
+        k, model = _get_k(8, documents, strategy, workers=2, seed=0)
+        assert k == 3
+        assert model.cluster_centers_.shape == (3, 5)
+
+
+def test_feature_cache_is_invalidated_by_content_and_parameters(
+        tmpdir, monkeypatch):
+    cache_path = str(tmpdir.join('features.npz'))
+    generation = {'content': 1, 'cluster': 1}
+    scans = []
+
+    def scan(client, query, index, doc_type):
+        scans.append(query)
+        return [{'_id': 'd%d' % number, '_source': {
+            'analyzed_title': 'word%d' % number,
+            'analyzed_introduction': 'shared',
+            'analyzed_content': 'text %d' % (number % 2),
+        }} for number in range(6)]
+
+    monkeypatch.setattr(cluster, 'scan', scan)
+    monkeypatch.setattr(feature_cache, 'get_index_generation',
+                        lambda: dict(generation))
+    monkeypatch.setattr(
+        cluster, 'load_features',
+        lambda key: feature_cache.load_features(key, cache_path))
+    monkeypatch.setattr(
+        cluster, 'save_features',
+        lambda key, documents, features: feature_cache.save_features(
+            key, documents, features, cache_path))
+
+    def get_features(**parameters):
+        documents, features = cluster._get_documents_and_features(
+            **parameters)
+        return documents['ids'], documents['vectors'].toarray(), features
+
+    built = get_features()
+    assert len(scans) == 1
+    cached = get_features()
+    assert len(scans) == 1  # an identical run hits the cache
+    assert cached[0] == built[0] and cached[2] == built[2]
+    assert np.array_equal(cached[1], built[1])
+
+    get_features(min_df=2)
+    assert len(scans) == 2  # other vectorizer parameters miss it
+    generation['cluster'] += 1
+    get_features(min_df=2)
+    assert len(scans) == 2  # cluster writes do not change the features
+    generation['content'] += 1
+    get_features(min_df=2)
+    assert len(scans) == 3  # indexing does
+    get_features(min_df=2, rebuild=True)
+    assert len(scans) == 4
+
+
+CLUSTER_LABELS = [['a', 'b'], ['c', 'd']]
+# (document id, its current cluster id and label, its new cluster id)
+WRITE_BACK_DOCUMENTS = [
+    ('d0', (0, 'a b'), 0),  # unchanged
+    ('d1', (1, 'c d'), 0),  # moved
+    ('d2', (0, 'a b'), 1),  # moved
+    ('d3', (1, 'old label'), 1),  # relabeled
+    ('d4', (None, None), 0),  # never clustered
+    ('d5', (1, 'c d'), 1),  # unchanged
+]
+
+
+class _Indices():
+    def refresh(self, index):
+        pass
+
+
+class _UpdateByQueryClient():
+    indices = _Indices()
+
+    def __init__(self):
+        self.requests = []
+
+    def update_by_query(self, index, doc_type, conflicts, body):
+        assert conflicts == 'proceed'
+        self.requests.append((body['script']['params']['id'],
+                              body['script']['params']['label'],
+                              body['query']['ids']['values']))
+        return {'updated': len(body['query']['ids']['values']),
+                'version_conflicts': 0}
+
+
+def test_grouped_write_back_only_updates_changed_documents(monkeypatch):
+    def scan(client, query, index, doc_type):
+        for document_id, (cluster_id, label), _ in WRITE_BACK_DOCUMENTS:
+            source = {} if cluster_id is None else \
+                {'cluster.id': cluster_id, 'cluster.label': label}
+            yield {'_id': document_id, '_source': source}
+
+    monkeypatch.setattr(cluster, 'scan', scan)
+    client = _UpdateByQueryClient()
+    assert cluster._write_clusters_grouped(
+        [document_id for document_id, _, _ in WRITE_BACK_DOCUMENTS],
+        np.array([label for _, _, label in WRITE_BACK_DOCUMENTS]),
+        CLUSTER_LABELS, client, workers=1) == (2, 4)
+    assert client.requests == [(0, 'a b', ['d1', 'd4']),
+                               (1, 'c d', ['d2', 'd3'])]
+
+
+@pytest.mark.parametrize('batch_size, expected_requests', [
+    (1000, [(0, 'a b', ['d1', 'd4']), (1, 'c d', ['d2', 'd3'])]),
+    (1, [(0, 'a b', ['d1']), (1, 'c d', ['d2']), (1, 'c d', ['d3']),
+         (0, 'a b', ['d4'])]),
+])
+def test_streamed_write_back_only_updates_changed_documents(
+        monkeypatch, batch_size, expected_requests):
+    new_labels = {document_id: label
+                  for document_id, _, label in WRITE_BACK_DOCUMENTS}
+    monkeypatch.setattr(
+        cluster, '_assign_streamed_batch',
+        lambda texts, vectorizer, model: (
+            None, np.array([new_labels[text] for text in texts]), None))
+
+    def get_batches():  # the texts stand in for the ids
+        for start in range(0, len(WRITE_BACK_DOCUMENTS), 2):
+            batch = WRITE_BACK_DOCUMENTS[start:start + 2]
+            ids = [document_id for document_id, _, _ in batch]
+            yield ids, ids, [current for _, current, _ in batch]
+
+    client = _UpdateByQueryClient()
+    assert cluster._write_streamed_clusters(
+        get_batches, None, None, CLUSTER_LABELS, None, client,
+        batch_size) == (len(expected_requests), 4)
+    assert client.requests == expected_requests
+
+
+STREAMED_TEXTS = ['سیب موز', 'سیب گلابی', 'موز گلابی', 'ماشین قطار',
+                  'قطار هواپیما', 'هواپیما ماشین', 'سیب قطار']
+
+
+class _LocalClusters():
+    def __init__(self):
+        self.labels = {}
+
+    def update(self, ids, labels):
+        self.labels.update(zip(ids, labels.tolist()))
+
+
+def _get_streamed_batches(batch_size, with_clusters=False):
+    def get_batches():
+        for start in range(0, len(STREAMED_TEXTS), batch_size):
+            texts = STREAMED_TEXTS[start:start + batch_size]
+            ids = list(range(start, start + len(texts)))
+            if with_clusters:
+                yield ids, texts, [(None, None)] * len(texts)
+            else:
+                yield ids, texts
+    return get_batches
+
+
+def test_streaming_labels_documents_left_out_of_training():
+    # with batches of 3 and k = 4 the last document is never trained on
+    k = 4
+    vectorizer, model = cluster._fit_streaming_model(
+        _get_streamed_batches(3), k, 64, seed=0)
+    totals = cluster._get_streamed_totals(
+        _get_streamed_batches(3), vectorizer, model)
+    assert totals['sizes'].sum() == len(STREAMED_TEXTS)
+
+    local_clusters = _LocalClusters()
+    cluster._write_streamed_clusters(
+        _get_streamed_batches(3, with_clusters=True), vectorizer, model,
+        [['x']] * k, local_clusters, _UpdateByQueryClient())
+    assert sorted(local_clusters.labels) == list(range(len(STREAMED_TEXTS)))
+    assert set(local_clusters.labels.values()) <= set(range(k))
+
+
+def test_streaming_rejects_fewer_documents_than_clusters():
+    with pytest.raises(ValueError):
+        cluster._fit_streaming_model(
+            _get_streamed_batches(2), len(STREAMED_TEXTS) + 1, 64)
@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+import pytest
+
+from cluster_model import CURRENT_FILE_NAME, load_cluster_model, \
+    save_cluster_model
+
+
+META = {
+    'vectorizer': 'hashing',
+    'num_features': 8,
+    'reduction': 'none',
+    'mean_distance': 0.5,
+    'labels': [['a'], ['b']],
+}
+
+
+def _save(model_dir):
+    return save_cluster_model(META, {
+        'idf': np.ones(8),
+        'centroids': np.eye(2, 8),
+    }, model_dir=model_dir)
+
+
+@pytest.mark.parametrize('current', [None, 'not a version\n'])
+def test_versions_follow_saved_models_without_current(tmpdir, current):
+    model_dir = str(tmpdir)
+    assert _save(model_dir) == 1
+    current_path = os.path.join(model_dir, CURRENT_FILE_NAME)
+    if current is None:
+        os.remove(current_path)
+    else:
+        with open(current_path, 'w') as current_file:
+            current_file.write(current)
+
+    assert _save(model_dir) == 2
+    assert load_cluster_model(model_dir).version == 2
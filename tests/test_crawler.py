@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+import crawler
+from page_cache import PageCache
+from page_store import open_page_store
+
+
+PAGE_URL = 'https://fa.wikipedia.org/wiki/P%d'
+MISSING_URL = 'https://fa.wikipedia.org/wiki/Missing'  # never cached
+NUM_CACHED_PAGES = 30
+MAX_PAGES = 12
+
+
+def _get_page_source(number):
+    links = ['/wiki/P%d' % (2 * number + 1), '/wiki/P%d' % (2 * number + 2)]
+    if number == 2:  # in the fetch queue at the checkpoint before page 8
+        links.append('/wiki/Missing')
+    return (
+        '<html><body><h1 id="firstHeading">P%d</h1>'
+        '<div id="mw-content-text"><p>page %d</p>%s</div></body></html>' % (
+            number, number, ''.join('<a href="%s">link</a>' % link
+                                    for link in links))
+    ).encode()
+
+
+@pytest.fixture
+def page_cache_path(tmpdir):
+    path = str(tmpdir.join('page_cache.sqlite3'))
+    page_cache = PageCache(path)
+    for number in range(NUM_CACHED_PAGES):
+        page_cache.put(PAGE_URL % number, _get_page_source(number))
+    page_cache.close()
+    return path
+
+
+def _crawl(pages_dir, page_cache_path, store_format, resume=False):
+    crawler.crawl(3, MAX_PAGES, [PAGE_URL % 0], pages_dir, concurrency=3,
+                  resume=resume, checkpoint_interval=3,
+                  page_cache_path=page_cache_path, offline=True,
+                  store_format=store_format)
+
+
+def _read_pages(pages_dir):
+    page_store = open_page_store(pages_dir)
+    pages = list(page_store.items())
+    page_store.close()
+    return pages
+
+
+@pytest.mark.parametrize('store_format', ['directory', 'segment'])
+@pytest.mark.parametrize('killed', [False, True])
+def test_resumed_crawl_matches_uninterrupted_one(
+        tmpdir, monkeypatch, page_cache_path, store_format, killed):
+    expected_dir = str(tmpdir.join('expected'))
+    _crawl(expected_dir, page_cache_path, store_format)
+    expected_pages = _read_pages(expected_dir)
+    assert len(expected_pages) == MAX_PAGES
+    assert MISSING_URL not in [page['page_link']
+                               for _, page in expected_pages]
+
+    extract = crawler.EXTRACTORS['html.parser']
+    save_checkpoint = crawler._save_checkpoint
+    parsed_sources = []
+    interrupted = []
+
+    def interrupt_ninth_page(page_source):
+        if len(parsed_sources) == 8 and not interrupted:
+            interrupted.append(True)
+            raise KeyboardInterrupt
+        parsed_sources.append(page_source)
+        return extract(page_source)
+
+    def save_unless_killed(*args):
+        # a killed crawl only has the last periodic checkpoint
+        if not (killed and interrupted):
+            save_checkpoint(*args)
+
+    monkeypatch.setitem(crawler.EXTRACTORS, 'html.parser',
+                        interrupt_ninth_page)
+    monkeypatch.setattr(crawler, '_save_checkpoint', save_unless_killed)
+    pages_dir = str(tmpdir.join('resumed'))
+    with pytest.raises(KeyboardInterrupt):
+        _crawl(pages_dir, page_cache_path, store_format)
+    assert len(_read_pages(pages_dir)) == 8
+
+    _crawl(pages_dir, page_cache_path, store_format, resume=True)
+    assert _read_pages(pages_dir) == expected_pages
+    # pages written after the checkpoint are read back, not parsed again
+    assert len(parsed_sources) == MAX_PAGES
+    assert not os.path.exists(crawler._get_checkpoint_path(pages_dir))
+
+
+def test_resume_without_checkpoint_starts_a_new_crawl(tmpdir,
+                                                      page_cache_path):
+    expected_dir = str(tmpdir.join('expected'))
+    _crawl(expected_dir, page_cache_path, 'directory')
+    pages_dir = str(tmpdir.join('resumed'))
+    _crawl(pages_dir, page_cache_path, 'directory', resume=True)
+    assert _read_pages(pages_dir) == _read_pages(expected_dir)
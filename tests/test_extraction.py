@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+from crawler import Page
+
+
+FIXTURE_HTML_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                'fixtures', 'html')
+FIXTURE_FILE_NAMES = sorted(file_name for file_name
+                            in os.listdir(FIXTURE_HTML_DIR)
+                            if file_name.endswith('.html'))
+
+
+def _read_fixture(file_name):
+    with open(os.path.join(FIXTURE_HTML_DIR, file_name), 'rb') as html_file:
+        return html_file.read()
+
+
+@pytest.mark.parametrize('file_name', FIXTURE_FILE_NAMES)
+def test_extractors_agree(file_name):
+    pytest.importorskip('bs4')
+    pytest.importorskip('lxml')
+    link = 'https://fa.wikipedia.org/wiki/' + file_name[:-5]
+    page_source = _read_fixture(file_name)
+    expected = Page(link, page_source, 'html.parser').json()
+    assert expected['title'] and expected['content'] and expected['links']
+    assert Page(link, page_source, 'lxml').json() == expected
@@ -0,0 +1,24 @@
+import pytest
+
+from frontier import BloomFilter, Frontier
+
+
+def test_urls_spilled_beyond_the_memory_limit_come_back_in_order(tmpdir):
+    frontier = Frontier(str(tmpdir.join('spill')), memory_limit=1)
+    frontier.extend(['a', 'b', 'a', 'c'])
+    assert [frontier.pop() for _ in range(3)] == ['a', 'b', 'c']
+    assert not frontier
+    frontier.close()
+
+
+def test_memory_limit_must_hold_a_url(tmpdir):
+    with pytest.raises(ValueError):
+        Frontier(str(tmpdir.join('spill')), memory_limit=0)
+
+
+@pytest.mark.parametrize('capacity, error_rate', [
+    (0, 0.01), (-5, 0.01), (100, 0), (100, 1), (100, 1.5), (100, -0.1),
+])
+def test_bloom_filter_rejects_invalid_sizes(capacity, error_rate):
+    with pytest.raises(ValueError):
+        BloomFilter(capacity, error_rate)
@@ -0,0 +1,46 @@
+from collections import Counter
+
+import index
+from documents import _get_content_hash, get_document_id
+from page_store import DirectoryPageStore
+
+
+def _get_page(name, content):
+    return {
+        'page_link': 'https://fa.wikipedia.org/wiki/' + name,
+        'title': name,
+        'introduction': 'مقدمه',
+        'content': [content],
+        'links': [],
+    }
+
+
+def test_update_actions_and_report(tmpdir, monkeypatch):
+    unchanged, edited, removed = [_get_page(name, 'متن')
+                                  for name in ['unchanged', 'edited',
+                                               'removed']]
+    indexed_content_hashes = {
+        get_document_id(page['page_link']): _get_content_hash(page)
+        for page in [unchanged, edited, removed]}
+    monkeypatch.setattr(index, '_get_indexed_content_hashes',
+                        lambda: dict(indexed_content_hashes))
+    monkeypatch.setattr(index, '_is_server_side_analysis', lambda: False)
+
+    pages_dir = str(tmpdir.join('pages'))
+    page_store = DirectoryPageStore(pages_dir)
+    for page_id, page in enumerate([unchanged, _get_page('edited', 'تازه'),
+                                    _get_page('new', 'متن')]):
+        page_store.write(page_id, page)
+    page_store.close()
+
+    report = Counter()
+    actions = list(index._get_update_actions(pages_dir, 1, report))
+    assert [(action['_op_type'], action['_id']) for action in actions] == [
+        ('index', get_document_id(edited['page_link'])),
+        ('index', get_document_id(_get_page('new', '')['page_link'])),
+        ('delete', get_document_id(removed['page_link'])),
+    ]
+    assert actions[0]['_source']['content'] == 'تازه'
+    assert actions[0]['_source']['analyzed_content'] == 'تازه'
+    assert report == {'added': 1, 'updated': 1, 'unchanged': 1,
+                      'deleted': 1}
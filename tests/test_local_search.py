@@ -0,0 +1,27 @@
+import os
+
+from documents import get_document_id
+from local_search import LocalIndex, build_local_index, update_clusters
+
+
+FIXTURE_PAGES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                 'fixtures', 'pages')
+
+
+def test_build_and_search(tmpdir):
+    index_dir = str(tmpdir.join('local_index'))
+    build_local_index(FIXTURE_PAGES_DIR, index_dir, workers=1)
+    local_index = LocalIndex(index_dir)
+    assert [document['title'] for document in local_index.documents] == \
+        ['تهران', 'حافظ', 'پایتون (زبان برنامه‌نویسی)', 'مؤلّفه‌های همبند']
+
+    hits = local_index.search('دیوان حافظ', 1, 1, 1, -1)
+    assert hits[0]['_source']['title'] == 'حافظ'
+    assert hits[0]['_id'] == get_document_id(
+        local_index.documents[1]['page_link'])
+    assert hits[0]['_source']['cluster.id'] == -1
+
+    update_clusters({hits[0]['_id']: 3}, index_dir)
+    build_local_index(FIXTURE_PAGES_DIR, index_dir, workers=1)
+    assert LocalIndex(index_dir).search('دیوان حافظ', 1, 1, 1, 3)[0][
+        '_source']['cluster.id'] == 3
@@ -0,0 +1,39 @@
+import os
+
+from page_store import SegmentPageStore, convert_page_store, \
+    open_page_store
+
+
+DOCUMENTS = [{
+    'page_link': 'https://fa.wikipedia.org/wiki/%d' % page_id,
+    'title': 'صفحه %d' % page_id,
+    'introduction': 'مقدمه',
+    'content': ['متن'] * page_id,
+    'links': [],
+} for page_id in range(5)]
+
+
+def _read_all(path):
+    page_store = open_page_store(path)
+    items = list(page_store.items())
+    page_store.close()
+    return items
+
+
+def test_segment_directory_segment_round_trip(tmpdir):
+    segment_path = str(tmpdir.join('segment'))
+    page_store = SegmentPageStore(segment_path)
+    for page_id, document in enumerate(DOCUMENTS):
+        page_store.write(page_id, document)
+    page_store.close()
+
+    directory_path = str(tmpdir.join('not', 'created', 'yet'))
+    convert_page_store(segment_path, directory_path, 'directory')
+    assert sorted(os.listdir(directory_path)) == \
+        ['%d.json' % page_id for page_id in range(len(DOCUMENTS))]
+    assert _read_all(directory_path) == list(enumerate(DOCUMENTS))
+
+    round_trip_path = str(tmpdir.join('round_trip'))
+    convert_page_store(directory_path, round_trip_path, 'segment')
+    assert SegmentPageStore.is_segment_store(round_trip_path)
+    assert _read_all(round_trip_path) == list(enumerate(DOCUMENTS))
@@ -0,0 +1,54 @@
+from search import _search_batch
+
+
+class _StandInClient():
+    """
+    answers _msearch with `num_hits[query]` hits per query, `size` at a time,
+    and an error for queries in `failing`
+    """
+
+    def __init__(self, num_hits, failing=()):
+        self.num_hits = num_hits
+        self.failing = failing
+        self.bodies = []
+
+    def msearch(self, body):
+        self.bodies.append(body)
+        responses = []
+        for search_body in body[1::2]:
+            query = search_body['query']['bool']['must'][0]['multi_match'][
+                'query']
+            if query in self.failing:
+                responses.append({'error': {'type': 'failure'}})
+                continue
+            start = search_body['search_after'][1] + 1 \
+                if 'search_after' in search_body else 0
+            end = min(start + search_body['size'], self.num_hits[query])
+            responses.append({'took': 1, 'hits': {'hits': [{
+                '_id': '%s%d' % (query, number),
+                '_score': 1.0 / (number + 1),
+                '_source': {'page_link': 'link', 'title': 'title'},
+                'sort': [1.0 / (number + 1), number],
+            } for number in range(start, end)]}})
+        return {'responses': responses}
+
+
+def test_pages_until_a_short_page_and_records_errors():
+    client = _StandInClient({'a': 5, 'b': 2, 'c': 4}, failing=['d'])
+    results = _search_batch(['a', 'b', 'c', 'd'], 1, 1, 1, -1, 2, 10,
+                            client=client)
+
+    assert [[hit['id'] for hit in result['hits']] for result in results] == \
+        [['a0', 'a1', 'a2', 'a3', 'a4'], ['b0', 'b1'],
+         ['c0', 'c1', 'c2', 'c3'], []]
+    assert results[0]['hits'][4]['score'] == 0.2
+    assert results[3]['error'] == {'type': 'failure'}
+    assert all('search_after' not in result for result in results)
+
+    # b's page is full, so it is asked again and gets an empty page
+    pages = [[search_body['query']['bool']['must'][0]['multi_match'][
+        'query'] for search_body in body[1::2]] for body in client.bodies]
+    assert pages == [['a', 'b', 'c', 'd'], ['a', 'b', 'c'], ['a', 'c']]
+    assert client.bodies[1][1]['search_after'] == [0.5, 1]
+    assert all(search_body['track_scores'] for body in client.bodies
+               for search_body in body[1::2])
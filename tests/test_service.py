@@ -0,0 +1,66 @@
+import asyncio
+
+from service import SearchService
+
+
+class _StandInClient():
+    def __init__(self):
+        self.generation_reads = 0
+        self.searches = 0
+
+    def get(self, index, doc_type, id):
+        self.generation_reads += 1
+        return {'_source': {'content': 1, 'cluster': 1}}
+
+    def search(self, index, body):
+        self.searches += 1
+        return {'took': 1, 'hits': {'total': 1, 'hits': [{
+            '_id': 'id',
+            '_score': 1.0,
+            '_source': {'page_link': 'link', 'title': 'title',
+                        'cluster.id': 0},
+        }]}}
+
+
+def test_cache_reads_the_generation_through_the_service_client():
+    client = _StandInClient()
+    service = SearchService(client=client, workers=1, cache_size=10)
+    for _ in range(2):
+        status, result = asyncio.get_event_loop().run_until_complete(
+            service._route('GET', '/search?q=x'))
+        assert status == 200
+        assert result['hits'][0]['id'] == 'id'
+    assert client.generation_reads == 1
+    assert client.searches == 1
+    assert service.cache.stats()['hits'] == 1
+
+
+class _FailingClient(_StandInClient):
+    def search(self, index, body):
+        raise RuntimeError('not a transport error')
+
+
+class _StandInWriter():
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_unexpected_error_is_a_500():
+    service = SearchService(client=_FailingClient(), workers=1)
+    loop = asyncio.get_event_loop()
+    reader = asyncio.StreamReader(loop=loop)
+    reader.feed_data(b'GET /search?q=x HTTP/1.1\r\nConnection: close\r\n\r\n')
+    reader.feed_eof()
+    writer = _StandInWriter()
+    loop.run_until_complete(service.handle_connection(reader, writer))
+    assert writer.data.startswith(b'HTTP/1.1 500 Internal Server Error\r\n')
+    assert writer.data.endswith(b'{"error": "internal server error"}')
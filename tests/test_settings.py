@@ -0,0 +1,18 @@
+import pytest
+
+import settings
+
+
+@pytest.mark.parametrize('module_name, registry_name, names_name', [
+    ('index', 'MAPPING_PROFILES', 'MAPPING_PROFILE_NAMES'),
+    ('cluster', 'K_SELECTION_STRATEGIES', 'K_SELECTION_STRATEGY_NAMES'),
+    ('cluster', 'K_MEANS_ESTIMATORS', 'K_MEANS_ESTIMATOR_NAMES'),
+    ('cluster', 'REDUCTIONS', 'REDUCTION_NAMES'),
+    ('cluster', 'CLUSTER_WRITE_BACKS', 'CLUSTER_WRITE_BACK_NAMES'),
+])
+def test_names_are_the_registry_keys(module_name, registry_name, names_name):
+    # cli.py offers the names without importing the heavy modules
+    module = pytest.importorskip(module_name)
+    names = getattr(settings, names_name)
+    assert len(names) == len(set(names))
+    assert set(names) == set(getattr(module, registry_name))